@@ -0,0 +1,78 @@
+"""Memory ConnectionManager holds per idle socket.
+
+    python benchmarks/connection_memory.py [--connections 50000]
+
+Connects that many distinct users to one manager with bare fake sockets and
+reports what tracemalloc sees the manager allocate for them: the registry and
+connection records only, not the server's socket and protocol objects, which
+CONNECTION_MEMORY estimates separately. Then sends each user one message and
+checks that the memory used to write it is given back once it is written.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.services import ConnectionManager
+from src.services.manager import CONNECTION_MEMORY, MAX_CONNECTIONS
+
+
+class Socket:
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, text):
+        pass
+
+    async def close(self, code=1000):
+        pass
+
+
+class NoBackplane:
+    async def start(self, deliver):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, sender, recipient, message, node=None, echo=False):
+        pass
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--connections", type=int, default=50000)
+    args = parser.parse_args()
+    count = args.connections
+
+    manager = ConnectionManager(max_connections=count, backplane=NoBackplane())
+    sockets = [Socket() for _ in range(count)]
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+
+    start = time.perf_counter()
+    for i, websocket in enumerate(sockets):
+        await manager.connect(websocket, f"{i:040X}")
+    elapsed = time.perf_counter() - start
+    idle = tracemalloc.get_traced_memory()[0] - base
+
+    for i in range(count):
+        await manager.send_personal_message('{"m": 1}', "sender", f"{i:040X}")
+    await asyncio.gather(*(c.flushed() for c in manager._connections()))
+    drained = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    await manager.stop()
+
+    print(f"connections        {count:>10}")
+    print(f"connect rate       {count / elapsed:>10.0f} /s")
+    print(f"idle, per socket   {idle / count:>10.0f} B (manager only)")
+    print(f"after one message  {drained / count:>10.0f} B")
+    print(f"default cap        {MAX_CONNECTIONS:>10} at {CONNECTION_MEMORY} B/socket")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+"""Messages/sec through ConnectionManager as users hold more devices.
+
+    python benchmarks/fanout_throughput.py [--messages 20000]
+
+Sender and recipient each hold the same number of fake sockets on one manager.
+Every message is routed with send_personal_message, so it is queued for each of
+the recipient's devices and echoed to each of the sender's, then the writer
+tasks drain the queues. The rate counts messages, not socket writes.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.services import ConnectionManager
+
+SENDER = "497472E4EADD6B41F735D437F8FC9A8BDC9CF796"
+RECIPIENT = "DEADBEEFDEADBEEFDEADBEEFDEADBEEFDEADBEEF"
+MESSAGE = (
+    '{"type":"encrypted_text","target_user":"%s",'
+    '"content":{"iv":[0,1,2,3,4,5,6,7,8,9,10,11],"ciphertext":[%s]}}'
+    % (RECIPIENT, ",".join(["200"] * 256))
+)
+
+
+class Socket:
+    def __init__(self):
+        self.written = 0
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, text):
+        self.written += 1
+
+    async def close(self, code=1000):
+        pass
+
+
+class NoBackplane:
+    async def start(self, deliver):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, sender, recipient, message, node=None, echo=False):
+        pass
+
+
+async def rate(devices, count):
+    manager = ConnectionManager(max_devices=devices, backplane=NoBackplane())
+    manager.send_queue_size = 0  # Unbounded; the sockets never stall.
+    sockets = []
+    for user_id in (SENDER, RECIPIENT):
+        for _ in range(devices):
+            sockets.append(Socket())
+            await manager.connect(sockets[-1], user_id)
+
+    start = time.perf_counter()
+    for _ in range(count):
+        await manager.send_personal_message(MESSAGE, SENDER, RECIPIENT)
+    await asyncio.gather(*(c.flushed() for c in manager._connections()))
+    elapsed = time.perf_counter() - start
+
+    await manager.stop()
+    assert all(s.written == count for s in sockets)
+    return count / elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'devices':>8}{'messages/sec':>14}{'writes/sec':>12}")
+    for devices in (1, 2, 8):
+        await rate(devices, 500)  # Warm up.
+        messages = await rate(devices, args.messages)
+        print(f"{devices:>8}{messages:>14.0f}{messages * devices * 2:>12.0f}")
+    print("(each user holding that many devices, one core)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,124 @@
+"""Frames/sec through the chat WebSocket receive -> validate -> route pipeline.
+
+    python benchmarks/frame_throughput.py [--frames 20000]
+
+Drives the real websocket_endpoint in-process with fake sockets: one user sends
+a stream of frames to another, and each is decoded, checked, routed through the
+ConnectionManager and written to both sockets. Run with the stdlib decoder and,
+if it is installed, orjson. Each encrypted message is also sent in the binary
+framing, which needs no JSON decoding at all.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from unittest.mock import patch
+
+from fastapi import WebSocketDisconnect
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.routes import chat
+from src.services import BINARY_SUBPROTOCOL, codec, sign_user_id
+
+SENDER = "497472E4EADD6B41F735D437F8FC9A8BDC9CF796"
+RECIPIENT = "DEADBEEFDEADBEEFDEADBEEFDEADBEEFDEADBEEF"
+
+
+class Socket:
+    def __init__(self, user_id, frames=()):
+        self.headers = {}
+        self.cookies = {"user_id": sign_user_id(user_id)}
+        self.scope = {"subprotocols": [BINARY_SUBPROTOCOL]}
+        self.frames = iter(frames)
+        self.written = 0
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def receive(self):
+        # A real receive always suspends; let the writer tasks run.
+        await asyncio.sleep(0)
+        try:
+            raw = next(self.frames)
+        except StopIteration:
+            raise WebSocketDisconnect()
+        if isinstance(raw, bytes):
+            return {"type": "websocket.receive", "bytes": raw}
+        return {"type": "websocket.receive", "text": raw}
+
+    async def send_text(self, text):
+        self.written += 1
+
+    async def send_bytes(self, data):
+        self.written += 1
+
+    async def close(self, code=1000):
+        raise RuntimeError(f"closed with {code}")
+
+
+def frames():
+    """A key exchange and encrypted messages as conversation.js sends them."""
+    key = {
+        "type": "key_exchange",
+        "target_user": RECIPIENT,
+        "publicKey": {"crv": "P-256", "ext": True, "kty": "EC", "x": "A" * 43},
+    }
+    cases = {"key_exchange": json.dumps(key)}
+    for size in (64, 1024, 8192):
+        message = {
+            "type": "encrypted_text",
+            "target_user": RECIPIENT,
+            "content": {"iv": list(range(12)), "ciphertext": [200] * size},
+        }
+        cases[f"text {size}B"] = json.dumps(message)
+        cases[f"text {size}B bin"] = (
+            bytes((codec.BINARY_ENCRYPTED_TEXT,))
+            + bytes.fromhex(RECIPIENT)
+            + bytes((12,))
+            + bytes(range(12))
+            + bytes([200] * size)
+        )
+    return cases
+
+
+async def rate(raw, count):
+    recipient = Socket(RECIPIENT)
+    await chat.manager.connect(recipient, RECIPIENT, subprotocol=BINARY_SUBPROTOCOL)
+    sender = Socket(SENDER, [raw] * count)
+    start = time.perf_counter()
+    await chat.websocket_endpoint(sender)
+    await chat.manager.active_connections[RECIPIENT][0].flushed()
+    elapsed = time.perf_counter() - start
+    chat.manager.disconnect(RECIPIENT)
+    assert recipient.written == count, recipient.written
+    return count / elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=20000)
+    args = parser.parse_args()
+
+    backends = {"json": json.loads}
+    if codec.orjson is not None:
+        backends["orjson"] = codec.orjson.loads
+
+    print(f"{'frame':<16}{'bytes':>8}" + "".join(f"{name:>12}" for name in backends))
+    for label, raw in frames().items():
+        rates = []
+        for loads in backends.values():
+            with patch.object(codec, "_loads", loads):
+                await rate(raw, 500)  # Warm up.
+                rates.append(await rate(raw, args.frames))
+        print(f"{label:<16}{len(raw):>8}" + "".join(f"{r:>12.0f}" for r in rates))
+    print("(frames/sec, one core)")
+
+
+if __name__ == "__main__":
+    # The per-connection flood limit would cut the sender off.
+    chat.MAX_MSGS = float("inf")
+    chat.manager.send_queue_size = 0  # Unbounded; the socket never stalls.
+    asyncio.run(main())
@@ -0,0 +1,120 @@
+"""Requests/sec through the security middleware, before and after going ASGI.
+
+    python benchmarks/middleware_throughput.py [--requests 20000]
+
+Drives a minimal FastAPI app in-process (no server or sockets, so only the
+middleware and framework cost is measured) with the previous
+``@app.middleware("http")`` implementation and with SecurityMiddleware.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.middleware import MAX_BODY_BYTES, SECURITY_HEADERS, SecurityMiddleware
+
+
+def routes(app):
+    @app.get("/")
+    async def index():
+        return PlainTextResponse("ok")
+
+    @app.post("/echo")
+    async def echo(request: Request):
+        return PlainTextResponse(str(len(await request.body())))
+
+    return app
+
+
+def before():
+    """The function middleware this replaced, as it was."""
+    app = FastAPI()
+
+    @app.middleware("http")
+    async def security_middleware(request: Request, call_next):
+        content_length = request.headers.get("content-length")
+        if content_length is not None:
+            try:
+                too_large = int(content_length) > MAX_BODY_BYTES
+            except ValueError:
+                return PlainTextResponse("Bad Request", status_code=400)
+            if too_large:
+                return PlainTextResponse("Payload too large", status_code=413)
+
+        response = await call_next(request)
+        for header, value in SECURITY_HEADERS.items():
+            response.headers[header] = value
+        return response
+
+    return routes(app)
+
+
+def after():
+    app = FastAPI()
+    app.add_middleware(SecurityMiddleware)
+    return routes(app)
+
+
+def scope_for(method, path, headers):
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": headers,
+        "client": ("127.0.0.1", 1234),
+        "server": ("bench", 80),
+    }
+
+
+async def rate(app, method, path, body, requests):
+    headers = [(b"content-length", str(len(body)).encode())] if body else []
+    scope = scope_for(method, path, headers)
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+        async def receive():
+            return messages.pop() if messages else {"type": "http.disconnect"}
+
+        await app(scope, receive, send)
+    return requests / (time.perf_counter() - start)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    cases = {
+        "GET /": ("GET", "/", b""),
+        "POST /echo 4KB": ("POST", "/echo", b"x" * 4096),
+    }
+    apps = {"before": before(), "after": after()}
+    print(f"{'request':<16}" + "".join(f"{name:>12}" for name in apps))
+    for label, (method, path, body) in cases.items():
+        rates = []
+        for app in apps.values():
+            await rate(app, method, path, body, 500)  # Warm up.
+            rates.append(await rate(app, method, path, body, args.requests))
+        print(f"{label:<16}" + "".join(f"{r:>12.0f}" for r in rates))
+    print("(requests/sec, one core)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
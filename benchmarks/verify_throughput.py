@@ -0,0 +1,83 @@
+"""Logins/sec per core for each verify_login backend.
+
+    python benchmarks/verify_throughput.py [--seconds 2]
+
+Runs verify_login back to back in this one process (a verification worker is
+one process on one core) for a good login with several key types, comparing
+pgpy with the key cache off, pgpy with a warm key cache, and the fast path.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+import warnings
+from unittest.mock import patch
+
+import pgpy
+from pgpy.constants import EllipticCurveOID, HashAlgorithm, KeyFlags, PubKeyAlgorithm
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.services import pgp_verifier
+from src.services.key_cache import KeyCache
+
+CHALLENGE = "Verification Challenge: 6f1c2d4e-8a0b-4c5d-9e7f-0123456789ab"
+
+KEYS = {
+    "rsa2048": (PubKeyAlgorithm.RSAEncryptOrSign, 2048),
+    "rsa4096": (PubKeyAlgorithm.RSAEncryptOrSign, 4096),
+    "ed25519": (PubKeyAlgorithm.EdDSA, EllipticCurveOID.Ed25519),
+    "p256": (PubKeyAlgorithm.ECDSA, EllipticCurveOID.NIST_P256),
+}
+
+BACKENDS = {
+    "pgpy": dict(fast=False, cache=False),
+    "pgpy+cache": dict(fast=False, cache=True),
+    "fast": dict(fast=True, cache=False),
+}
+
+
+def login_for(algorithm, size):
+    key = pgpy.PGPKey.new(algorithm, size)
+    key.add_uid(
+        pgpy.PGPUID.new("Bench"), usage={KeyFlags.Sign}, hashes=[HashAlgorithm.SHA256]
+    )
+    message = pgpy.PGPMessage.new(CHALLENGE, cleartext=True)
+    message |= key.sign(message)
+    return str(key.pubkey), str(message)
+
+
+def rate(public_key, clearsigned, seconds, fast, cache):
+    key_cache = KeyCache(1024 if cache else 0, 600)
+    with (
+        patch.object(pgp_verifier, "FAST_PATH", fast),
+        patch.object(pgp_verifier, "key_cache", key_cache),
+    ):
+        assert pgp_verifier.verify_login(public_key, clearsigned, CHALLENGE)[0]
+        done = 0
+        start = time.perf_counter()
+        while (elapsed := time.perf_counter() - start) < seconds:
+            pgp_verifier.verify_login(public_key, clearsigned, CHALLENGE)
+            done += 1
+    return done / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    warnings.simplefilter("ignore")
+
+    print(f"{'key':<10}" + "".join(f"{name:>14}" for name in BACKENDS))
+    for name, (algorithm, size) in KEYS.items():
+        login = login_for(algorithm, size)
+        rates = [rate(*login, args.seconds, **opts) for opts in BACKENDS.values()]
+        print(f"{name:<10}" + "".join(f"{r:>14.0f}" for r in rates))
+    print("(logins/sec, one core)")
+
+
+if __name__ == "__main__":
+    main()
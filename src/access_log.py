@@ -0,0 +1,218 @@
+import asyncio
+import bisect
+import logging
+import math
+import random
+import time
+
+from .env import ACCESS_LOG_INTERVAL, ACCESS_LOG_SAMPLE_RATES
+
+logger = logging.getLogger(__name__)
+
+# Same layout as Uvicorn's access lines, so sampled lines read (and are masked)
+# like the ones they replace.
+ACCESS_FORMAT = '%s - "%s %s HTTP/%s" %d'
+
+# Latencies are counted in fixed buckets growing 10% at a time, from 0.1 ms up
+# to about two minutes, so a route's summary costs the same memory however many
+# requests it served. Percentiles are reported as their bucket's upper bound:
+# at most 10% high.
+LATENCY_BUCKETS = tuple(0.0001 * 1.1**i for i in range(150))
+
+# Requests that never reached a route: 404s, and the ones SecurityMiddleware
+# turns away itself.
+UNMATCHED = "unmatched"
+
+
+def parse_sample_rates(text: str) -> dict:
+    """Parse "route=rate,..." (e.g. "*=0.01,/static=0") into {route: rate}."""
+    rates = {}
+    for item in text.split(","):
+        if not item.strip():
+            continue
+        route, sep, rate = item.rpartition("=")
+        if not sep or not route.strip():
+            raise ValueError(f"Expected route=rate, got {item.strip()!r}")
+        rate = float(rate)
+        if not 0 <= rate <= 1:
+            raise ValueError(f"Sample rate for {route.strip()} must be 0..1")
+        rates[route.strip()] = rate
+    return rates
+
+
+def always_logged(status: int) -> bool:
+    """Server errors and authentication failures get a full line every time."""
+    return status >= 500 or status in (401, 403)
+
+
+class _RouteStats:
+    __slots__ = ("requests", "sampled", "statuses", "buckets")
+
+    def __init__(self):
+        self.requests = 0
+        self.sampled = 0
+        self.statuses = {}
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def percentile(self, q: float) -> float:
+        rank = max(1, math.ceil(q * self.requests))
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                break
+        return LATENCY_BUCKETS[min(i, len(LATENCY_BUCKETS) - 1)]
+
+
+class AccessLog:
+    """Per-route access counts, logged as one summary line per route every
+    ``interval`` seconds instead of a line per request.
+
+    Each route also logs a full line for a ``sample_rates[route]`` fraction of
+    its requests ("*" covers routes not listed), and for every request that
+    ``always_logged`` picks out.
+    """
+
+    def __init__(
+        self, interval: float = ACCESS_LOG_INTERVAL, sample_rates: dict = None
+    ):
+        self.interval = interval
+        self.sample_rates = (
+            parse_sample_rates(ACCESS_LOG_SAMPLE_RATES)
+            if sample_rates is None
+            else dict(sample_rates)
+        )
+        self._default_rate = self.sample_rates.get("*", 0.0)
+        self._stats = {}
+        self._since = time.monotonic()
+        self._task = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._report())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.flush()
+
+    def record(self, route: str, status: int, seconds: float) -> bool:
+        """Count one request; return whether it should also be logged in full."""
+        stats = self._stats.get(route)
+        if stats is None:
+            stats = self._stats[route] = _RouteStats()
+        stats.requests += 1
+        stats.statuses[status] = stats.statuses.get(status, 0) + 1
+        stats.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+        if always_logged(status):
+            return True
+        rate = self.sample_rates.get(route, self._default_rate)
+        if rate and (rate >= 1 or random.random() < rate):
+            stats.sampled += 1
+            return True
+        return False
+
+    def flush(self):
+        """Log a summary line per route seen since the last flush, and reset."""
+        stats, self._stats = self._stats, {}
+        now = time.monotonic()
+        interval, self._since = now - self._since, now
+        for route, route_stats in sorted(stats.items()):
+            logger.info(
+                "Access summary",
+                extra={
+                    "route": route,
+                    "interval": round(interval, 1),
+                    "requests": route_stats.requests,
+                    "sampled": route_stats.sampled,
+                    "statuses": {
+                        str(status): count
+                        for status, count in sorted(route_stats.statuses.items())
+                    },
+                    "p50_ms": round(route_stats.percentile(0.5) * 1000, 1),
+                    "p99_ms": round(route_stats.percentile(0.99) * 1000, 1),
+                },
+            )
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Access summary failed")
+
+
+def _route(scope, root_path: str) -> str:
+    # The route template ("/chat/{recipient_id}"), not the path, keeps one
+    # summary per endpoint and fingerprints out of the summaries. The router
+    # leaves it in the scope on its way through.
+    route = scope.get("route")
+    if route is not None:
+        return getattr(route, "path", UNMATCHED)
+    # A mount (the static files) only extends root_path.
+    mounted = scope.get("root_path", root_path)
+    if mounted != root_path:
+        return mounted[len(root_path) :]
+    return UNMATCHED
+
+
+class AccessLogMiddleware:
+    """Time every HTTP request and hand it to an AccessLog.
+
+    Meant to be outermost, so the time and status are what the client saw,
+    including responses the other middleware answers on its own. A request the
+    app fails on is counted, and logged, as a 500.
+    """
+
+    def __init__(self, app, access_log: AccessLog):
+        self.app = app
+        self.access_log = access_log
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        root_path = scope.get("root_path", "")
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception:
+            status = 500
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            route = _route(scope, root_path)
+            if self.access_log.record(route, status, seconds):
+                self._log(scope, route, status, seconds)
+
+    @staticmethod
+    def _log(scope, route, status, seconds):
+        client = scope.get("client")
+        path = scope["path"]
+        if scope.get("query_string"):
+            path += "?" + scope["query_string"].decode("ascii", "replace")
+        logger.info(
+            ACCESS_FORMAT,
+            f"{client[0]}:{client[1]}" if client else "-",
+            scope["method"],
+            path,
+            scope.get("http_version", "1.1"),
+            status,
+            extra={"route": route, "duration_ms": round(seconds * 1000, 1)},
+        )
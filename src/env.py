@@ -3,12 +3,32 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-CHALLENGE_LIFETIME = os.getenv("CHALLENGE_LIFETIME")
+# How long a login challenge stays valid, in seconds. Challenges are signed
+# tokens carrying their own expiry, so this is checked from the token itself.
+CHALLENGE_LIFETIME = int(os.getenv("CHALLENGE_LIFETIME", "300"))
 REDIS_HOST = os.getenv("REDIS_HOST")
 REDIS_PORT = os.getenv("REDIS_PORT")
 REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
+
+# Most Redis connections one worker may hold at once, shared by every router
+# (plus one long-lived pub/sub connection when BACKPLANE=redis).
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
 SECRET_KEY = os.getenv("SECRET_KEY")
 
+# How ConnectionManager reaches users held by other processes. "local" (default)
+# keeps everything in-process, which is only correct with a single worker.
+# "redis" relays messages over Redis pub/sub so several Uvicorn workers, or
+# several hosts, can share the chat.
+BACKPLANE = os.getenv("BACKPLANE", "local").strip().lower()
+
+# Most chat WebSockets one worker holds at once. The effective cap is lower if
+# that many wouldn't fit in CHAT_MEMORY_BUDGET MiB, at roughly 32 KiB a socket
+# (0 disables the budget). Keep the budget within the worker's memory limit;
+# holding tens of thousands of sockets also needs the open-file limit and
+# Uvicorn's --limit-concurrency raised to match.
+CHAT_MAX_CONNECTIONS = int(os.getenv("CHAT_MAX_CONNECTIONS", "50000"))
+CHAT_MEMORY_BUDGET = int(os.getenv("CHAT_MEMORY_BUDGET", "256"))
+
 # Deployment environment. "production" makes config validation strict (e.g.
 # refusing to start without a strong SECRET_KEY). Anything else is treated as
 # development/test, where weak-config fallbacks are allowed for convenience.
@@ -18,6 +38,59 @@ ENVIRONMENT = os.getenv("ENVIRONMENT", "development").strip().lower()
 # a leaked cookie expires on its own even without server-side revocation.
 SESSION_LIFETIME = int(os.getenv("SESSION_LIFETIME", str(12 * 60 * 60)))
 
+# PGP login verification runs on dedicated worker processes (per Uvicorn
+# worker). VERIFY_WORKERS is how many, i.e. how many logins verify at once.
+# Clearnet and onion logins queue separately and take turns at free workers;
+# in each, at most VERIFY_MAX_PENDING logins may be queued or running before
+# /login sheds with 503, as it does for a login that waited VERIFY_QUEUE_TIMEOUT
+# seconds without reaching a worker. A verification still running after
+# VERIFY_TIMEOUT seconds fails and its worker is killed and replaced.
+VERIFY_WORKERS = int(os.getenv("VERIFY_WORKERS", "2"))
+VERIFY_MAX_PENDING = int(os.getenv("VERIFY_MAX_PENDING", "32"))
+VERIFY_QUEUE_TIMEOUT = float(os.getenv("VERIFY_QUEUE_TIMEOUT", "3"))
+VERIFY_TIMEOUT = float(os.getenv("VERIFY_TIMEOUT", "5"))
+
+# "fast" (default) checks Ed25519, ECDSA and RSA login signatures with the
+# cryptography primitives directly and hands anything else -- or anything it
+# can't vouch for -- to pgpy. "pgpy" always uses pgpy.
+VERIFY_BACKEND = os.getenv("VERIFY_BACKEND", "fast").strip().lower()
+
+# Decoder for chat WebSocket frames: orjson when it is installed (the default),
+# or "json" to force the standard library's.
+FRAME_CODEC = os.getenv("FRAME_CODEC", "orjson").strip().lower()
+
+# How long, in seconds, /login remembers that a (key, signature, challenge)
+# failed verification, so resubmitting the same bad login costs nothing. The
+# challenge is part of it, so a corrected attempt is never held back. 0 disables.
+LOGIN_FAILURE_TTL = float(os.getenv("LOGIN_FAILURE_TTL", "10"))
+
+# Each verification worker keeps up to KEY_CACHE_SIZE recently parsed public
+# keys for KEY_CACHE_TTL seconds, so returning users don't pay for re-parsing
+# their key on every login. 0 disables the cache.
+KEY_CACHE_SIZE = int(os.getenv("KEY_CACHE_SIZE", "1024"))
+KEY_CACHE_TTL = float(os.getenv("KEY_CACHE_TTL", "600"))
+
+# An extra regular expression for log masking, on top of fingerprints, challenge
+# nonces and cookie signatures (see MASK_PATTERNS in src/logger). Anything it
+# matches in a log message is replaced with [MASKED]; use | for several.
+LOG_MASK_PATTERN = os.getenv("LOG_MASK_PATTERN", "")
+
+# Access logging. "full" (the default) is Uvicorn's line per request. "sampled"
+# replaces those with one summary line per route every ACCESS_LOG_INTERVAL
+# seconds -- request count, status counts, p50/p99 latency -- plus a full line
+# for a sample of requests at the rates in ACCESS_LOG_SAMPLE_RATES: a comma-
+# separated list of route=rate, with routes written as declared (e.g.
+# "/chat/{recipient_id}") and "*" for any route not listed. Server errors and
+# authentication failures (401/403) are always logged in full.
+ACCESS_LOG = os.getenv("ACCESS_LOG", "full").strip().lower()
+ACCESS_LOG_INTERVAL = float(os.getenv("ACCESS_LOG_INTERVAL", "60"))
+ACCESS_LOG_SAMPLE_RATES = os.getenv("ACCESS_LOG_SAMPLE_RATES", "*=0.01,/static=0")
+
+# Every STATS_INTERVAL seconds each worker logs a "Stats" line per component:
+# the public-key cache's hits and misses, and the chat sockets' outbound queue
+# depths, write latency and evictions. 0 turns it off.
+STATS_INTERVAL = float(os.getenv("STATS_INTERVAL", "60"))
+
 # Version of the running build, shown in the page footer. CI sets this from
 # `git describe --tags --always` at deploy time; "dev" is the local fallback.
 APP_VERSION = os.getenv("APP_VERSION", "dev")
@@ -1,20 +1,82 @@
+import copy
 import logging
-import regex as re
+import queue
+from logging.handlers import QueueHandler, QueueListener
+import re
 from pythonjsonlogger import json
 from datetime import datetime, timezone
 
+from ..env import ACCESS_LOG, LOG_MASK_PATTERN
+
+# Records are not formatted or written on the thread that logs them (the event
+# loop, for nearly everything): the handler only queues them, and a background
+# thread formats whatever has queued up, up to LOG_BATCH_SIZE at a time, and
+# writes it to stdout in one go. At most LOG_QUEUE_SIZE records may be waiting;
+# past that, new ones are dropped and counted rather than stalling the caller,
+# and the count is logged once the backlog clears.
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 256
+
+
+# Masked wherever they appear in a log message: PGP fingerprints and key ids
+# (long runs of upper-case hex, which also catches most other long tokens), and
+# the challenge nonces (UUIDs) and session-cookie HMACs (long lower-case hex)
+# that would let someone holding the logs tie a line to a login or a session.
+MASK_PATTERNS = (
+    r"[A-Z0-9]{20,}",
+    r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}",
+    r"[0-9a-f]{32,}",
+)
+# No MASK_PATTERNS match is shorter than this, so shorter strings aren't scanned.
+MASK_MIN_LENGTH = 20
+
 
 class MaskingFilter(logging.Filter):
+    """Replace whatever matches ``patterns`` in a record's message and string
+    arguments with [MASKED].
+
+    The patterns are compiled once, into a single alternation. Strings shorter
+    than ``min_length`` -- most arguments, such as methods, addresses and
+    status codes -- are passed over without being scanned, and the masked form
+    of each message template (e.g. the Uvicorn access-log format) is kept, so
+    a template is only scanned the first time it is seen.
+    """
+
+    _MAX_TEMPLATES = 256
+
+    def __init__(self, patterns=MASK_PATTERNS, min_length: int = MASK_MIN_LENGTH):
+        super().__init__()
+        self.pattern = re.compile("|".join(f"(?:{p})" for p in patterns))
+        self.min_length = min_length
+        self._templates = {}
+
+    def mask(self, text: str) -> str:
+        if len(text) < self.min_length:
+            return text
+        return self.pattern.sub("[MASKED]", text)
+
     def filter(self, record: logging.LogRecord) -> bool:
-        pattern = r"[A-Z0-9]{20,}"
-        if isinstance(record.msg, str):
-            record.msg = re.sub(pattern, "[MASKED]", record.msg)
-        if record.args:
-            new_args = list(record.args)
-            for i, arg in enumerate(new_args):
-                if isinstance(arg, str):
-                    new_args[i] = re.sub(pattern, "[MASKED]", arg)
-            record.args = tuple(new_args)
+        msg = record.msg
+        if isinstance(msg, str):
+            if not record.args:
+                record.msg = self.mask(msg)
+            else:
+                masked = self._templates.get(msg)
+                if masked is None:
+                    if len(self._templates) >= self._MAX_TEMPLATES:
+                        self._templates.clear()
+                    masked = self._templates[msg] = self.mask(msg)
+                record.msg = masked
+        args = record.args
+        if isinstance(args, tuple):
+            masked = tuple(self.mask(a) if isinstance(a, str) else a for a in args)
+            if masked != args:
+                record.args = masked
+        elif isinstance(args, dict):
+            # log.info("%(name)s", {"name": ...}) keeps the mapping as args.
+            record.args = {
+                k: self.mask(v) if isinstance(v, str) else v for k, v in args.items()
+            }
         return True
 
 
@@ -27,6 +89,129 @@ class CustomJsonFormatter(json.JsonFormatter):
         log_record["level"] = record.levelname
 
 
+class BatchStreamHandler(logging.StreamHandler):
+    """A StreamHandler that can also write a batch of records at once."""
+
+    def emit_batch(self, records):
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.format(record) + self.terminator)
+            except Exception:
+                self.handleError(record)
+        try:
+            self.stream.write("".join(lines))
+            self.flush()
+        except Exception:
+            self.handleError(records[0])
+
+
+class BatchingQueueListener(QueueListener):
+    """A QueueListener that hands its handler everything queued at once."""
+
+    def __init__(self, queue, handler, batch_size: int, dropped=None):
+        super().__init__(queue, handler)
+        self.batch_size = batch_size
+        # Returns (and resets) how many records were dropped since last asked.
+        self.dropped = dropped or (lambda: 0)
+
+    def enqueue_sentinel(self):
+        # Blocking: the queue may be full, but the listener is draining it.
+        self.queue.put(self._sentinel)
+
+    def _monitor(self):
+        handler = self.handlers[0]
+        while True:
+            batch = [self.dequeue(True)]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.dequeue(False))
+                except queue.Empty:
+                    break
+            stopping = self._sentinel in batch
+            records = [r for r in batch if r is not self._sentinel]
+            dropped = self.dropped()
+            if dropped:
+                records.append(_dropped_record(dropped))
+            if records:
+                handler.emit_batch(records)
+            for _ in batch:
+                self.queue.task_done()
+            if stopping:
+                return
+
+
+def _dropped_record(count: int) -> logging.LogRecord:
+    return logging.LogRecord(
+        __name__,
+        logging.WARNING,
+        __file__,
+        0,
+        f"Dropped {count} log records: the log queue was full",
+        None,
+        None,
+    )
+
+
+class BackgroundHandler(QueueHandler):
+    """Queue records for a background thread to format and write to ``stream``.
+
+    Filters run here, on the logging thread, before the record is queued.
+    """
+
+    def __init__(
+        self,
+        stream=None,
+        queue_size: int = LOG_QUEUE_SIZE,
+        batch_size: int = LOG_BATCH_SIZE,
+    ):
+        super().__init__(queue.Queue(queue_size))
+        self.dropped = 0
+        self.target = BatchStreamHandler(stream)
+        self.listener = BatchingQueueListener(
+            self.queue, self.target, batch_size, self._take_dropped
+        )
+        self.listener.start()
+
+    def setFormatter(self, fmt):
+        # Records are formatted on the listener thread, by the target.
+        self.target.setFormatter(fmt)
+
+    def _take_dropped(self) -> int:
+        # Read and reset from the listener thread while emit() may be counting
+        # on another; an increment landing in between is reported next time.
+        count, self.dropped = self.dropped, 0
+        return count
+
+    def prepare(self, record):
+        # Resolve the message while its arguments are as they were, but leave
+        # the JSON formatting (and any traceback) to the listener thread.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        if self.listener is None:
+            # Closed, so nothing would drain the queue; write synchronously.
+            self.target.handle(record)
+        else:
+            super().emit(record)
+
+    def close(self):
+        # Called by logging.shutdown() at exit: write out what is queued.
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        super().close()
+
+
 LOGGING_CONFIG = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -38,11 +223,18 @@ LOGGING_CONFIG = {
     "filters": {
         "masking": {
             "()": MaskingFilter,
+            "patterns": (
+                [*MASK_PATTERNS, LOG_MASK_PATTERN]
+                if LOG_MASK_PATTERN
+                else MASK_PATTERNS
+            ),
+            # An extra pattern's shortest match is unknown; scan everything.
+            "min_length": 1 if LOG_MASK_PATTERN else MASK_MIN_LENGTH,
         }
     },
     "handlers": {
         "console": {
-            "class": "logging.StreamHandler",
+            "()": BackgroundHandler,
             "stream": "ext://sys.stdout",
             "formatter": "json",
             "filters": ["masking"],
@@ -52,7 +244,8 @@ LOGGING_CONFIG = {
         "uvicorn": {"handlers": ["console"], "level": "INFO", "propagate": False},
         "uvicorn.access": {
             "handlers": ["console"],
-            "level": "INFO",
+            # Sampled mode logs requests from src/access_log instead.
+            "level": "WARNING" if ACCESS_LOG == "sampled" else "INFO",
             "propagate": False,
         },
         "": {"handlers": ["console"], "level": "INFO"},
@@ -0,0 +1,69 @@
+from fastapi import FastAPI
+from fastapi.responses import FileResponse
+from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager
+import logging.config
+from .access_log import AccessLog, AccessLogMiddleware
+from .env import ACCESS_LOG, FRAME_CODEC
+from .logger import LOGGING_CONFIG
+from .middleware import SecurityMiddleware
+from .redis_client import redis_client
+from .routes import auth, chat
+from .services import load_scripts
+from .services.codec import BACKEND as FRAME_BACKEND
+from .stats import StatsReporter
+
+logging.config.dictConfig(LOGGING_CONFIG)
+logger = logging.getLogger(__name__)
+
+access_log = AccessLog() if ACCESS_LOG == "sampled" else None
+stats = StatsReporter(
+    {"key_cache": auth.key_cache.stats, "chat": chat.manager.queue_stats}
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info(f"Chat frames decoded with {FRAME_BACKEND}")
+    if FRAME_BACKEND == "json" and FRAME_CODEC != "json":
+        logger.warning(
+            "orjson is not installed, so chat frames use the slower stdlib json "
+            "decoder; install the 'fast' extra"
+        )
+    # Background work that must live exactly as long as the worker process.
+    await load_scripts(redis_client)
+    await auth.limiter.start()
+    await auth.verifier.start()
+    await chat.manager.start()
+    if access_log is not None:
+        await access_log.start()
+    await stats.start()
+    try:
+        yield
+    finally:
+        await stats.stop()
+        if access_log is not None:
+            await access_log.stop()
+        await chat.manager.stop()
+        await auth.verifier.stop()
+        await auth.limiter.stop()
+        await redis_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+app.add_middleware(SecurityMiddleware)
+if access_log is not None:
+    # Added last so it is outermost and also times SecurityMiddleware's answers.
+    app.add_middleware(AccessLogMiddleware, access_log=access_log)
+
+app.mount("/static", StaticFiles(directory="src/static"), name="static")
+
+
+@app.get("/favicon.ico", include_in_schema=False)
+async def favicon():
+    return FileResponse("src/static/favicon.ico")
+
+
+app.include_router(auth.router)
+app.include_router(chat.router)
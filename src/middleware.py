@@ -0,0 +1,114 @@
+from starlette.responses import PlainTextResponse
+
+# Largest request body we accept, mirroring the reverse proxy's cap. Enforced in
+# the app so onion traffic -- which is pointed straight at Uvicorn and bypasses
+# Caddy -- gets the same bound.
+MAX_BODY_BYTES = 64 * 1024
+
+# Applied to every response, including over the onion service which does not go
+# through Caddy. script-src/style-src 'self' is only safe because all scripts and
+# styles live in /static (no inline scripts, styles, or event handlers).
+SECURITY_HEADERS = {
+    "Referrer-Policy": "no-referrer",
+    "X-Content-Type-Options": "nosniff",
+    "X-Frame-Options": "DENY",
+    "Content-Security-Policy": (
+        "default-src 'self'; script-src 'self'; style-src 'self'; "
+        "connect-src 'self'; img-src 'self'; base-uri 'none'; "
+        "frame-ancestors 'none'; form-action 'self'"
+    ),
+    # Don't advertise the server software.
+    "Server": "vapour",
+}
+
+# The same headers as raw ASGI pairs, encoded once at import.
+_HEADER_BLOCK = [
+    (name.lower().encode("latin-1"), value.encode("latin-1"))
+    for name, value in SECURITY_HEADERS.items()
+]
+_HEADER_NAMES = frozenset(name for name, _ in _HEADER_BLOCK)
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class SecurityMiddleware:
+    """Add SECURITY_HEADERS to every HTTP response and cap request bodies.
+
+    A plain ASGI middleware: headers are spliced into ``http.response.start``
+    as they pass, with no per-request response wrapper. The body cap is checked
+    against Content-Length up front and against the bytes actually received,
+    so a chunked upload without a Content-Length is held to it too.
+    """
+
+    def __init__(self, app, max_body_bytes: int = MAX_BODY_BYTES):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                # Ours replace any the app set, as with the header API before.
+                headers = [
+                    header
+                    for header in message.get("headers", ())
+                    if header[0] not in _HEADER_NAMES
+                ]
+                headers.extend(_HEADER_BLOCK)
+                message = {**message, "headers": headers}
+            await send(message)
+
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    too_large = int(value) > self.max_body_bytes
+                except ValueError:
+                    response = PlainTextResponse("Bad Request", status_code=400)
+                    await response(scope, receive, send_with_headers)
+                    return
+                if too_large:
+                    await self._reject(scope, receive, send_with_headers)
+                    return
+                break
+
+        received = 0
+        response_started = False
+        overflowed = False
+
+        async def counting_receive():
+            nonlocal received, overflowed
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    overflowed = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            if overflowed and not response_started:
+                # The app answered its failed body read (FastAPI turns it into
+                # a 400); that answer is replaced by our 413 below.
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send_with_headers(message)
+
+        try:
+            await self.app(scope, counting_receive, guarded_send)
+        except _BodyTooLarge:
+            if response_started:
+                raise
+        if overflowed and not response_started:
+            await self._reject(scope, receive, send_with_headers)
+
+    @staticmethod
+    async def _reject(scope, receive, send):
+        response = PlainTextResponse("Payload too large", status_code=413)
+        await response(scope, receive, send)
@@ -0,0 +1,28 @@
+import redis.asyncio as aioredis
+
+from .env import (
+    REDIS_HOST,
+    REDIS_PORT,
+    REDIS_PASSWORD,
+    REDIS_MAX_CONNECTIONS,
+)
+
+# Single shared async client so every router draws from one bounded pool per
+# worker. BlockingConnectionPool makes a caller wait for a free connection
+# (up to POOL_TIMEOUT) instead of opening sockets without limit during a burst,
+# and idle connections are PINGed before reuse so a Redis restart surfaces as a
+# reconnect rather than an error on the next request.
+POOL_TIMEOUT = 5  # seconds
+HEALTH_CHECK_INTERVAL = 30  # seconds
+
+pool = aioredis.BlockingConnectionPool(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    password=REDIS_PASSWORD or None,
+    decode_responses=True,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    timeout=POOL_TIMEOUT,
+    health_check_interval=HEALTH_CHECK_INTERVAL,
+    socket_connect_timeout=POOL_TIMEOUT,
+)
+redis_client = aioredis.Redis(connection_pool=pool)
@@ -1,45 +1,154 @@
 from fastapi import APIRouter, Request, Form, HTTPException
 from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.concurrency import run_in_threadpool
+import asyncio
+import hashlib
+import time
 import uuid
-import redis
+from collections import OrderedDict
 from ..templating import templates
+from ..redis_client import redis_client
 from ..services import (
-    verify_login,
+    VerificationPool,
+    VerifierBusy,
+    CLEARNET,
+    ONION,
     client_ip,
-    is_rate_limited,
-    is_globally_rate_limited,
+    is_public_ip,
+    LocalRateLimiter,
+    GCRA,
+    ip_limit,
+    global_limit,
     sign_user_id,
+    sign_challenge,
+    unsign_challenge,
+    key_cache,
+    init_worker,
 )
 from ..env import (
     CHALLENGE_LIFETIME,
-    REDIS_HOST,
-    REDIS_PORT,
-    REDIS_PASSWORD,
+    LOGIN_FAILURE_TTL,
     SESSION_LIFETIME,
+    VERIFY_WORKERS,
+    VERIFY_MAX_PENDING,
+    VERIFY_QUEUE_TIMEOUT,
+    VERIFY_TIMEOUT,
 )
 
 router = APIRouter()
 
-redis_client = redis.Redis(
-    host=REDIS_HOST,
-    port=REDIS_PORT,
-    password=REDIS_PASSWORD or None,
-    decode_responses=True,
+# Answers clearly-under/clearly-over limit checks in-process and batches the
+# Redis charges, so a normal page view doesn't pay a round trip to learn it
+# wasn't rate limited.
+limiter = LocalRateLimiter(redis_client)
+
+# pgpy verification is synchronous and CPU-heavy on attacker-controlled input;
+# it runs on dedicated worker processes so one slow/malicious key can't stall
+# the event loop (or hold the GIL) that serves every other connection. Clearnet
+# and onion logins get separate lanes (see _lane) so neither can starve the
+# other. Workers log like the app and count their key cache hits and misses
+# into ours.
+verifier = VerificationPool(
+    VERIFY_WORKERS,
+    VERIFY_MAX_PENDING,
+    VERIFY_TIMEOUT,
+    queue_timeout=VERIFY_QUEUE_TIMEOUT,
+    initializer=init_worker,
+    initargs=(key_cache.counters,),
 )
 
+# Identical concurrent logins -- double submits, or one login replayed many
+# times in a flood -- share a single verification rather than each taking a
+# worker. Keyed by a digest of (public key, signature, challenge).
+_in_flight: dict[bytes, asyncio.Future] = {}
+
+# Digests of logins that recently failed, with when each entry lapses (see
+# LOGIN_FAILURE_TTL). Oldest-first, bounded so a flood of distinct junk can't
+# grow it without limit.
+_recent_failures: OrderedDict[bytes, float] = OrderedDict()
+MAX_RECENT_FAILURES = 10_000
+
 # Largest PGP public key / clearsigned blob we will even attempt to parse.
 # A normal armored key is a few KB; this is generous while blocking giant
 # payloads that exist only to burn CPU/memory in pgpy.
 MAX_PGP_FIELD = 16 * 1024
 
 
+def _challenge_text(nonce: str) -> str:
+    return f"Verification Challenge: {nonce}"
+
+
 def _issue_challenge() -> tuple[str, str]:
-    """Mint a fresh single-use challenge and store it in Redis with a TTL."""
-    challenge_id = str(uuid.uuid4())
-    challenge = f"Verification Challenge: {challenge_id}"
-    redis_client.setex(name=challenge_id, time=CHALLENGE_LIFETIME, value=challenge)
-    return challenge, challenge_id
+    """Mint a fresh single-use challenge.
+
+    Nothing is stored: the challenge id is a signed token carrying the nonce
+    and its expiry, so serving the login page never writes to Redis.
+    """
+    nonce = str(uuid.uuid4())
+    return _challenge_text(nonce), sign_challenge(nonce)
+
+
+async def _consume_challenge(nonce: str) -> bool:
+    """Mark ``nonce`` used; False if it already was (a replay).
+
+    Only consumed challenges are recorded, and only for as long as the token
+    could still pass :func:`unsign_challenge`.
+    """
+    return bool(
+        await redis_client.set(
+            f"challenge:used:{nonce}", 1, nx=True, ex=CHALLENGE_LIFETIME
+        )
+    )
+
+
+def _login_digest(public_key: str, signature: str, challenge: str) -> bytes:
+    digest = hashlib.sha256()
+    for field in (public_key, signature, challenge):
+        data = field.encode()
+        # Length-prefixed so no two different triples can digest alike.
+        digest.update(len(data).to_bytes(8, "big") + data)
+    return digest.digest()
+
+
+def _lane(request: Request) -> str:
+    # Onion traffic reaches us from the local Tor daemon, never a public address.
+    return CLEARNET if is_public_ip(client_ip(request)) else ONION
+
+
+async def _verify(
+    public_key: str, signature: str, expected_challenge: str, lane: str = CLEARNET
+):
+    """Verify a login, sharing the work with identical logins already in flight.
+
+    Raises :class:`VerifierBusy` like the pool itself. Callers are shielded from
+    each other: one of them giving up doesn't cancel the shared verification.
+    """
+    key = _login_digest(public_key, signature, expected_challenge)
+    lapses_at = _recent_failures.get(key)
+    if lapses_at is not None:
+        if time.monotonic() < lapses_at:
+            return False, None
+        del _recent_failures[key]
+
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(
+            verifier.verify(public_key, signature, expected_challenge, lane)
+        )
+        _in_flight[key] = task
+        task.add_done_callback(lambda done: _settle(key, done))
+    return await asyncio.shield(task)
+
+
+def _settle(key: bytes, task: asyncio.Future):
+    del _in_flight[key]
+    if task.cancelled() or task.exception() is not None:
+        return  # e.g. VerifierBusy: nothing was learned about this login.
+    is_valid, _ = task.result()
+    if not is_valid and LOGIN_FAILURE_TTL > 0:
+        _recent_failures[key] = time.monotonic() + LOGIN_FAILURE_TTL
+        _recent_failures.move_to_end(key)
+        while len(_recent_failures) > MAX_RECENT_FAILURES:
+            _recent_failures.popitem(last=False)
 
 
 def _render_login(
@@ -70,7 +179,9 @@ def _challenge_to_show(expected_challenge, challenge_id) -> tuple[str, str]:
 
 @router.get("/", response_class=HTMLResponse)
 async def index(request: Request):
-    if is_rate_limited(redis_client, client_ip(request), "index", limit=60, window=60):
+    if await limiter.is_limited(
+        ip_limit(client_ip(request), "index", limit=60, window=60, algorithm=GCRA)
+    ):
         raise HTTPException(status_code=429, detail="Too Many Requests")
 
     challenge, challenge_id = _issue_challenge()
@@ -87,13 +198,20 @@ async def login(
     challenge_id: str = Form(""),
 ):
     # Per-IP limit (clearnet) plus a server-wide ceiling that also covers onion
-    # traffic, where every client shares the exempt loopback address.
-    if is_rate_limited(
-        redis_client, client_ip(request), "login", limit=30, window=60
-    ) or is_globally_rate_limited(redis_client, "login", limit=300, window=60):
+    # traffic, where every client shares the exempt loopback address. When Redis
+    # is consulted, both are checked atomically in one round trip. GCRA rather
+    # than fixed windows so neither can be doubled across a window boundary, and
+    # the global burst is held well under the per-minute budget so a flood
+    # arrives at the verifier paced, not all at once.
+    if await limiter.is_limited(
+        ip_limit(client_ip(request), "login", limit=30, window=60, algorithm=GCRA),
+        global_limit("login", limit=300, window=60, algorithm=GCRA, burst=30),
+    ):
         raise HTTPException(status_code=429, detail="Too Many Requests")
 
-    expected_challenge = redis_client.get(challenge_id) if challenge_id else None
+    # Validated from the token alone -- no Redis lookup.
+    nonce = unsign_challenge(challenge_id)
+    expected_challenge = _challenge_text(nonce) if nonce else None
 
     # Missing input: re-show the page (keeping the existing challenge if it's
     # still valid, otherwise a fresh one) with guidance.
@@ -132,15 +250,30 @@ async def login(
             status_code=400,
         )
 
-    # pgpy verification is synchronous and CPU-heavy on attacker-controlled
-    # input; run it off the event loop so one slow/malicious key can't stall
-    # every other connection.
-    is_valid, user_id = await run_in_threadpool(
-        verify_login, public_key, signature, expected_challenge
-    )
+    try:
+        is_valid, user_id = await _verify(
+            public_key, signature, expected_challenge, _lane(request)
+        )
+    except VerifierBusy:
+        # This lane's queue is full, or the login waited too long for a worker:
+        # shed now rather than queue behind a flood. The challenge is untouched,
+        # so the user can simply retry.
+        raise HTTPException(status_code=503, detail="Service Unavailable")
+
+    if is_valid and user_id and not await _consume_challenge(nonce):
+        # A correct signature over a challenge that has already logged someone
+        # in: a replay (or a double submit). Make them sign a fresh one.
+        challenge, challenge_id = _issue_challenge()
+        return _render_login(
+            request,
+            challenge,
+            challenge_id,
+            "That challenge has already been used. Here is a new one — please "
+            "sign it and try again.",
+            status_code=400,
+        )
 
     if is_valid and user_id:
-        redis_client.delete(challenge_id)
         response = RedirectResponse(url="/chat/", status_code=303)
         response.set_cookie(
             key="user_id",
@@ -2,30 +2,45 @@ from fastapi import APIRouter, Request, WebSocket, WebSocketDisconnect, Cookie,
 from fastapi.responses import HTMLResponse, RedirectResponse
 from typing import Optional
 from urllib.parse import urlsplit
-import asyncio
-import json
 import time
-from ..services import ConnectionManager, unsign_user_id, is_valid_fingerprint
+from ..services import (
+    ConnectionManager,
+    PresenceRegistry,
+    RedisBackplane,
+    unsign_user_id,
+    is_valid_fingerprint,
+    decode_frame,
+    decode_binary_frame,
+    BINARY_SUBPROTOCOL,
+)
 from ..templating import templates
+from ..redis_client import redis_client
+from ..env import BACKPLANE
 
 router = APIRouter(prefix="/chat")
-manager = ConnectionManager()
+
+
+def _make_manager() -> ConnectionManager:
+    if BACKPLANE != "redis":
+        return ConnectionManager()
+    backplane = RedisBackplane(redis_client)
+    return ConnectionManager(
+        backplane=backplane,
+        presence=PresenceRegistry(redis_client, backplane.node_id),
+    )
+
+
+manager = _make_manager()
 
 # Largest single WebSocket frame we will parse. An ECDH JWK is a few hundred
 # bytes and chat messages are short; this is generous while bounding the JSON a
 # hostile client can force us to allocate and parse.
 MAX_WS_MESSAGE = 64 * 1024
 
-# Close a socket that sends nothing for this long (slow-loris / idle hoarding).
-IDLE_TIMEOUT = 300  # seconds
-
 # Per-connection flood control: at most MAX_MSGS messages per MSG_WINDOW.
 MSG_WINDOW = 10  # seconds
 MAX_MSGS = 120
 
-# Message types the protocol understands; anything else is rejected.
-_ALLOWED_TYPES = {"key_exchange", "encrypted_text"}
-
 
 @router.get("/", response_class=HTMLResponse)
 async def chat_home(request: Request, user_id: Optional[str] = Cookie(None)):
@@ -69,22 +84,6 @@ def _origin_allowed(websocket: WebSocket) -> bool:
     return bool(host) and urlsplit(origin).netloc == host
 
 
-def _valid_message(data) -> bool:
-    """Enforce the minimal message schema before routing anything."""
-    if not isinstance(data, dict):
-        return False
-    if data.get("type") not in _ALLOWED_TYPES:
-        return False
-    if not is_valid_fingerprint(data.get("target_user")):
-        return False
-    if data["type"] == "key_exchange":
-        return isinstance(data.get("publicKey"), dict)
-    content = data.get("content")
-    return (
-        isinstance(content, dict) and "iv" in content and "ciphertext" in content
-    )
-
-
 @router.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket):
     if not _origin_allowed(websocket):
@@ -100,20 +99,26 @@ async def websocket_endpoint(websocket: WebSocket):
         await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
         return
 
-    await manager.connect(websocket, user_id)
+    # Clients offering the binary subprotocol get it; JSON text works on both.
+    binary = BINARY_SUBPROTOCOL in websocket.scope.get("subprotocols", ())
+    connection = await manager.connect(
+        websocket, user_id, subprotocol=BINARY_SUBPROTOCOL if binary else None
+    )
     window_start = time.monotonic()
     msg_count = 0
     try:
         while True:
-            try:
-                raw = await asyncio.wait_for(
-                    websocket.receive_text(), timeout=IDLE_TIMEOUT
-                )
-            except asyncio.TimeoutError:
-                await websocket.close(code=status.WS_1001_GOING_AWAY)
+            # No per-receive timeout: the manager's idle sweep closes sockets
+            # that go quiet, which ends this receive with a disconnect.
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
                 break
+            raw = message.get("text")
+            if raw is None:
+                raw = message.get("bytes") or b""
 
             now = time.monotonic()
+            connection.last_seen = now
             if now - window_start > MSG_WINDOW:
                 window_start = now
                 msg_count = 0
@@ -126,18 +131,21 @@ async def websocket_endpoint(websocket: WebSocket):
                 await websocket.close(code=status.WS_1009_MESSAGE_TOO_BIG)
                 break
 
-            try:
-                data = json.loads(raw)
-            except json.JSONDecodeError:
-                await websocket.close(code=status.WS_1003_UNSUPPORTED_DATA)
-                break
-
-            if not _valid_message(data):
+            # Decoded and checked against the message schema in one pass.
+            if isinstance(raw, str):
+                frame = decode_frame(raw)
+            elif binary:
+                frame = decode_binary_frame(raw)
+            else:
+                frame = None
+            if frame is None:
                 await websocket.close(code=status.WS_1003_UNSUPPORTED_DATA)
                 break
 
+            # Routed as the client encoded it; the manager splices in the
+            # sender/recipient fields rather than re-encoding the payload.
             await manager.send_personal_message(
-                message=data, sender=user_id, recipient=data["target_user"]
+                message=raw, sender=user_id, recipient=frame.target_user
             )
     except WebSocketDisconnect:
         pass
@@ -1,16 +1,67 @@
+from .backplane import LocalBackplane, RedisBackplane
+from .codec import (
+    decode_frame,
+    decode_binary_frame,
+    KeyExchange,
+    EncryptedText,
+    BINARY_SUBPROTOCOL,
+)
 from .manager import ConnectionManager
-from .pgp_verifier import verify_login
-from .rate_limit import client_ip, is_rate_limited, is_globally_rate_limited
-from .session import sign_user_id, unsign_user_id
+from .pgp_verifier import verify_login, key_cache, init_worker
+from .presence import PresenceRegistry
+from .rate_limit import (
+    client_ip,
+    is_public_ip,
+    is_rate_limited,
+    is_globally_rate_limited,
+    is_any_rate_limited,
+    ip_limit,
+    global_limit,
+    load_scripts,
+    LocalRateLimiter,
+    FIXED_WINDOW,
+    GCRA,
+)
+from .session import (
+    sign_user_id,
+    unsign_user_id,
+    sign_challenge,
+    unsign_challenge,
+)
 from .validators import is_valid_fingerprint
+from .verification import VerificationPool, VerifierBusy, CLEARNET, ONION
 
 __all__ = [
+    "LocalBackplane",
+    "RedisBackplane",
+    "decode_frame",
+    "decode_binary_frame",
+    "KeyExchange",
+    "EncryptedText",
+    "BINARY_SUBPROTOCOL",
     "ConnectionManager",
     "verify_login",
+    "key_cache",
+    "init_worker",
+    "PresenceRegistry",
     "client_ip",
+    "is_public_ip",
     "is_rate_limited",
     "is_globally_rate_limited",
+    "is_any_rate_limited",
+    "ip_limit",
+    "global_limit",
+    "load_scripts",
+    "LocalRateLimiter",
+    "FIXED_WINDOW",
+    "GCRA",
     "sign_user_id",
     "unsign_user_id",
+    "sign_challenge",
+    "unsign_challenge",
     "is_valid_fingerprint",
+    "VerificationPool",
+    "VerifierBusy",
+    "CLEARNET",
+    "ONION",
 ]
@@ -0,0 +1,137 @@
+import asyncio
+import base64
+import json
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Pub/sub channel every node subscribes to. A relayed frame names its recipient
+# and each node delivers it only to sockets it holds locally; an "echo" frame is
+# also echoed to the sender's devices held there, as the sending node does for
+# its own. Each node also listens on ``<RELAY_CHANNEL>:<node_id>`` for frames
+# addressed to it directly, which is how a message is routed once presence says
+# where the sender and recipient are.
+#
+# A relayed frame is a one-line JSON routing header, a newline, then the chat
+# message exactly as the client encoded it, so relaying never re-encodes (or
+# escapes) the ciphertext. A binary message travels base64-encoded, flagged in
+# the header, since the channel carries text.
+RELAY_CHANNEL = "vapour:relay"
+
+# Pause before resubscribing after the Redis connection drops, so an outage
+# doesn't turn into a tight reconnect loop.
+_RESUBSCRIBE_DELAY = 1.0  # seconds
+
+
+class LocalBackplane:
+    """Backplane for a single process: there are no other nodes to reach.
+
+    This is the default, so a lone worker behaves exactly as before -- a
+    recipient who isn't connected here isn't connected anywhere.
+    """
+
+    node_id = "local"
+
+    async def start(self, deliver):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(
+        self, sender: str, recipient: str, message, node=None, echo: bool = False
+    ):
+        pass
+
+
+class RedisBackplane:
+    """Relay messages between processes over Redis pub/sub.
+
+    Each node subscribes to ``channel`` and to its own node channel, and hands
+    every frame it receives to the ``deliver`` callback given to :meth:`start`.
+    Frames are tagged with the publishing node's id so a node never re-delivers
+    its own traffic (it has already done the local delivery itself). ``deliver``
+    is called as ``deliver(sender, recipient, message, echo)``.
+    """
+
+    def __init__(self, redis_client, channel: str = RELAY_CHANNEL, node_id=None):
+        self.redis = redis_client
+        self.channel = channel
+        self.node_id = node_id or uuid.uuid4().hex
+        self._task = None
+
+    async def start(self, deliver):
+        self._task = asyncio.create_task(self._run(deliver))
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def node_channel(self, node: str) -> str:
+        return f"{self.channel}:{node}"
+
+    async def publish(
+        self, sender: str, recipient: str, message, node=None, echo: bool = False
+    ):
+        """Relay ``message`` to ``node``, or to every node if none is given.
+
+        With ``echo``, receiving nodes also echo it to the sender's devices.
+        """
+        header = {"origin": self.node_id, "sender": sender, "recipient": recipient}
+        if echo:
+            header["echo"] = True
+        if isinstance(message, bytes):
+            header["binary"] = True
+            message = base64.b64encode(message).decode("ascii")
+        header = json.dumps(header)
+        channel = self.channel if node is None else self.node_channel(node)
+        await self.redis.publish(channel, f"{header}\n{message}")
+
+    async def _run(self, deliver):
+        # Keep the subscription alive across Redis restarts; messages published
+        # while we are disconnected are lost, which pub/sub never promised to
+        # keep anyway (and the chat protocol doesn't store messages).
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.channel, self.node_channel(self.node_id))
+                async for item in pubsub.listen():
+                    await self._handle(item, deliver)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Backplane subscription lost: {e}")
+                await asyncio.sleep(_RESUBSCRIBE_DELAY)
+            finally:
+                await pubsub.aclose()
+
+    async def _handle(self, item, deliver):
+        if item.get("type") != "message":
+            return
+        try:
+            header, newline, message = item["data"].partition("\n")
+            if not newline:
+                raise ValueError("no message")
+            header = json.loads(header)
+            origin = header["origin"]
+            sender, recipient = header["sender"], header["recipient"]
+            echo = header.get("echo") is True
+            if header.get("binary"):
+                message = base64.b64decode(message, validate=True)
+        except (ValueError, TypeError, KeyError, AttributeError):
+            logger.error("Dropped malformed backplane frame")
+            return
+        if origin == self.node_id:
+            return
+        try:
+            await deliver(sender, recipient, message, echo)
+        except Exception as e:
+            # A dead local socket must not kill the subscription for everyone.
+            logger.error(f"Backplane delivery failed: {e}")
@@ -0,0 +1,112 @@
+import json
+from typing import NamedTuple, Optional, Union
+
+from ..env import FRAME_CODEC
+from .validators import is_valid_fingerprint
+
+try:
+    import orjson
+except ImportError:  # Optional; the stdlib decoder is used instead.
+    orjson = None
+
+# Decoding and validation of chat WebSocket frames. A frame is decoded once,
+# checked against the protocol schema in the same pass, and comes back as one of
+# the typed messages below; anything else is None and the socket is closed. The
+# router only needs the recipient out of it -- the encoded frame itself is what
+# gets relayed (see ConnectionManager.send_personal_message).
+#
+# orjson decodes several times faster than the stdlib and is used whenever it is
+# installed, unless FRAME_CODEC says "json".
+BACKEND = "orjson" if orjson is not None and FRAME_CODEC != "json" else "json"
+_loads = orjson.loads if BACKEND == "orjson" else json.loads
+
+# Clients that offer this WebSocket subprotocol may send encrypted_text as a
+# binary frame carrying the iv and ciphertext as raw bytes, and receive it the
+# same way; JSON text, as spoken by every client, stays valid on either. A
+# binary frame is
+#
+#     kind (1 byte) | fingerprint (20 bytes) | iv length (1 byte) | iv | ciphertext
+#
+# where the fingerprint is the target for BINARY_ENCRYPTED_TEXT (client to
+# server), the sender for BINARY_DELIVERED and the recipient for BINARY_ECHO.
+# Relaying only rewrites the first 21 bytes; the payload is never touched.
+BINARY_SUBPROTOCOL = "vapour.bin.v1"
+BINARY_ENCRYPTED_TEXT = 0x01
+BINARY_DELIVERED = 0x02
+BINARY_ECHO = 0x03
+_BINARY_HEADER = 22
+_PEER_KINDS = {"sender": BINARY_DELIVERED, "recipient": BINARY_ECHO}
+
+
+class KeyExchange(NamedTuple):
+    target_user: str
+    public_key: dict
+
+
+class EncryptedText(NamedTuple):
+    target_user: str
+    content: dict
+
+
+Frame = Union[KeyExchange, EncryptedText]
+
+
+def decode_frame(raw: Union[str, bytes]) -> Optional[Frame]:
+    """Decode and validate one client frame; None if it is malformed."""
+    try:
+        data = _loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(data, dict):
+        return None
+    target = data.get("target_user")
+    if not is_valid_fingerprint(target):
+        return None
+    kind = data.get("type")
+    if kind == "key_exchange":
+        public_key = data.get("publicKey")
+        if isinstance(public_key, dict):
+            return KeyExchange(target, public_key)
+    elif kind == "encrypted_text":
+        content = data.get("content")
+        if isinstance(content, dict) and "iv" in content and "ciphertext" in content:
+            return EncryptedText(target, content)
+    return None
+
+
+def decode_binary_frame(raw: bytes) -> Optional[EncryptedText]:
+    """Check one binary client frame; None if it is malformed.
+
+    The iv and ciphertext in the result are views into ``raw``, not copies.
+    """
+    if len(raw) <= _BINARY_HEADER or raw[0] != BINARY_ENCRYPTED_TEXT:
+        return None
+    iv_end = _BINARY_HEADER + raw[21]
+    if raw[21] == 0 or iv_end >= len(raw):
+        return None
+    view = memoryview(raw)
+    content = {"iv": view[_BINARY_HEADER:iv_end], "ciphertext": view[iv_end:]}
+    return EncryptedText(raw[1:21].hex().upper(), content)
+
+
+def relabel_binary(frame: bytes, field: str, peer: str) -> bytes:
+    """A client's binary frame, re-addressed to name ``peer`` as its ``field``.
+
+    ``field`` is "sender" for the recipient's copy, "recipient" for the echo.
+    """
+    return bytes((_PEER_KINDS[field],)) + bytes.fromhex(peer) + frame[21:]
+
+
+def binary_to_json(frame: bytes, field: str, peer: str) -> str:
+    """relabel_binary as JSON text, for a client that can't take binary."""
+    iv_end = _BINARY_HEADER + frame[21]
+    message = {
+        "type": "encrypted_text",
+        "target_user": frame[1:21].hex().upper(),
+        "content": {
+            "iv": list(frame[_BINARY_HEADER:iv_end]),
+            "ciphertext": list(frame[iv_end:]),
+        },
+        field: peer,
+    }
+    return json.dumps(message, separators=(",", ":"))
@@ -0,0 +1,84 @@
+import hashlib
+import multiprocessing
+import time
+from collections import OrderedDict
+
+# Returning users paste the same public key on every login, and parsing it is
+# the dominant cost of a verification (large RSA keys with many subkeys/UIDs
+# especially). This keeps recently parsed keys, keyed by a digest of their
+# armor, so a repeat login skips straight to checking the signature.
+#
+# Entries live in each verification worker's own memory: parsed pgpy objects
+# can't be shared between processes, and pickling one back and forth would cost
+# about as much as parsing it. The hit/miss counters, however, are in shared
+# memory the app creates and hands to each worker as it starts (see
+# share_counters), so the app sees totals across all of them (and across
+# workers that were killed and replaced).
+
+
+class KeyCache:
+    """Bounded LRU of parsed keys, each kept for at most ``ttl`` seconds."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # Unlocked on purpose: a worker killed mid-increment must not leave a
+        # lock held for the others. A rare lost increment is fine for a counter.
+        self._hits = multiprocessing.RawValue("Q", 0)
+        self._misses = multiprocessing.RawValue("Q", 0)
+
+    @staticmethod
+    def digest(armored: str) -> bytes:
+        # Normalize line endings and surrounding whitespace so the same key
+        # pasted from a different OS or editor still hits.
+        normalized = armored.replace("\r\n", "\n").strip()
+        return hashlib.sha256(normalized.encode()).digest()
+
+    def get(self, armored: str):
+        key = self.digest(armored)
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if time.monotonic() < expires_at:
+                self._entries.move_to_end(key)
+                self._hits.value += 1
+                return value
+            del self._entries[key]
+        self._misses.value += 1
+        return None
+
+    def put(self, armored: str, value):
+        if self.max_size <= 0:
+            return
+        key = self.digest(armored)
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hits(self) -> int:
+        return self._hits.value
+
+    @property
+    def misses(self) -> int:
+        return self._misses.value
+
+    @property
+    def counters(self) -> tuple:
+        """The shared hit and miss counters, to hand to a worker process."""
+        return self._hits, self._misses
+
+    def share_counters(self, counters: tuple):
+        """Count into ``counters`` (another cache's) from now on."""
+        self._hits, self._misses = counters
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
@@ -1,52 +1,439 @@
-from typing import Dict, Optional
-from fastapi import WebSocket
+import asyncio
+import json
+import logging
+import sys
+import time
+from collections import deque
+from typing import Dict, List, Optional, Union
+from fastapi import WebSocket, status
 
-# Hard ceiling on simultaneously held sockets. Each connection costs memory and
-# an event-loop task; this bounds how much a flood of distinct identities can
-# tie up before new connections are shed (1013 Try Again Later).
-MAX_CONNECTIONS = 500
+from ..env import CHAT_MAX_CONNECTIONS, CHAT_MEMORY_BUDGET
+from .backplane import LocalBackplane
+from .codec import BINARY_SUBPROTOCOL, binary_to_json, relabel_binary
+
+# Roughly what one held socket costs a worker in resident memory: Uvicorn's
+# websockets protocol object and buffers, plus our own record. Measured at
+# about 29 KiB per idle socket with a few hundred connected.
+CONNECTION_MEMORY = 32 * 1024  # bytes
+
+
+def connection_limit(max_connections: int, memory_budget: int) -> int:
+    """The lower of ``max_connections`` and what fits in ``memory_budget`` MiB.
+
+    A budget of 0 leaves ``max_connections`` as the only limit.
+    """
+    if memory_budget <= 0:
+        return max_connections
+    return min(max_connections, memory_budget * 2**20 // CONNECTION_MEMORY)
+
+
+# Ceiling on simultaneously held sockets, beyond which new connections are shed
+# (1013 Try Again Later): bounds how much a flood of distinct identities can
+# tie up. See CHAT_MAX_CONNECTIONS and CHAT_MEMORY_BUDGET in env.py.
+MAX_CONNECTIONS = connection_limit(CHAT_MAX_CONNECTIONS, CHAT_MEMORY_BUDGET)
+
+# Sockets one fingerprint may hold at once (phone, laptop, a few tabs). A new
+# device past the cap pushes out that user's oldest one, closed with 1008.
+MAX_DEVICES = 4
+
+# Frames buffered per connection. A recipient this far behind isn't reading
+# (a stalled TCP window is common over Tor) and is evicted with 1013 rather
+# than left to hold memory or slow anyone else down.
+SEND_QUEUE_SIZE = 64
+
+# Longest a single write to a socket may take before the recipient is evicted
+# with 1008, and how long we then wait for the close to go through.
+SEND_TIMEOUT = 10  # seconds
+
+# Close a socket that sends nothing for this long (slow-loris / idle hoarding)
+# with 1001. Rather than a timer per receive, one sweep every IDLE_SWEEP_INTERVAL
+# checks each socket's last activity, so an idle socket goes within
+# IDLE_TIMEOUT + IDLE_SWEEP_INTERVAL.
+IDLE_TIMEOUT = 300  # seconds
+IDLE_SWEEP_INTERVAL = 15  # seconds
+
+# A write to one socket taking longer than this is logged as a stalled peer,
+# well before SEND_TIMEOUT evicts it. Each connection also keeps a moving
+# average of its write latency, weighted SEND_LATENCY_WEIGHT to the newest.
+SLOW_SEND = 1  # seconds
+SEND_LATENCY_WEIGHT = 0.2
+
+logger = logging.getLogger(__name__)
+
+
+def _with_field(frame: str, name: str, value: str) -> str:
+    """Add ``name: value`` to the encoded JSON object ``frame``.
+
+    The field is appended last, so it overrides a same-named key the client
+    may have sent: JSON.parse, like json.loads, keeps the last duplicate.
+    """
+    end = frame.rindex("}")
+    return f"{frame[:end]},{json.dumps(name)}:{json.dumps(value)}}}"
+
+
+def _addressed(connection, message: Union[str, bytes], name: str, value: str):
+    """``message`` with ``name: value`` added, in a form ``connection`` takes."""
+    if isinstance(message, str):
+        return _with_field(message, name, value)
+    if connection.binary:
+        return relabel_binary(message, name, value)
+    return binary_to_json(message, name, value)
+
+
+class Connection:
+    """An accepted socket and the task that writes to it.
+
+    Frames are queued with :meth:`send`, which never blocks; a per-connection
+    writer task drains the queue onto the socket, so one slow recipient only
+    ever delays its own frames. Most sockets sit idle most of the time, so the
+    queue and writer only exist while there is something to write.
+    """
+
+    __slots__ = (
+        "websocket",
+        "user_id",
+        "binary",
+        "queue_size",
+        "queue",
+        "writer",
+        "last_seen",
+        "send_latency",
+        "writing_since",
+    )
+
+    def __init__(
+        self, websocket: WebSocket, user_id: str, queue_size: int, binary=False
+    ):
+        self.websocket = websocket
+        self.user_id = user_id
+        # Negotiated BINARY_SUBPROTOCOL, so takes encrypted_text as raw bytes.
+        self.binary = binary
+        # Most frames that may wait for the writer; 0 is unbounded.
+        self.queue_size = queue_size
+        self.queue: Optional[deque] = None
+        self.writer: Optional[asyncio.Task] = None
+        # Monotonic time the client last sent anything; see sweep_idle().
+        self.last_seen = time.monotonic()
+        # Moving average of how long a write to this socket takes, and when
+        # the write in progress (if any) began.
+        self.send_latency = 0.0
+        self.writing_since = None
+
+    def send(self, payload: Union[str, bytes]) -> bool:
+        """Queue the encoded frame ``payload``; False if the queue is full."""
+        if self.queue is None:
+            self.queue = deque()
+        elif self.queue_size and len(self.queue) >= self.queue_size:
+            return False
+        self.queue.append(payload)
+        return True
+
+    async def flushed(self):
+        """Wait until everything queued so far is written, or dropped."""
+        while self.writer is not None:
+            await asyncio.wait((self.writer,))
+
+    async def close(self, code: int, timeout: float = SEND_TIMEOUT):
+        if self.writer is not None:
+            self.writer.cancel()
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), timeout)
+        except Exception:
+            pass  # Already gone, or stalled too badly to close cleanly.
 
 
 class ConnectionManager:
-    def __init__(self, max_connections: int = MAX_CONNECTIONS):
-        self.active_connections: Dict[str, WebSocket] = {}
+    def __init__(
+        self,
+        max_connections: int = MAX_CONNECTIONS,
+        backplane=None,
+        presence=None,
+        idle_timeout: float = IDLE_TIMEOUT,
+        max_devices: int = MAX_DEVICES,
+    ):
+        # Each user's sockets on this node, oldest first.
+        self.active_connections: Dict[str, List[Connection]] = {}
+        self.connection_count = 0
         self.max_connections = max_connections
+        self.max_devices = max_devices
+        self.idle_timeout = idle_timeout
+        self.send_queue_size = SEND_QUEUE_SIZE
+        self.send_timeout = SEND_TIMEOUT
+        # Slow consumers evicted so far: queue overflowed, write timed out.
+        self.evicted_overflow = 0
+        self.evicted_timeout = 0
+        # Reaches recipients connected to other worker processes/hosts. The
+        # local default makes a single worker self-contained.
+        self.backplane = backplane or LocalBackplane()
+        # Optional cluster directory of which node holds whom. With it, remote
+        # messages are published to one node (or not at all when the recipient
+        # is offline) instead of being broadcast to every node.
+        self.presence = presence
+        self._presence_tasks = set()
+        self._close_tasks = set()
+        self._sweeper = None
+
+    async def start(self):
+        """Begin receiving messages relayed from other nodes."""
+        await self.backplane.start(self._deliver_local)
+        if self.presence is not None:
+            await self.presence.start(lambda: self.active_connections.keys())
+        self._sweeper = asyncio.get_running_loop().create_task(self._sweep())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        if self.presence is not None:
+            await self.presence.stop(list(self.active_connections))
+        await self.backplane.stop()
+        for connection in self._connections():
+            if connection.writer is not None:
+                connection.writer.cancel()
+
+    def _connections(self):
+        for devices in self.active_connections.values():
+            yield from devices
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(IDLE_SWEEP_INTERVAL)
+            self.sweep_idle()
+
+    def sweep_idle(self, now: Optional[float] = None) -> int:
+        """Close every socket idle for idle_timeout with 1001; return how many."""
+        cutoff = (time.monotonic() if now is None else now) - self.idle_timeout
+        idle = [c for c in self._connections() if c.last_seen < cutoff]
+        for connection in idle:
+            self._close(connection, status.WS_1001_GOING_AWAY)
+        return len(idle)
+
+    def queue_stats(self) -> dict:
+        """Outbound queue depths and write latency across local connections.
+
+        ``stalled_for`` is how long the oldest write still in progress has
+        been going; a peer that stopped reading shows up there first.
+        """
+        connections = list(self._connections())
+        depths = [len(c.queue) if c.queue else 0 for c in connections]
+        now = time.monotonic()
+        writing = [now - c.writing_since for c in connections if c.writing_since]
+        return {
+            "connections": len(depths),
+            "queued": sum(depths),
+            "max_depth": max(depths, default=0),
+            "max_send_latency": max((c.send_latency for c in connections), default=0.0),
+            "stalled_for": max(writing, default=0.0),
+            "evicted_overflow": self.evicted_overflow,
+            "evicted_timeout": self.evicted_timeout,
+        }
 
     def has_capacity_for(self, user_id: str) -> bool:
-        """Whether a (re)connection from ``user_id`` can be accepted.
+        """Whether another socket from ``user_id`` can be accepted.
 
-        A reconnecting user replaces their own existing slot, so they always
-        fit; only genuinely new identities count against the cap.
+        Every socket counts against max_connections, except that a user at
+        their device cap always fits: their oldest device makes way.
         """
-        if user_id in self.active_connections:
+        if len(self.active_connections.get(user_id, ())) >= self.max_devices:
             return True
-        return len(self.active_connections) < self.max_connections
+        return self.connection_count < self.max_connections
 
-    async def connect(self, websocket: WebSocket, user_id: str):
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
+    async def connect(
+        self, websocket: WebSocket, user_id: str, subprotocol: Optional[str] = None
+    ) -> Connection:
+        await websocket.accept(subprotocol=subprotocol)
+        # One string per user, shared by the registry key and each device.
+        user_id = sys.intern(user_id)
+        connection = Connection(
+            websocket,
+            user_id,
+            self.send_queue_size,
+            binary=subprotocol == BINARY_SUBPROTOCOL,
+        )
+        devices = self.active_connections.setdefault(user_id, [])
+        devices.append(connection)
+        self.connection_count += 1
+        if len(devices) > self.max_devices:
+            self._close(devices[0], status.WS_1008_POLICY_VIOLATION)
+        if self.presence is not None:
+            try:
+                await self.presence.add(user_id)
+            except Exception as e:
+                # Still reachable from this node; the heartbeat retries the claim.
+                logger.error(f"Presence update failed: {e}")
+        return connection
 
     def disconnect(self, user_id: str, websocket: Optional[WebSocket] = None):
-        """Drop ``user_id``'s connection.
+        """Drop ``user_id``'s socket ``websocket``, or all of them if not given.
 
-        If ``websocket`` is given, only remove it when it is still the active
-        socket for that user, so a late cleanup from a replaced connection
-        cannot evict the user's newer one.
+        Dropping a socket that has already gone is a no-op, so cleanup paths
+        can all call this without coordinating.
         """
-        current = self.active_connections.get(user_id)
-        if current is None:
+        devices = self.active_connections.get(user_id)
+        if devices is None:
             return
-        if websocket is not None and current is not websocket:
+        gone = [c for c in devices if websocket is None or c.websocket is websocket]
+        for connection in gone:
+            devices.remove(connection)
+            if connection.writer is not None:
+                connection.writer.cancel()
+        self.connection_count -= len(gone)
+        if devices:
             return
         del self.active_connections[user_id]
+        if self.presence is not None:
+            # disconnect() runs from cleanup paths that can't await, so withdraw
+            # the presence claim in the background.
+            task = asyncio.get_running_loop().create_task(self._forget(user_id))
+            self._presence_tasks.add(task)
+            task.add_done_callback(self._presence_tasks.discard)
+
+    async def _forget(self, user_id: str):
+        # The user may have reconnected here before this ran; keep their claim.
+        if user_id in self.active_connections:
+            return
+        try:
+            await self.presence.remove(user_id)
+        except Exception as e:
+            # The claim lapses on its own after the presence TTL.
+            logger.error(f"Presence update failed: {e}")
+
+    async def send_personal_message(
+        self, message: Union[str, bytes], sender: str, recipient: str
+    ):
+        """Route ``message`` exactly as the client encoded it.
+
+        A JSON text frame is never decoded or re-encoded here: the recipient's
+        copy and the sender's echo are the original text with ``sender`` or
+        ``recipient`` spliced in. A binary frame is relayed as bytes to clients
+        that speak the binary protocol and converted to JSON for the rest.
+
+        Nothing here waits on, or fails with, another socket: each copy is
+        queued for that device's writer, and a device whose write fails is
+        dropped on its own.
+        """
+        # Every device the recipient has here gets it now, as does every one of
+        # the sender's devices (the echo is how the sending tab shows it, too).
+        # Either of them may also have devices on other nodes.
+        await self._deliver_local(sender, recipient, message, echo=True)
+        await self._relay(sender, recipient, message)
+
+    async def _relay(self, sender: str, recipient: str, message: Union[str, bytes]):
+        # Runs in the sender's receive loop: a backplane outage costs remote
+        # delivery, not the sender's connection.
+        # Relayed copies carry the echo, so the sender's devices on other nodes
+        # show the conversation too; a node holding neither party drops it.
+        try:
+            if self.presence is None:
+                await self.backplane.publish(sender, recipient, message, echo=True)
+                return
+            nodes = await self.presence.nodes_for(recipient)
+            nodes |= await self.presence.nodes_for(sender)
+            for node in nodes:
+                # A claim by this node for a user we don't hold is stale.
+                if node != self.backplane.node_id:
+                    await self.backplane.publish(
+                        sender, recipient, message, node=node, echo=True
+                    )
+        except Exception as e:
+            logger.error(f"Relay failed: {e}")
+
+    async def _deliver_local(
+        self,
+        sender: str,
+        recipient: str,
+        message: Union[str, bytes],
+        echo: bool = False,
+    ):
+        devices = self.active_connections.get(recipient)
+        if devices:
+            self._fan_out(devices, message, "sender", sender)
+        if echo:
+            devices = self.active_connections.get(sender)
+            if devices:
+                self._fan_out(devices, message, "recipient", recipient)
+
+    def _fan_out(self, devices, message, name: str, value: str):
+        """Queue ``message`` for each of ``devices``.
+
+        Queueing never blocks; each device's writer task then sends on its own,
+        so the devices are written to concurrently.
+        """
+        payloads = {}
+        # A copy: an overflowing device is evicted from ``devices`` as we go.
+        for connection in list(devices):
+            payload = payloads.get(connection.binary)
+            if payload is None:
+                payload = _addressed(connection, message, name, value)
+                payloads[connection.binary] = payload
+            self._enqueue(connection, payload)
+
+    def _enqueue(self, connection: Connection, payload: Union[str, bytes]):
+        if not connection.send(payload):
+            self.evicted_overflow += 1
+            self._evict(
+                connection,
+                status.WS_1013_TRY_AGAIN_LATER,
+                f"outbound queue full ({self.send_queue_size} frames)",
+            )
+        elif connection.writer is None:
+            connection.writer = asyncio.get_running_loop().create_task(
+                self._write(connection)
+            )
+
+    async def _write(self, connection: Connection):
+        queue = connection.queue
+        try:
+            while queue:
+                payload = queue.popleft()
+                connection.writing_since = start = time.monotonic()
+                try:
+                    # Not wait_for: on 3.11 it can swallow a cancel that lands
+                    # as the send completes, leaving the writer running on.
+                    async with asyncio.timeout(self.send_timeout):
+                        if isinstance(payload, bytes):
+                            await connection.websocket.send_bytes(payload)
+                        else:
+                            await connection.websocket.send_text(payload)
+                    self._record_latency(connection, time.monotonic() - start)
+                except TimeoutError:
+                    self.evicted_timeout += 1
+                    self._evict(
+                        connection,
+                        status.WS_1008_POLICY_VIOLATION,
+                        f"write took over {self.send_timeout}s",
+                    )
+                    return
+                except Exception:
+                    # The socket is gone; its receive loop will clean up too.
+                    self.disconnect(connection.user_id, connection.websocket)
+                    return
+                finally:
+                    connection.writing_since = None
+        finally:
+            # Idle (or dropped): hold no queue or task until the next frame.
+            connection.queue = None
+            connection.writer = None
+
+    def _record_latency(self, connection: Connection, elapsed: float):
+        connection.send_latency += SEND_LATENCY_WEIGHT * (
+            elapsed - connection.send_latency
+        )
+        if elapsed > SLOW_SEND:
+            logger.warning(
+                f"Slow consumer: write took {elapsed:.1f}s, "
+                f"averaging {connection.send_latency:.2f}s"
+            )
 
-    async def send_personal_message(self, message: dict, sender: str, recipient: str):
-        if recipient in self.active_connections:
-            payload_for_recipient = message.copy()
-            payload_for_recipient["sender"] = sender
-            await self.active_connections[recipient].send_json(payload_for_recipient)
+    def _evict(self, connection: Connection, code: int, reason: str):
+        """Drop a slow consumer and close its socket in the background."""
+        logger.warning(f"Evicted slow consumer: {reason}")
+        self._close(connection, code)
 
-        if sender in self.active_connections:
-            payload_for_sender = message.copy()
-            payload_for_sender["recipient"] = recipient
-            await self.active_connections[sender].send_json(payload_for_sender)
+    def _close(self, connection: Connection, code: int):
+        self.disconnect(connection.user_id, connection.websocket)
+        task = asyncio.get_running_loop().create_task(
+            connection.close(code, self.send_timeout)
+        )
+        self._close_tasks.add(task)
+        task.add_done_callback(self._close_tasks.discard)
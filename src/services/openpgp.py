@@ -0,0 +1,454 @@
+import base64
+import binascii
+import hashlib
+from typing import Iterator, NamedTuple
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
+from cryptography.hazmat.primitives.asymmetric.utils import (
+    Prehashed,
+    encode_dss_signature,
+)
+
+# Just enough of the OpenPGP wire format (RFC 4880) to read a key's algorithm,
+# size and key ids, and a signature's hash algorithm and issuer, straight from
+# the armored text. This lets the verifier reject inputs its policy would refuse
+# anyway without paying for a full pgpy parse. It is a scanner, not a parser:
+# anything it doesn't understand raises PacketError and is left to pgpy.
+#
+# For the common key types it can also check a cleartext signature itself, with
+# cryptography's primitives (see verify_signature). That is the login fast path;
+# again, anything unusual raises PacketError and pgpy decides instead.
+
+# Packet tags we look at.
+TAG_SIGNATURE = 2
+TAG_PUBLIC_KEY = 6
+TAG_PUBLIC_SUBKEY = 14
+TAG_USER_ID = 13
+TAG_USER_ATTRIBUTE = 17
+
+# Signature types (RFC 4880 section 5.2.1).
+SIG_BINARY = 0x00
+SIG_TEXT = 0x01
+SIG_SUBKEY_BINDING = 0x18
+_SIG_CERTIFICATIONS = {0x10, 0x11, 0x12, 0x13}
+_SIG_REVOCATIONS = {0x20, 0x28, 0x30}
+
+# Signature subpacket types carrying the signer's identity.
+_SUBPACKET_ISSUER = 16
+_SUBPACKET_ISSUER_FINGERPRINT = 33
+_SUBPACKET_KEY_EXPIRATION = 9
+
+# Public-key algorithms whose key material starts with a curve OID.
+_ECC_ALGOS = {18, 19, 22}  # ECDH, ECDSA, EdDSA
+
+# What verify_signature can check itself, by OpenPGP id.
+_HASHES = {
+    8: hashes.SHA256,
+    9: hashes.SHA384,
+    10: hashes.SHA512,
+    11: hashes.SHA224,
+}
+_ECDSA_CURVES = {
+    bytes.fromhex("2a8648ce3d030107"): ec.SECP256R1,
+    bytes.fromhex("2b81040022"): ec.SECP384R1,
+    bytes.fromhex("2b81040023"): ec.SECP521R1,
+}
+_ED25519_OID = bytes.fromhex("2b06010401da470f01")
+
+
+class PacketError(ValueError):
+    """The input isn't OpenPGP data this scanner can read."""
+
+
+class KeyInfo(NamedTuple):
+    algorithm: int
+    # Unix time the key was created.
+    created: int
+    # RSA modulus size in bits; None for algorithms sized by their curve.
+    bits: int | None
+    # Uppercase hex, as pgpy renders them.
+    fingerprint: str
+    key_id: str
+    body: bytes
+
+
+class SignatureInfo(NamedTuple):
+    version: int
+    sig_type: int
+    algorithm: int
+    hash_algorithm: int
+    # Key id of the signing key, or None if the signature doesn't say.
+    issuer: str | None
+    # Seconds after key creation at which the key expires, if this signature
+    # sets it (hashed subpackets only).
+    key_expiration: int | None
+    body: bytes
+
+
+class CertInfo(NamedTuple):
+    primary: KeyInfo
+    subkeys: list[KeyInfo]
+    # Every key expiration the primary's self-certifications state, with None
+    # standing for a self-certification that sets none.
+    expirations: frozenset
+    # Whether the key carries any revocation signature.
+    revoked: bool
+    # Subkey binding signatures found after each subkey, by its key id. Nothing
+    # here is checked yet: see verify_binding.
+    bindings: dict
+
+
+def dearmor(text: str, block: str) -> bytes:
+    """Decode the first ``-----BEGIN PGP <block>-----`` section of ``text``."""
+    lines = iter(text.replace("\r\n", "\n").split("\n"))
+    begin = f"-----BEGIN PGP {block}-----"
+    for line in lines:
+        if line.strip() == begin:
+            break
+    else:
+        raise PacketError(f"No {block} armor found")
+
+    body = []
+    in_headers = True
+    for line in lines:
+        line = line.strip()
+        if line.startswith("-----END PGP"):
+            break
+        if in_headers:
+            # Armor headers ("Version: ...") run up to the first blank line.
+            if not line or ": " in line:
+                in_headers = bool(line)
+                continue
+            in_headers = False
+        if line.startswith("="):
+            break  # CRC24 checksum line ends the data.
+        body.append(line)
+    else:
+        raise PacketError(f"Unterminated {block} armor")
+
+    try:
+        return base64.b64decode("".join(body), validate=True)
+    except binascii.Error as e:
+        raise PacketError(f"Bad armor payload: {e}") from None
+
+
+def packets(data: bytes) -> Iterator[tuple[int, bytes]]:
+    """Yield ``(tag, body)`` for each packet in ``data``."""
+    pos = 0
+    while pos < len(data):
+        header = data[pos]
+        if not header & 0x80:
+            raise PacketError("Not a packet header")
+        if header & 0x40:
+            # New-format header.
+            tag = header & 0x3F
+            length, pos = _new_format_length(data, pos + 1)
+        else:
+            tag = (header >> 2) & 0x0F
+            length_type = header & 0x03
+            pos += 1
+            if length_type == 3:
+                length = len(data) - pos  # Indeterminate: runs to the end.
+            else:
+                size = (1, 2, 4)[length_type]
+                length = int.from_bytes(_take(data, pos, size), "big")
+                pos += size
+        yield tag, _take(data, pos, length)
+        pos += length
+
+
+def parse_public_key(body: bytes) -> KeyInfo:
+    """Read a v4 public key or subkey packet body."""
+    if len(body) < 6 or body[0] != 4:
+        raise PacketError("Unsupported key packet version")
+    algorithm = body[5]
+    bits = None
+    if algorithm in (1, 2, 3):  # RSA: the modulus is the first MPI.
+        bits = int.from_bytes(_take(body, 6, 2), "big")
+    elif algorithm in _ECC_ALGOS:
+        # Sized by the curve named by this OID.
+        _take(body, 7, _take(body, 6, 1)[0])
+    created = int.from_bytes(body[1:5], "big")
+    digest = hashlib.sha1(b"\x99" + len(body).to_bytes(2, "big") + body)
+    fingerprint = digest.hexdigest().upper()
+    return KeyInfo(algorithm, created, bits, fingerprint, fingerprint[-16:], body)
+
+
+def parse_signature(body: bytes) -> SignatureInfo:
+    """Read a v3 or v4 signature packet body."""
+    version = body[0] if body else None
+    if version == 3:
+        if len(body) < 17:
+            raise PacketError("Truncated signature")
+        return SignatureInfo(
+            3, body[2], body[15], body[16], body[7:15].hex().upper(), None, body
+        )
+    if version != 4 or len(body) < 6:
+        raise PacketError("Unsupported signature version")
+
+    hashed_len = int.from_bytes(body[4:6], "big")
+    hashed = _take(body, 6, hashed_len)
+    unhashed_at = 6 + hashed_len
+    unhashed_len = int.from_bytes(_take(body, unhashed_at, 2), "big")
+    unhashed = _take(body, unhashed_at + 2, unhashed_len)
+
+    issuer = None
+    for kind, data in _subpackets(hashed + unhashed):
+        if kind == _SUBPACKET_ISSUER and len(data) == 8:
+            issuer = data.hex().upper()
+        elif kind == _SUBPACKET_ISSUER_FINGERPRINT and len(data) == 21:
+            issuer = data[-8:].hex().upper()
+    key_expiration = None
+    for kind, data in _subpackets(hashed):
+        if kind == _SUBPACKET_KEY_EXPIRATION and len(data) == 4:
+            key_expiration = int.from_bytes(data, "big")
+    return SignatureInfo(4, body[1], body[2], body[3], issuer, key_expiration, body)
+
+
+def scan_key(armored: str) -> tuple[KeyInfo, list[KeyInfo]]:
+    """Return the primary key and subkeys of an armored public key."""
+    cert = scan_cert(armored)
+    return cert.primary, cert.subkeys
+
+
+def scan_cert(armored: str) -> CertInfo:
+    """Return the keys of an armored public key and what its signatures say."""
+    primary = None
+    subkeys = []
+    bindings = {}
+    expirations = set()
+    revoked = False
+    under_user_id = False
+    for tag, body in packets(dearmor(armored, "PUBLIC KEY BLOCK")):
+        if tag == TAG_PUBLIC_KEY:
+            if primary is not None:
+                raise PacketError("More than one primary key")
+            primary = parse_public_key(body)
+        elif primary is None:
+            raise PacketError("Key block doesn't start with a primary key")
+        elif tag == TAG_PUBLIC_SUBKEY:
+            subkeys.append(parse_public_key(body))
+            bindings.setdefault(subkeys[-1].key_id, [])
+            under_user_id = False
+        elif tag in (TAG_USER_ID, TAG_USER_ATTRIBUTE):
+            under_user_id = True
+        elif tag == TAG_SIGNATURE:
+            signature = parse_signature(body)
+            if signature.sig_type in _SIG_REVOCATIONS:
+                revoked = True
+            elif signature.sig_type == SIG_SUBKEY_BINDING and subkeys:
+                bindings[subkeys[-1].key_id].append(signature)
+            elif (
+                under_user_id
+                and signature.sig_type in _SIG_CERTIFICATIONS
+                and signature.issuer == primary.key_id
+            ):
+                expirations.add(signature.key_expiration)
+    if primary is None:
+        raise PacketError("No primary key packet")
+    return CertInfo(primary, subkeys, frozenset(expirations), revoked, bindings)
+
+
+def scan_signature(clearsigned: str) -> SignatureInfo:
+    """Return the first signature in a clearsigned message."""
+    return scan_signatures(clearsigned)[0]
+
+
+def scan_signatures(clearsigned: str) -> list[SignatureInfo]:
+    """Return every signature in a clearsigned message."""
+    signatures = [
+        parse_signature(body)
+        for tag, body in packets(dearmor(clearsigned, "SIGNATURE"))
+        if tag == TAG_SIGNATURE
+    ]
+    if not signatures:
+        raise PacketError("No signature packet")
+    return signatures
+
+
+def cleartext(clearsigned: str) -> str:
+    """Return the signed text of a cleartext-signed message (RFC 4880 section 7).
+
+    Dash-escaping is undone and lines are joined with ``\\n``; the line break
+    before the signature armor belongs to the framing, not the text.
+    """
+    lines = iter(clearsigned.replace("\r\n", "\n").split("\n"))
+    for line in lines:
+        if line.strip() == "-----BEGIN PGP SIGNED MESSAGE-----":
+            break
+    else:
+        raise PacketError("Not a cleartext-signed message")
+    # Armor headers ("Hash: ...") end at the first blank line.
+    for line in lines:
+        if not line.strip():
+            break
+        if ": " not in line:
+            raise PacketError("Malformed cleartext armor header")
+    else:
+        raise PacketError("Unterminated cleartext armor headers")
+
+    text = []
+    for line in lines:
+        if line.rstrip() == "-----BEGIN PGP SIGNATURE-----":
+            return "\n".join(text)
+        if line.startswith("- "):
+            line = line[2:]
+        elif line.startswith("-"):
+            raise PacketError("Unescaped dash in cleartext")
+        text.append(line)
+    raise PacketError("No signature after cleartext")
+
+
+def verify_signature(key: KeyInfo, signature: SignatureInfo, text: str) -> bool:
+    """Check ``signature`` over ``text`` with ``key`` using cryptography directly.
+
+    Handles v4 signatures by RSA, ECDSA on the NIST curves and Ed25519 keys,
+    over binary or text documents. Returns whether the signature is good;
+    anything outside that set raises PacketError.
+    """
+    if signature.sig_type == SIG_BINARY:
+        data = text
+    elif signature.sig_type == SIG_TEXT:
+        # Canonical text: trailing whitespace dropped, CRLF line endings.
+        data = "\r\n".join(line.rstrip(" \t") for line in text.split("\n"))
+    else:
+        raise PacketError("Unsupported signature type")
+    try:
+        data = data.encode("utf-8")
+    except UnicodeEncodeError:
+        raise PacketError("Text isn't encodable as UTF-8") from None
+    return _verify(key, signature, data)
+
+
+def verify_binding(primary: KeyInfo, subkey: KeyInfo, signature: SignatureInfo) -> bool:
+    """Check that ``signature`` is ``primary``'s binding of ``subkey`` to it.
+
+    Without one, a subkey packet proves nothing: anyone can append their own key
+    to someone else's as a "subkey". Raises PacketError like verify_signature.
+    """
+    if signature.sig_type != SIG_SUBKEY_BINDING:
+        raise PacketError("Not a subkey binding signature")
+    if signature.issuer not in (None, primary.key_id):
+        return False
+    # The hash covers both key packets, each framed as in the fingerprint.
+    data = b"".join(
+        b"\x99" + len(key.body).to_bytes(2, "big") + key.body
+        for key in (primary, subkey)
+    )
+    return _verify(primary, signature, data)
+
+
+def _verify(key: KeyInfo, signature: SignatureInfo, data: bytes) -> bool:
+    body = signature.body
+    if signature.version != 4 or signature.algorithm != key.algorithm:
+        raise PacketError("Unsupported signature")
+    hash_type = _HASHES.get(signature.hash_algorithm)
+    if hash_type is None:
+        raise PacketError("Unsupported hash algorithm")
+
+    # The hash covers the signed data, then the signature's hashed fields, then a
+    # trailer giving their length.
+    hashed_end = 6 + int.from_bytes(body[4:6], "big")
+    hashed = body[:hashed_end]
+    digest = hashes.Hash(hash_type())
+    digest.update(data)
+    digest.update(hashed)
+    digest.update(b"\x04\xff" + len(hashed).to_bytes(4, "big"))
+    digest = digest.finalize()
+
+    pos = hashed_end + 2 + int.from_bytes(_take(body, hashed_end, 2), "big")
+    if _take(body, pos, 2) != digest[:2]:
+        return False  # The quick check: the leading 16 bits of the hash.
+    values = _mpis(body, pos + 2)
+    material = key.body[6:]
+
+    try:
+        if key.algorithm in (1, 3):  # RSA (encrypt-or-sign, sign-only)
+            n, e = _mpis(material, 0, 2)
+            public_key = rsa.RSAPublicNumbers(
+                int.from_bytes(e, "big"), int.from_bytes(n, "big")
+            ).public_key()
+            s = values[0].rjust(len(n), b"\x00")
+            public_key.verify(s, digest, padding.PKCS1v15(), Prehashed(hash_type()))
+        elif key.algorithm == 19:  # ECDSA
+            oid = _take(material, 1, material[0])
+            curve = _ECDSA_CURVES.get(oid)
+            if curve is None:
+                raise PacketError("Unsupported ECDSA curve")
+            (point,) = _mpis(material, 1 + len(oid), 1)
+            public_key = ec.EllipticCurvePublicKey.from_encoded_point(curve(), point)
+            r, s = (int.from_bytes(v, "big") for v in values[:2])
+            public_key.verify(
+                encode_dss_signature(r, s), digest, ec.ECDSA(Prehashed(hash_type()))
+            )
+        elif key.algorithm == 22:  # EdDSA (the pre-RFC 9580 encoding)
+            oid = _take(material, 1, material[0])
+            (point,) = _mpis(material, 1 + len(oid), 1)
+            if oid != _ED25519_OID or len(point) != 33 or point[0] != 0x40:
+                raise PacketError("Unsupported EdDSA key")
+            public_key = Ed25519PublicKey.from_public_bytes(point[1:])
+            r, s = values[:2]
+            if len(r) > 32 or len(s) > 32:
+                return False
+            # Ed25519 signs the digest itself, not the document.
+            public_key.verify(r.rjust(32, b"\x00") + s.rjust(32, b"\x00"), digest)
+        else:
+            raise PacketError("Unsupported key algorithm")
+    except InvalidSignature:
+        return False
+    except (ValueError, IndexError):
+        # Key material cryptography refuses (bad point, even modulus, ...).
+        raise PacketError("Unusable key material") from None
+    return True
+
+
+def _take(data: bytes, pos: int, length: int) -> bytes:
+    if pos + length > len(data):
+        raise PacketError("Truncated packet")
+    return data[pos : pos + length]
+
+
+def _mpis(data: bytes, pos: int, count: int | None = None) -> list[bytes]:
+    """Read ``count`` multiprecision integers from ``pos`` (or all the rest)."""
+    values = []
+    while pos < len(data) and (count is None or len(values) < count):
+        length = (int.from_bytes(_take(data, pos, 2), "big") + 7) // 8
+        values.append(_take(data, pos + 2, length))
+        pos += 2 + length
+    if count is not None and len(values) < count:
+        raise PacketError("Truncated key material")
+    return values
+
+
+def _new_format_length(data: bytes, pos: int) -> tuple[int, int]:
+    first = _take(data, pos, 1)[0]
+    if first < 192:
+        return first, pos + 1
+    if first < 224:
+        return ((first - 192) << 8) + _take(data, pos + 1, 1)[0] + 192, pos + 2
+    if first == 255:
+        return int.from_bytes(_take(data, pos + 1, 4), "big"), pos + 5
+    # Partial body lengths only occur in literal/compressed data streams.
+    raise PacketError("Partial body length")
+
+
+def _subpackets(data: bytes) -> Iterator[tuple[int, bytes]]:
+    pos = 0
+    while pos < len(data):
+        first = data[pos]
+        if first < 192:
+            length, pos = first, pos + 1
+        elif first < 255:
+            length = ((first - 192) << 8) + _take(data, pos + 1, 1)[0] + 192
+            pos += 2
+        else:
+            length = int.from_bytes(_take(data, pos + 1, 4), "big")
+            pos += 5
+        if length == 0:
+            raise PacketError("Empty subpacket")
+        subpacket = _take(data, pos, length)
+        yield subpacket[0] & 0x7F, subpacket[1:]
+        pos += length
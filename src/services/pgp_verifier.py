@@ -1,6 +1,13 @@
 import pgpy
 import logging
-from pgpy.constants import HashAlgorithm, PubKeyAlgorithm
+import logging.config
+import time
+from pgpy.constants import HashAlgorithm, PubKeyAlgorithm, SignatureType
+
+from . import openpgp
+from .key_cache import KeyCache
+from ..env import KEY_CACHE_SIZE, KEY_CACHE_TTL, VERIFY_BACKEND
+from ..logger import LOGGING_CONFIG
 
 # --- Acceptance policy -------------------------------------------------------
 #
@@ -25,6 +32,20 @@ _RSA_ALGOS = {
 _MIN_RSA_BITS = 2048
 _ALLOWED_ECC_ALGOS = {PubKeyAlgorithm.ECDSA, PubKeyAlgorithm.EdDSA}
 
+# Parsed keys by armor digest, with their key ids and algorithm verdict. Expiry
+# is time-dependent, so it is re-checked on every use rather than cached.
+key_cache = KeyCache(KEY_CACHE_SIZE, KEY_CACHE_TTL)
+
+# Try _fast_verify before pgpy (see VERIFY_BACKEND).
+FAST_PATH = VERIFY_BACKEND != "pgpy"
+
+
+def init_worker(counters):
+    """Verification worker initializer: log the way the app does, and count
+    into the app's key cache stats."""
+    logging.config.dictConfig(LOGGING_CONFIG)
+    key_cache.share_counters(counters)
+
 
 def _signature_policy_ok(signature, logger) -> bool:
     if signature.hash_algorithm in _WEAK_HASHES:
@@ -33,14 +54,21 @@ def _signature_policy_ok(signature, logger) -> bool:
     return True
 
 
-def _key_policy_ok(key, logger) -> bool:
+def _key_policy_ok(key, logger, algorithm_ok=None, cached=False) -> bool:
     if key.is_expired:
         logger.error("Rejected expired key")
         return False
+    if algorithm_ok is None:
+        return _algorithm_policy_ok(key.key_algorithm, key.key_size, logger)
+    # A fresh verdict was logged with its reason as the key was parsed.
+    if not algorithm_ok and cached:
+        logger.error("Rejected key by its cached policy verdict")
+    return algorithm_ok
 
-    algo = key.key_algorithm
+
+def _algorithm_policy_ok(algo, key_size, logger) -> bool:
     if algo in _RSA_ALGOS:
-        if (key.key_size or 0) < _MIN_RSA_BITS:
+        if (key_size or 0) < _MIN_RSA_BITS:
             logger.error(f"Rejected RSA key smaller than {_MIN_RSA_BITS} bits")
             return False
         return True
@@ -51,6 +79,141 @@ def _key_policy_ok(key, logger) -> bool:
     return False
 
 
+def _scan(public_key_str, clearsigned_str):
+    """Return ``(cert, signatures)`` read from the raw packets, or None if the
+    scanner can't read them. Done once per login, for both _prescan_ok and
+    _fast_verify."""
+    try:
+        return (
+            openpgp.scan_cert(public_key_str),
+            openpgp.scan_signatures(clearsigned_str),
+        )
+    except openpgp.PacketError:
+        return None
+
+
+def _prescan_ok(scanned, logger) -> bool:
+    """Apply the policy to the raw packets, before any pgpy parsing.
+
+    Catches weak/unsupported keys, weak hashes and a signer that isn't in the
+    key for the cost of a base64 decode. Input the scanner can't read is passed
+    through: pgpy stays the authority and re-checks everything.
+    """
+    if scanned is None:
+        return True
+    cert, signatures = scanned
+    primary, signature = cert.primary, signatures[0]
+
+    known_ids = {primary.key_id} | {subkey.key_id for subkey in cert.subkeys}
+    if signature.issuer is not None and signature.issuer not in known_ids:
+        logger.error(f"Key id in signature not found in public key")
+        return False
+    if not _algorithm_policy_ok(primary.algorithm, primary.bits, logger):
+        return False
+    if signature.hash_algorithm in _WEAK_HASHES:
+        logger.error(f"Rejected weak signature hash: {signature.hash_algorithm}")
+        return False
+    return True
+
+
+def _fast_verify(scanned, clearsigned_str, expected_challenge, logger):
+    """Verify a login without pgpy, or return None to let pgpy decide.
+
+    Only ever *accepts*: the same checks as the pgpy path (challenge, signer,
+    policy, expiry) plus a good signature return the fingerprint. Every failure
+    -- and every input the scanner can't vouch for, such as revoked keys or
+    self-signatures that disagree about expiry -- returns None, so pgpy remains
+    the one that rejects and logs why.
+    """
+    if scanned is None:
+        return None
+    cert, signatures = scanned
+    try:
+        text = openpgp.cleartext(clearsigned_str)
+    except openpgp.PacketError:
+        return None
+    if len(signatures) != 1 or cert.revoked or len(cert.expirations) > 1:
+        return None
+    signature = signatures[0]
+
+    if text.strip() != expected_challenge.strip():
+        return None
+    primary = cert.primary
+    keys = {key.key_id: key for key in (primary, *cert.subkeys)}
+    signer = keys.get(signature.issuer)
+    if signer is None:
+        return None
+    if signer is not primary and not _bound(primary, signer, cert):
+        return None
+
+    # pgpy treats a zero expiration as expiring at creation; leave that to it.
+    (expiration,) = cert.expirations or {None}
+    if expiration == 0 or (
+        expiration is not None and primary.created + expiration <= time.time()
+    ):
+        return None
+    if signature.hash_algorithm in _WEAK_HASHES or not _algorithm_policy_ok(
+        primary.algorithm, primary.bits, logger
+    ):
+        return None
+
+    try:
+        if openpgp.verify_signature(signer, signature, text):
+            return primary.fingerprint
+    except openpgp.PacketError:
+        pass
+    return None
+
+
+def _bound(primary, subkey, cert) -> bool:
+    """Whether the primary key has signed a binding for ``subkey``."""
+    for binding in cert.bindings.get(subkey.key_id, ()):
+        try:
+            if openpgp.verify_binding(primary, subkey, binding):
+                return True
+        except openpgp.PacketError:
+            pass
+    return False
+
+
+def _bound_subkeys(key):
+    """Key ids of the subkeys ``key`` has signed a valid binding signature for.
+
+    pgpy accepts any subkey packet in the block as one of the key's own, so a
+    key pasted with someone else's key appended as a "subkey" would otherwise
+    sign for it.
+    """
+    bound = set()
+    for key_id, subkey in key.subkeys.items():
+        for signature in subkey.__sig__:
+            if (
+                signature.type != SignatureType.Subkey_Binding
+                or signature.signer != key.fingerprint.keyid
+            ):
+                continue
+            try:
+                if key.verify(subkey, signature):
+                    bound.add(key_id)
+                    break
+            except Exception:
+                # A binding pgpy can't check binds nothing.
+                continue
+    return bound
+
+
+def _load_key(public_key_str, logger):
+    """Return ``(key, known_ids, algorithm_ok, cached)``, parsing only on a cache
+    miss; ``cached`` says whether it was a hit."""
+    cached = key_cache.get(public_key_str)
+    if cached is not None:
+        return (*cached, True)
+    key, _ = pgpy.PGPKey.from_blob(public_key_str)
+    known_ids = frozenset({key.fingerprint.keyid} | _bound_subkeys(key))
+    algorithm_ok = _algorithm_policy_ok(key.key_algorithm, key.key_size, logger)
+    key_cache.put(public_key_str, (key, known_ids, algorithm_ok))
+    return key, known_ids, algorithm_ok, False
+
+
 def verify_login(public_key_str, clearsigned_str, expected_challenge):
     logger = logging.getLogger(__name__)
     try:
@@ -59,7 +222,19 @@ def verify_login(public_key_str, clearsigned_str, expected_challenge):
         )
         public_key_str = public_key_str.replace("\u202f", " ").strip()
 
-        key, _ = pgpy.PGPKey.from_blob(public_key_str)
+        scanned = _scan(public_key_str, clearsigned_str)
+        if not _prescan_ok(scanned, logger):
+            return False, None
+
+        if FAST_PATH:
+            fingerprint = _fast_verify(
+                scanned, clearsigned_str, expected_challenge, logger
+            )
+            if fingerprint is not None:
+                logger.info("Verification result: verified (fast path)")
+                return True, fingerprint
+
+        key, known_ids, algorithm_ok, cached = _load_key(public_key_str, logger)
         msg = pgpy.PGPMessage.from_blob(clearsigned_str)
 
         if str(msg.message).strip() != expected_challenge.strip():
@@ -71,16 +246,14 @@ def verify_login(public_key_str, clearsigned_str, expected_challenge):
             return False, None
 
         signer_id = msg.signatures[0].signer
-        known_ids = {key.fingerprint.keyid} | set(key.subkeys)
 
         if signer_id not in known_ids:
             logger.error(f"Key id in signature not found in public key")
             return False, None
 
         # Enforce the strength policy before trusting the signature.
-        if not _key_policy_ok(key, logger) or not _signature_policy_ok(
-            msg.signatures[0], logger
-        ):
+        key_ok = _key_policy_ok(key, logger, algorithm_ok, cached)
+        if not key_ok or not _signature_policy_ok(msg.signatures[0], logger):
             return False, None
 
         verification = key.verify(msg)
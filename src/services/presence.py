@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Each user's entry is a Redis hash ``presence:<fingerprint>`` mapping the id of
+# every node holding a socket for them to the wall-clock time that claim lapses.
+# A node re-asserts its claims every HEARTBEAT_INTERVAL; a node that dies simply
+# stops, and its claims are ignored once PRESENCE_TTL has passed (the whole key
+# expires when no node refreshes it).
+_KEY_PREFIX = "presence:"
+HEARTBEAT_INTERVAL = 10  # seconds
+PRESENCE_TTL = 30  # seconds
+
+# Lookups are cached in-process so a hot conversation doesn't pay a Redis round
+# trip per frame. Kept short: a peer who connects elsewhere becomes reachable
+# within this window. Local connects/disconnects invalidate immediately.
+LOOKUP_CACHE_TTL = 1.0  # seconds
+LOOKUP_CACHE_SIZE = 10_000
+
+
+class PresenceRegistry:
+    """Cluster-wide directory of which node(s) hold each user's socket."""
+
+    def __init__(
+        self,
+        redis_client,
+        node_id: str,
+        ttl: int = PRESENCE_TTL,
+        heartbeat_interval: float = HEARTBEAT_INTERVAL,
+        cache_ttl: float = LOOKUP_CACHE_TTL,
+        cache_size: int = LOOKUP_CACHE_SIZE,
+    ):
+        self.redis = redis_client
+        self.node_id = node_id
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._cache: dict[str, tuple[float, frozenset[str]]] = {}
+        self._task = None
+
+    async def start(self, local_users):
+        """Start heartbeating the users returned by ``local_users()``."""
+        self._task = asyncio.create_task(self._heartbeat(local_users))
+
+    async def stop(self, local_users=()):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Withdraw our claims on a clean shutdown rather than waiting for them
+        # to lapse, so peers stop routing to us straight away.
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id in local_users:
+                pipe.hdel(_KEY_PREFIX + user_id, self.node_id)
+            await pipe.execute()
+
+    async def add(self, user_id: str):
+        self._cache.pop(user_id, None)
+        await self._claim([user_id])
+
+    async def remove(self, user_id: str):
+        self._cache.pop(user_id, None)
+        await self.redis.hdel(_KEY_PREFIX + user_id, self.node_id)
+
+    async def nodes_for(self, user_id: str) -> frozenset[str]:
+        """Ids of the nodes currently holding a socket for ``user_id``."""
+        now = time.monotonic()
+        cached = self._cache.get(user_id)
+        if cached is not None and now - cached[0] < self.cache_ttl:
+            return cached[1]
+
+        claims = await self.redis.hgetall(_KEY_PREFIX + user_id)
+        wall_now = time.time()
+        nodes = frozenset(
+            node for node, expires in claims.items() if float(expires) > wall_now
+        )
+
+        if len(self._cache) >= self.cache_size:
+            # Dicts keep insertion order, so this drops the oldest entry.
+            del self._cache[next(iter(self._cache))]
+        self._cache[user_id] = (now, nodes)
+        return nodes
+
+    async def _claim(self, user_ids):
+        expires = time.time() + self.ttl
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                key = _KEY_PREFIX + user_id
+                pipe.hset(key, self.node_id, expires)
+                pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def _heartbeat(self, local_users):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self._claim(list(local_users()))
+            except Exception as e:
+                # Claims lapse on their own if this keeps failing; just retry.
+                logger.error(f"Presence heartbeat failed: {e}")
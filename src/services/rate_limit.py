@@ -1,7 +1,114 @@
+import asyncio
+import hashlib
 import ipaddress
+import logging
 import time
+from collections import OrderedDict
+from typing import NamedTuple
 
 from fastapi import Request
+from redis.exceptions import NoScriptError, RedisError
+
+logger = logging.getLogger(__name__)
+
+# Algorithms a scope can be limited with.
+#
+# FIXED_WINDOW counts requests per aligned ``window``-second bucket. Cheap and
+# simple, but a client can spend a full budget at the end of one bucket and
+# another at the start of the next: 2x ``limit`` in a moment.
+#
+# GCRA (generic cell rate algorithm) stores one timestamp per key -- the
+# theoretical arrival time (TAT) of the next request if the client paced itself
+# at ``limit`` per ``window``. A request is allowed while the TAT is no more
+# than ``burst`` intervals ahead of now, so at most ``burst`` requests ever
+# arrive back-to-back and the sustained rate is ``limit`` per ``window``, with
+# no window boundary to game.
+FIXED_WINDOW = "fixed"
+GCRA = "gcra"
+
+# Charges every scope in one atomic round trip with ``admitted`` hits a worker
+# has already let through (see LocalRateLimiter) plus ``cost`` new requests to
+# decide on. A fixed-window counter has its expiry armed when it is created, in
+# the same script, so a crash can't leave a counter that never expires; a GCRA
+# key expires once its TAT has passed. A rejected GCRA request is not recorded,
+# so hammering a limited key doesn't extend the penalty -- but admitted hits
+# always are, whatever the verdict, or the other workers would never see them.
+#
+# In "first" mode it stops at the first scope over its limit -- later scopes are
+# not charged for a request that is rejected anyway -- and returns that scope's
+# 1-based index, or 0. In "each" mode it charges every scope and returns a list
+# of 0/1 over-limit flags, one per key.
+#   ARGV[1] = now (ms), ARGV[2] = mode
+#   ARGV[6i-3 .. 6i+2] = algorithm, limit, window (s), burst, admitted, cost
+#   for KEYS[i]
+_LIMITER_SCRIPT = """
+local now = tonumber(ARGV[1])
+local each = ARGV[2] == "each"
+local verdicts = {}
+for i, key in ipairs(KEYS) do
+    local base = 6 * i - 3
+    local limit = tonumber(ARGV[base + 1])
+    local window = tonumber(ARGV[base + 2])
+    local admitted = tonumber(ARGV[base + 4])
+    local cost = tonumber(ARGV[base + 5])
+    local over
+    if ARGV[base] == "gcra" then
+        local interval = window * 1000 / limit
+        local tat = tonumber(redis.call("GET", key) or now)
+        if tat < now then
+            tat = now
+        end
+        tat = tat + admitted * interval
+        local new_tat = tat + cost * interval
+        over = new_tat - now > tonumber(ARGV[base + 3]) * interval
+        if not over then
+            tat = new_tat
+        end
+        if tat > now then
+            redis.call("SET", key, tat, "PX", math.ceil(tat - now))
+        end
+    else
+        local count = redis.call("INCRBY", key, admitted + cost)
+        if count == admitted + cost then
+            -- Slightly over the window to tolerate clock skew.
+            redis.call("EXPIRE", key, window + 1)
+        end
+        over = count > limit
+    end
+    if over and not each then
+        return i
+    end
+    verdicts[i] = over and 1 or 0
+end
+if each then
+    return verdicts
+end
+return 0
+"""
+_LIMITER_SHA = hashlib.sha1(_LIMITER_SCRIPT.encode()).hexdigest()
+
+
+class Limit(NamedTuple):
+    """One rate-limit scope: a key and the budget it is held to."""
+
+    key: str
+    limit: int
+    window: int
+    algorithm: str = FIXED_WINDOW
+    # GCRA only: how many requests may arrive back-to-back. Defaults to
+    # ``limit``; lower it to smooth bursts further.
+    burst: int | None = None
+
+
+def _make_limit(
+    name: str, limit: int, window: int, algorithm: str, burst: int | None
+) -> Limit:
+    if algorithm == GCRA:
+        # One TAT per key, so no time bucket in the name.
+        return Limit(f"rl:gcra:{name}", limit, window, GCRA, burst)
+    if algorithm != FIXED_WINDOW:
+        raise ValueError(f"Unknown rate-limit algorithm: {algorithm}")
+    return Limit(f"rl:{name}:{int(time.time()) // window}", limit, window)
 
 
 def client_ip(request: Request) -> str:
@@ -16,20 +123,105 @@ def client_ip(request: Request) -> str:
     return "unknown"
 
 
-def _is_public(ip: str) -> bool:
+def is_public_ip(ip: str) -> bool:
     try:
         return ipaddress.ip_address(ip).is_global
     except ValueError:
         return False
 
 
-def is_rate_limited(
-    redis_client, ip: str, scope: str, limit: int, window: int
+def ip_limit(
+    ip: str,
+    scope: str,
+    limit: int,
+    window: int,
+    algorithm: str = FIXED_WINDOW,
+    burst: int | None = None,
+) -> Limit | None:
+    """Per-IP limit for ``scope``, or None if ``ip`` is exempt.
+
+    Only public (globally routable) IPs are limited; see :func:`is_rate_limited`.
+    """
+    if not is_public_ip(ip):
+        return None
+    return _make_limit(f"{scope}:{ip}", limit, window, algorithm, burst)
+
+
+def global_limit(
+    scope: str,
+    limit: int,
+    window: int,
+    algorithm: str = FIXED_WINDOW,
+    burst: int | None = None,
+) -> Limit:
+    """Server-wide limit for ``scope``, not keyed on client IP."""
+    return _make_limit(f"global:{scope}", limit, window, algorithm, burst)
+
+
+async def is_any_rate_limited(redis_client, *limits: Limit | None) -> bool:
+    """Charge one request against every given scope in a single round trip.
+
+    Returns True as soon as any scope is over its limit. ``None`` entries
+    (exempt scopes, see :func:`ip_limit`) are skipped.
+    """
+    limits = [limit for limit in limits if limit is not None]
+    if not limits:
+        return False
+    return bool(await _charge(redis_client, limits, [0] * len(limits), 1, "first"))
+
+
+async def load_scripts(redis_client):
+    """Preload the limiter into Redis' script cache at startup.
+
+    Not required for correctness -- a cache miss falls back to sending the
+    script body -- so a Redis that is down at boot is logged, not fatal.
+    """
+    try:
+        await redis_client.script_load(_LIMITER_SCRIPT)
+    except RedisError as e:
+        logger.error(f"Could not preload rate-limit script: {e}")
+
+
+def _capacity(limit: Limit) -> int:
+    """Most requests ``limit`` lets through back-to-back."""
+    if limit.algorithm == GCRA and limit.burst is not None:
+        return limit.burst
+    return limit.limit
+
+
+async def _charge(
+    redis_client, limits: list[Limit], admitted: list[int], cost: int, mode: str
+):
+    keys = [limit.key for limit in limits]
+    args = [int(time.time() * 1000), mode]
+    for limit, hits in zip(limits, admitted):
+        args += [limit.algorithm, limit.limit, limit.window, _capacity(limit)]
+        args += [hits, cost]
+    return await _run_limiter(redis_client, keys, args)
+
+
+async def _run_limiter(redis_client, keys: list[str], args: list):
+    try:
+        return await redis_client.evalsha(_LIMITER_SHA, len(keys), *keys, *args)
+    except NoScriptError:
+        # Script cache was flushed (Redis restart, SCRIPT FLUSH). EVAL runs the
+        # body and re-caches it, so the next call is back on EVALSHA.
+        return await redis_client.eval(_LIMITER_SCRIPT, len(keys), *keys, *args)
+
+
+async def is_rate_limited(
+    redis_client,
+    ip: str,
+    scope: str,
+    limit: int,
+    window: int,
+    algorithm: str = FIXED_WINDOW,
 ) -> bool:
-    """Fixed-window per-IP rate limit backed by Redis.
+    """Per-IP rate limit backed by Redis.
 
-    Returns True when the caller has exceeded ``limit`` requests within the
-    current ``window`` (seconds) for the given ``scope``.
+    Returns True when the caller has exceeded ``limit`` requests within a
+    ``window`` (seconds) for the given ``scope``, counted with ``algorithm``
+    (:data:`FIXED_WINDOW` or :data:`GCRA`).
 
     Only public (globally routable) IPs are limited. Onion traffic arrives via
     the local Tor daemon and internal calls come from private ranges, so they
@@ -37,17 +229,15 @@ def is_rate_limited(
     user out at once. Those paths are defended by Tor's onion-service PoW and
     the server-wide --limit-concurrency cap instead.
     """
-    if not _is_public(ip):
-        return False
+    return await is_any_rate_limited(
+        redis_client, ip_limit(ip, scope, limit, window, algorithm)
+    )
 
-    key = f"rl:{scope}:{ip}:{int(time.time()) // window}"
-    return _incr_and_check(redis_client, key, limit, window)
 
-
-def is_globally_rate_limited(
-    redis_client, scope: str, limit: int, window: int
+async def is_globally_rate_limited(
+    redis_client, scope: str, limit: int, window: int, algorithm: str = FIXED_WINDOW
 ) -> bool:
-    """Fixed-window rate limit that is NOT keyed on client IP.
+    """Rate limit that is NOT keyed on client IP.
 
     The per-IP limiter exempts private/loopback addresses, which means all
     onion traffic (arriving via the local Tor daemon) shares one exempt
@@ -57,14 +247,180 @@ def is_globally_rate_limited(
     they saturate the verification threadpool, while normal usage stays well
     under the cap. It complements -- does not replace -- the per-IP limiter.
     """
-    key = f"rl:global:{scope}:{int(time.time()) // window}"
-    return _incr_and_check(redis_client, key, limit, window)
+    return await is_any_rate_limited(
+        redis_client, global_limit(scope, limit, window, algorithm)
+    )
+
+
+# --- In-process pre-filter ----------------------------------------------------
+#
+# Nearly every request is far under its limits, so a Redis round trip to learn
+# that is mostly wasted. LocalRateLimiter answers those cases in-process and
+# only consults Redis near a limit, charging the hits it accepted locally in
+# periodic batches.
+
+# Scope keys tracked per worker before the least recently used is evicted.
+LOCAL_MAX_KEYS = 10_000
+# A request is accepted locally only while its buckets stay above this fraction
+# of capacity; below it, every request is checked against Redis.
+LOCAL_SYNC_THRESHOLD = 0.5
+# How often locally accepted hits are charged to Redis.
+LOCAL_FLUSH_INTERVAL = 1.0  # seconds
+
+
+class _Bucket:
+    __slots__ = ("limit", "tokens", "updated", "pending")
+
+    def __init__(self, limit: Limit, now: float):
+        self.limit = limit
+        self.tokens = float(_capacity(limit))
+        self.updated = now
+        # Hits accepted locally that Redis hasn't been charged for yet.
+        self.pending = 0
+
+    def refill(self, now: float):
+        rate = self.limit.limit / self.limit.window
+        elapsed = now - self.updated
+        self.tokens = min(_capacity(self.limit), self.tokens + elapsed * rate)
+        self.updated = now
+
+
+class LocalRateLimiter:
+    """Token-bucket pre-filter in front of the Redis limiter.
+
+    Each scope key gets a local token bucket refilling at the scope's rate:
+
+    * bucket empty: this worker alone has seen the scope exceed its rate, so
+      the cluster-wide count is over too -- deny without asking Redis;
+    * bucket comfortably full (above ``sync_threshold``): accept, and queue the
+      hit for the next batched charge to Redis;
+    * otherwise (near the limit): charge Redis now, pending hits included, and
+      let it decide. A Redis denial drains the local bucket, so the key is then
+      denied locally until it refills.
+
+    Limits are therefore approximately cluster-wide: across N workers a scope
+    can overshoot by about N * (1 - sync_threshold) * capacity per flush
+    interval before the batched charges catch up.
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        max_keys: int = LOCAL_MAX_KEYS,
+        sync_threshold: float = LOCAL_SYNC_THRESHOLD,
+        flush_interval: float = LOCAL_FLUSH_INTERVAL,
+    ):
+        self.redis = redis_client
+        self.max_keys = max_keys
+        self.sync_threshold = sync_threshold
+        self.flush_interval = flush_interval
+        self._buckets: OrderedDict[str, _Bucket] = OrderedDict()
+        # Evicted buckets that still owe Redis some hits.
+        self._evicted: list[_Bucket] = []
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except RedisError as e:
+            logger.error(f"Final rate-limit flush failed: {e}")
+
+    async def is_limited(self, *limits: Limit | None) -> bool:
+        """Like :func:`is_any_rate_limited`, answered locally when obvious."""
+        limits = [limit for limit in limits if limit is not None]
+        if not limits:
+            return False
+
+        now = time.monotonic()
+        buckets = [self._bucket(limit, now) for limit in limits]
+        if any(bucket.tokens < 1 for bucket in buckets):
+            return True
+        if all(
+            bucket.tokens - 1 >= self.sync_threshold * _capacity(bucket.limit)
+            for bucket in buckets
+        ):
+            for bucket in buckets:
+                bucket.tokens -= 1
+                bucket.pending += 1
+            return False
+
+        # Near a limit: Redis decides, and is charged everything we owe it.
+        pending = self._take_pending(buckets)
+        try:
+            over = await _charge(self.redis, limits, pending, 1, "first")
+        except Exception:
+            self._restore_pending(buckets, pending)
+            raise
+        if not over:
+            for bucket in buckets:
+                bucket.tokens -= 1
+            return False
+        buckets[over - 1].tokens = 0
+        # Scopes after the rejecting one were never charged.
+        self._restore_pending(buckets[over:], pending[over:])
+        return True
+
+    async def flush(self):
+        """Charge Redis for every hit accepted locally since the last flush."""
+        buckets = [bucket for bucket in self._buckets.values() if bucket.pending]
+        buckets += self._evicted
+        self._evicted = []
+        if not buckets:
+            return
+        pending = self._take_pending(buckets)
+        try:
+            verdicts = await _charge(
+                self.redis, [bucket.limit for bucket in buckets], pending, 0, "each"
+            )
+        except Exception:
+            self._restore_pending(buckets, pending)
+            raise
+        for bucket, over in zip(buckets, verdicts):
+            if over:
+                bucket.tokens = 0
+
+    def _bucket(self, limit: Limit, now: float) -> _Bucket:
+        bucket = self._buckets.get(limit.key)
+        if bucket is not None:
+            self._buckets.move_to_end(limit.key)
+            bucket.refill(now)
+            return bucket
+        bucket = self._buckets[limit.key] = _Bucket(limit, now)
+        if len(self._buckets) > self.max_keys:
+            _, evicted = self._buckets.popitem(last=False)
+            if evicted.pending:
+                self._evicted.append(evicted)
+        return bucket
+
+    @staticmethod
+    def _take_pending(buckets: list[_Bucket]) -> list[int]:
+        # Claimed before awaiting Redis so hits accepted meanwhile are kept for
+        # the next charge instead of being wiped when this one completes.
+        pending = [bucket.pending for bucket in buckets]
+        for bucket in buckets:
+            bucket.pending = 0
+        return pending
 
+    @staticmethod
+    def _restore_pending(buckets: list[_Bucket], pending: list[int]):
+        for bucket, hits in zip(buckets, pending):
+            bucket.pending += hits
 
-def _incr_and_check(redis_client, key: str, limit: int, window: int) -> bool:
-    count = redis_client.incr(key)
-    if count == 1:
-        # First hit in this window: set the key to expire so buckets don't
-        # accumulate. Slightly over the window to tolerate clock skew.
-        redis_client.expire(key, window + 1)
-    return count > limit
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                # Pending hits were restored; the next flush retries them.
+                logger.error(f"Rate-limit flush failed: {e}")
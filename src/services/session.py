@@ -4,7 +4,7 @@ import logging
 import secrets
 import time
 
-from ..env import SECRET_KEY, ENVIRONMENT, SESSION_LIFETIME
+from ..env import SECRET_KEY, ENVIRONMENT, SESSION_LIFETIME, CHALLENGE_LIFETIME
 
 logger = logging.getLogger(__name__)
 
@@ -43,9 +43,14 @@ def _load_key() -> bytes:
 
 _KEY = _load_key()
 
+# Login challenges are signed with a key derived from _KEY rather than _KEY
+# itself, so a challenge token can never be passed off as a session cookie (or
+# vice versa) however their formats happen to line up.
+_CHALLENGE_KEY = hmac.new(_KEY, b"vapour login challenge", hashlib.sha256).digest()
 
-def _signature(value: str) -> str:
-    return hmac.new(_KEY, value.encode(), hashlib.sha256).hexdigest()
+
+def _signature(value: str, key: bytes = _KEY) -> str:
+    return hmac.new(key, value.encode(), hashlib.sha256).hexdigest()
 
 
 def sign_user_id(user_id: str) -> str:
@@ -66,7 +71,9 @@ def unsign_user_id(token: str | None) -> str | None:
     fingerprint, so without verifying the HMAC anyone could impersonate anyone
     by simply setting the cookie. Expired or future-dated tokens are rejected.
     """
-    if not token:
+    # Every token we issue is ASCII; anything else is forged or mangled, and
+    # compare_digest refuses non-ASCII strings with a TypeError.
+    if not token or not token.isascii():
         return None
     payload, _, signature = token.rpartition(".")
     if not payload or not signature:
@@ -85,3 +92,38 @@ def unsign_user_id(token: str | None) -> str | None:
     if age < 0 or age > SESSION_LIFETIME:
         return None
     return user_id
+
+
+def sign_challenge(nonce: str) -> str:
+    """Return a self-authenticating challenge id for ``nonce``.
+
+    Format: ``nonce.expires_at.hmac(nonce.expires_at)``. The login page can be
+    served without writing anything server-side; :func:`unsign_challenge`
+    recovers the nonce, and only a *consumed* challenge needs recording.
+    """
+    payload = f"{nonce}.{int(time.time()) + CHALLENGE_LIFETIME}"
+    return f"{payload}.{_signature(payload, _CHALLENGE_KEY)}"
+
+
+def unsign_challenge(token: str | None) -> str | None:
+    """Return the nonce iff ``token`` is a validly signed, unexpired challenge."""
+    # An untrusted form field: see unsign_user_id.
+    if not token or not token.isascii():
+        return None
+    payload, _, signature = token.rpartition(".")
+    if not payload or not signature:
+        return None
+    if not hmac.compare_digest(signature, _signature(payload, _CHALLENGE_KEY)):
+        return None
+
+    nonce, _, expires_at = payload.rpartition(".")
+    if not nonce or not expires_at:
+        return None
+    try:
+        remaining = int(expires_at) - int(time.time())
+    except ValueError:
+        return None
+    # Also reject expiries further out than we ever issue (clock games).
+    if remaining < 0 or remaining > CHALLENGE_LIFETIME:
+        return None
+    return nonce
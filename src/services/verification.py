@@ -0,0 +1,244 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import signal
+import time
+from collections import deque
+
+from .pgp_verifier import verify_login
+
+logger = logging.getLogger(__name__)
+
+# pgpy is pure Python and holds the GIL, so verifying in a thread still competes
+# with the event loop serving every chat socket. Verification instead runs in a
+# small set of dedicated worker processes. Each worker is its own process (not a
+# shared ProcessPoolExecutor) so one stuck on a hostile key can be killed and
+# replaced without disturbing jobs running on the others.
+#
+# Workers come from a fork server: a clean process started once, which imports
+# pgpy and the verifier up front and forks each worker from there. Forking the
+# app itself would hand every worker -- including replacements forked while
+# serving -- copies of the listening socket, client sockets and Redis
+# connections, and a socket the app closes would stay open until that worker
+# died. The job function is pickled by reference, so it must be importable, and
+# importing it must not build the app (which lives in src.main for that reason).
+FORKSERVER_PRELOAD = ["pgpy", verify_login.__module__]
+_MP_CONTEXT = multiprocessing.get_context("forkserver")
+_MP_CONTEXT.set_forkserver_preload(FORKSERVER_PRELOAD)
+
+
+# Admission lanes. Clearnet logins arrive from public addresses; onion logins
+# all arrive from the local Tor daemon. Each lane queues separately and free
+# workers alternate between them, so a flood on one can't starve the other.
+CLEARNET = "clearnet"
+ONION = "onion"
+
+
+class VerifierBusy(Exception):
+    """Raised when a login can't be verified in time; callers should shed load.
+
+    Either its lane's queue is full, or it waited longer than the pool's queue
+    timeout for a worker.
+    """
+
+
+def _serve(conn, func, initializer, initargs):
+    # Ctrl-C in development is the parent's to handle; it tears us down.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        try:
+            job_id, args = conn.recv()
+        except EOFError:
+            return
+        try:
+            result = func(*args)
+        except Exception:
+            # verify_login already fails closed; this covers anything else.
+            result = (False, None)
+        conn.send((job_id, result))
+
+
+class _Worker:
+    def __init__(self, func, initializer=None, initargs=()):
+        self.conn, child_conn = _MP_CONTEXT.Pipe()
+        self.process = _MP_CONTEXT.Process(
+            target=_serve,
+            args=(child_conn, func, initializer, initargs),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+    async def run(self, job_id: int, args: tuple):
+        loop = asyncio.get_running_loop()
+        self.conn.send((job_id, args))
+        readable = loop.create_future()
+        fd = self.conn.fileno()
+        loop.add_reader(fd, lambda: readable.done() or readable.set_result(None))
+        try:
+            await readable
+        finally:
+            loop.remove_reader(fd)
+        result_id, result = self.conn.recv()
+        if result_id != job_id:
+            raise RuntimeError("Verification worker answered the wrong job")
+        return result
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class VerificationPool:
+    """Run :func:`verify_login` on dedicated worker processes.
+
+    Logins wait for a worker in their lane's queue. At most ``max_pending``
+    verifications per lane may be queued or running; past that, :meth:`verify`
+    raises :class:`VerifierBusy` instead of piling up work, as it does for a
+    login that waited more than ``queue_timeout`` seconds -- by then the client
+    has likely given up, so it is shed before any work is done. Free workers
+    take the next login from each waiting lane in turn. A job still running
+    after ``timeout`` seconds fails closed and its worker is killed and
+    replaced. Each worker calls ``initializer(*initargs)`` once as it starts,
+    as with a ProcessPoolExecutor.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        max_pending: int,
+        timeout: float,
+        func=verify_login,
+        queue_timeout: float | None = None,
+        lanes=(CLEARNET, ONION),
+        initializer=None,
+        initargs=(),
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.func = func
+        self.initializer = initializer
+        self.initargs = tuple(initargs)
+        self.lanes = tuple(lanes)
+        self._idle = None
+        self._all = set()
+        self._waiters = {lane: deque() for lane in self.lanes}
+        self._pending = dict.fromkeys(self.lanes, 0)
+        self._turn = 0
+        self._job_ids = itertools.count()
+
+    @property
+    def pending(self) -> int:
+        return sum(self._pending.values())
+
+    async def start(self):
+        """Spawn the workers up front so the first logins don't pay for it."""
+        if self._idle is not None:
+            return
+        self._idle = [self._spawn() for _ in range(self.workers)]
+
+    async def stop(self):
+        for worker in self._all:
+            worker.kill()
+        self._all.clear()
+        self._idle = None
+        for waiters in self._waiters.values():
+            while waiters:
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    waiter.set_exception(VerifierBusy())
+
+    async def verify(
+        self,
+        public_key: str,
+        clearsigned: str,
+        expected_challenge: str,
+        lane: str = CLEARNET,
+    ):
+        if self._pending[lane] >= self.max_pending:
+            raise VerifierBusy()
+        await self.start()
+        self._pending[lane] += 1
+        try:
+            worker = await self._acquire(lane)
+            try:
+                return await asyncio.wait_for(
+                    worker.run(
+                        next(self._job_ids),
+                        (public_key, clearsigned, expected_challenge),
+                    ),
+                    self.timeout,
+                )
+            except BaseException as e:
+                # Whatever interrupted the job -- timeout, a dead worker, or the
+                # request being cancelled -- the worker may still be mid-job and
+                # must never hand that stale result to the next caller.
+                self._retire(worker)
+                worker = self._spawn()
+                if isinstance(e, asyncio.TimeoutError):
+                    logger.error(
+                        f"Verification exceeded {self.timeout}s; worker recycled"
+                    )
+                    return False, None
+                if isinstance(e, Exception):
+                    logger.error(f"Verification worker failed: {e}")
+                    return False, None
+                raise
+            finally:
+                self._release(worker)
+        finally:
+            self._pending[lane] -= 1
+
+    async def _acquire(self, lane: str) -> _Worker:
+        if self._idle and not any(self._waiters.values()):
+            return self._idle.pop()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[lane].append(waiter)
+        queued_at = time.monotonic()
+        try:
+            return await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            waited = time.monotonic() - queued_at
+            logger.warning(f"Shed a {lane} login after {waited:.1f}s in the queue")
+            raise VerifierBusy() from None
+        except BaseException:
+            # Cancelled just as a worker was handed over: pass it on.
+            if waiter.done() and not waiter.cancelled() and not waiter.exception():
+                self._release(waiter.result())
+            raise
+        finally:
+            if waiter in self._waiters[lane]:
+                self._waiters[lane].remove(waiter)
+
+    def _release(self, worker: _Worker):
+        """Hand ``worker`` to the next waiting lane in turn, or park it."""
+        if worker not in self._all:
+            return  # Retired, or the pool was stopped meanwhile.
+        if self._idle is None:
+            self._retire(worker)  # A replacement spawned after stop().
+            return
+        for offset in range(len(self.lanes)):
+            index = (self._turn + offset) % len(self.lanes)
+            waiters = self._waiters[self.lanes[index]]
+            while waiters:
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(worker)
+                    self._turn = index + 1
+                    return
+        self._idle.append(worker)
+
+    def _spawn(self) -> _Worker:
+        worker = _Worker(self.func, self.initializer, self.initargs)
+        self._all.add(worker)
+        return worker
+
+    def _retire(self, worker: _Worker):
+        self._all.discard(worker)
+        worker.kill()
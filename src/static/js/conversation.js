@@ -4,9 +4,19 @@
 // strict script-src 'self' Content-Security-Policy.
 const VAPOUR_SCRIPT = document.currentScript;
 
+// Offered to the server so encrypted messages can travel as raw bytes instead
+// of JSON arrays of numbers. A binary frame is:
+//   kind (1 byte) | fingerprint (20 bytes) | iv length (1 byte) | iv | ciphertext
+// Key exchange (and everything from a server without it) stays JSON text.
+const BINARY_PROTOCOL = "vapour.bin.v1";
+const FRAME_ENCRYPTED_TEXT = 0x01;  // Ours, fingerprint = recipient.
+const FRAME_DELIVERED = 0x02;       // To us, fingerprint = sender.
+const FRAME_ECHO = 0x03;            // Ours echoed back, fingerprint = recipient.
+
 window.startChat = function(userId, recipientId) {
     const wsProtocol = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
-    const ws = new WebSocket(wsProtocol + window.location.host + "/chat/ws/" + userId);
+    const ws = new WebSocket(wsProtocol + window.location.host + "/chat/ws/" + userId, [BINARY_PROTOCOL]);
+    ws.binaryType = "arraybuffer";
     const recipient = recipientId;
     const messagesDiv = document.getElementById('messages');
     const messageInput = document.getElementById('messageText');
@@ -38,6 +48,48 @@ window.startChat = function(userId, recipientId) {
         return JSON.stringify(value);
     }
 
+    function fingerprintToBytes(fingerprint) {
+        const bytes = new Uint8Array(20);
+        for (let i = 0; i < 20; i++) {
+            bytes[i] = parseInt(fingerprint.substr(i * 2, 2), 16);
+        }
+        return bytes;
+    }
+
+    function bytesToFingerprint(bytes) {
+        return Array.from(bytes, (b) => b.toString(16).padStart(2, "0")).join("").toUpperCase();
+    }
+
+    function encodeEncryptedText(target, content) {
+        const frame = new Uint8Array(22 + content.iv.length + content.ciphertext.length);
+        frame[0] = FRAME_ENCRYPTED_TEXT;
+        frame.set(fingerprintToBytes(target), 1);
+        frame[21] = content.iv.length;
+        frame.set(content.iv, 22);
+        frame.set(content.ciphertext, 22 + content.iv.length);
+        return frame;
+    }
+
+    // Read a binary frame into the same shape as its JSON equivalent.
+    function decodeEncryptedText(buffer) {
+        const frame = new Uint8Array(buffer);
+        if (frame.length < 23) {
+            return {};
+        }
+        const ivEnd = 22 + frame[21];
+        const data = {
+            type: "encrypted_text",
+            content: { iv: frame.subarray(22, ivEnd), ciphertext: frame.subarray(ivEnd) }
+        };
+        const peer = bytesToFingerprint(frame.subarray(1, 21));
+        if (frame[0] === FRAME_DELIVERED) {
+            data.sender = peer;
+        } else if (frame[0] === FRAME_ECHO) {
+            data.recipient = peer;
+        }
+        return data;
+    }
+
     function formatSafetyNumber(digest) {
         const bytes = new Uint8Array(digest);
         const groups = [];
@@ -159,8 +211,8 @@ window.startChat = function(userId, recipientId) {
         );
         
         return {
-            iv: Array.from(iv),
-            ciphertext: Array.from(new Uint8Array(encrypted))
+            iv: iv,
+            ciphertext: new Uint8Array(encrypted)
         };
     }
 
@@ -197,7 +249,9 @@ window.startChat = function(userId, recipientId) {
     };
 
     ws.onmessage = async function(event) {
-        const data = JSON.parse(event.data);
+        const data = event.data instanceof ArrayBuffer
+            ? decodeEncryptedText(event.data)
+            : JSON.parse(event.data);
 
         // Case 1: Received a public key
         if (data.type === 'key_exchange' && data.publicKey && data.sender === recipient) {
@@ -247,11 +301,18 @@ window.startChat = function(userId, recipientId) {
 
         const encryptedContent = await encryptMessage(messageText);
 
-        ws.send(JSON.stringify({
-            target_user: recipient,
-            type: 'encrypted_text',
-            content: encryptedContent
-        }));
+        if (ws.protocol === BINARY_PROTOCOL) {
+            ws.send(encodeEncryptedText(recipient, encryptedContent));
+        } else {
+            ws.send(JSON.stringify({
+                target_user: recipient,
+                type: 'encrypted_text',
+                content: {
+                    iv: Array.from(encryptedContent.iv),
+                    ciphertext: Array.from(encryptedContent.ciphertext)
+                }
+            }));
+        }
         messageInput.value = '';
     }
     
@@ -0,0 +1,47 @@
+import asyncio
+import logging
+
+from .env import STATS_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+class StatsReporter:
+    """Log each source's counters every ``interval`` seconds.
+
+    ``sources`` maps a component name to a callable returning a flat dict of
+    counters (``KeyCache.stats``, ``ConnectionManager.queue_stats``); each is
+    logged as one "Stats" line with the counters as fields.
+    """
+
+    def __init__(self, sources: dict, interval: float = STATS_INTERVAL):
+        self.sources = dict(sources)
+        self.interval = interval
+        self._task = None
+
+    async def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._report())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def report(self):
+        for component, stats in self.sources.items():
+            try:
+                fields = stats()
+            except Exception:
+                logger.exception(f"Stats for {component} failed")
+                continue
+            logger.info("Stats", extra={"component": component, **fields})
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.report()
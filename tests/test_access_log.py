@@ -0,0 +1,200 @@
+import asyncio
+import sys
+import os
+import unittest
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
+from fastapi.staticfiles import StaticFiles
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.access_log import (
+    AccessLog,
+    AccessLogMiddleware,
+    UNMATCHED,
+    parse_sample_rates,
+)
+from src.middleware import SecurityMiddleware
+
+FINGERPRINT = "497472E4EADD6B41F735D437F8FC9A8BDC9CF796"
+STATIC = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src/static"))
+
+
+def make_app(access_log):
+    app = FastAPI()
+    app.add_middleware(SecurityMiddleware, max_body_bytes=16)
+    app.add_middleware(AccessLogMiddleware, access_log=access_log)
+    app.mount("/static", StaticFiles(directory=STATIC), name="static")
+
+    @app.get("/")
+    async def index():
+        return PlainTextResponse("hi")
+
+    @app.get("/chat/{recipient_id}")
+    async def chat(recipient_id: str):
+        return PlainTextResponse(recipient_id)
+
+    @app.post("/login")
+    async def login():
+        raise HTTPException(status_code=401)
+
+    @app.get("/boom")
+    async def boom():
+        raise RuntimeError("boom")
+
+    return app
+
+
+def call(app, method="GET", path="/", body=b""):
+    """Drive one HTTP request through ``app``; return the response status."""
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 1234),
+        "server": ("testserver", 80),
+    }
+    try:
+        asyncio.run(app(scope, receive, send))
+    except RuntimeError:
+        pass
+    return sent[0]["status"]
+
+
+class TestSampleRates(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(
+            parse_sample_rates(" *=0.01, /static=0 ,/chat/{recipient_id}=1,"),
+            {"*": 0.01, "/static": 0.0, "/chat/{recipient_id}": 1.0},
+        )
+        self.assertEqual(parse_sample_rates(""), {})
+
+    def test_rejects_bad_entries(self):
+        for text in ("/static", "=0.5", "*=2", "*=lots"):
+            with self.assertRaises(ValueError, msg=text):
+                parse_sample_rates(text)
+
+
+class TestAccessLogMiddleware(unittest.TestCase):
+    def setUp(self):
+        self.access_log = AccessLog(sample_rates={"*": 0})
+        self.app = make_app(self.access_log)
+
+    def lines(self, *requests):
+        with self.assertLogs("src.access_log") as logs:
+            for request in requests:
+                call(self.app, *request)
+            self.access_log.flush()
+        return logs.records
+
+    def test_summarises_per_route_template(self):
+        records = self.lines(
+            ("GET", "/"),
+            ("GET", "/"),
+            ("GET", f"/chat/{FINGERPRINT}"),
+            ("GET", "/static/favicon.ico"),
+            ("GET", "/static/missing.js"),
+            ("GET", "/missing"),
+        )
+        summaries = {r.route: r for r in records}
+        self.assertEqual(
+            sorted(summaries), ["/", "/chat/{recipient_id}", "/static", UNMATCHED]
+        )
+        self.assertTrue(all(r.getMessage() == "Access summary" for r in records))
+        self.assertEqual(summaries["/"].requests, 2)
+        self.assertEqual(summaries["/static"].statuses, {"200": 1, "404": 1})
+        self.assertEqual(summaries[UNMATCHED].statuses, {"404": 1})
+        self.assertGreater(summaries["/"].p50_ms, 0)
+        self.assertGreaterEqual(summaries["/"].p99_ms, summaries["/"].p50_ms)
+
+    def test_errors_and_auth_failures_logged_in_full(self):
+        records = self.lines(("POST", "/login"), ("GET", "/boom"))
+        full = [r.getMessage() for r in records if r.getMessage() != "Access summary"]
+        self.assertEqual(
+            full,
+            [
+                '127.0.0.1:1234 - "POST /login HTTP/1.1" 401',
+                '127.0.0.1:1234 - "GET /boom HTTP/1.1" 500',
+            ],
+        )
+        self.assertEqual(records[0].route, "/login")
+
+    def test_sampled_lines(self):
+        self.access_log.sample_rates["/"] = 1
+        records = self.lines(("GET", "/"), ("GET", f"/chat/{FINGERPRINT}"))
+        self.assertEqual(
+            [r.getMessage() for r in records],
+            [
+                '127.0.0.1:1234 - "GET / HTTP/1.1" 200',
+                "Access summary",
+                "Access summary",
+            ],
+        )
+        self.assertEqual(records[1].sampled, 1)
+        self.assertEqual(records[2].sampled, 0)
+
+    def test_counts_responses_from_inner_middleware(self):
+        records = self.lines(("POST", "/login", b"x" * 64))
+        self.assertEqual(records[0].statuses, {"413": 1})
+
+    def test_flush_resets(self):
+        self.lines(("GET", "/"))
+        with self.assertNoLogs("src.access_log"):
+            self.access_log.flush()
+
+
+class TestAccessLog(unittest.TestCase):
+    def test_percentiles(self):
+        access_log = AccessLog(sample_rates={})
+        for _ in range(98):
+            access_log.record("/", 200, 0.002)
+        access_log.record("/", 200, 0.5)
+        access_log.record("/", 200, 0.5)
+        with self.assertLogs("src.access_log") as logs:
+            access_log.flush()
+        summary = logs.records[0]
+        # Bucketed: within 10% above the true value.
+        self.assertTrue(2 <= summary.p50_ms <= 2.2, summary.p50_ms)
+        self.assertTrue(500 <= summary.p99_ms <= 550, summary.p99_ms)
+
+    def test_stop_flushes(self):
+        async def run_test():
+            access_log = AccessLog(interval=60, sample_rates={})
+            await access_log.start()
+            access_log.record("/", 200, 0.001)
+            with self.assertLogs("src.access_log") as logs:
+                await access_log.stop()
+            self.assertEqual(logs.records[0].requests, 1)
+
+        asyncio.run(run_test())
+
+    def test_reports_every_interval(self):
+        async def run_test():
+            access_log = AccessLog(interval=0.01, sample_rates={})
+            await access_log.start()
+            access_log.record("/", 200, 0.001)
+            with self.assertLogs("src.access_log") as logs:
+                await asyncio.sleep(0.05)
+            await access_log.stop()
+            self.assertEqual([r.route for r in logs.records], ["/"])
+
+        asyncio.run(run_test())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,277 @@
+import asyncio
+import sys
+import os
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.routes import auth
+from src.services import VerifierBusy, CLEARNET, ONION
+
+
+class FakeVerifier:
+    """Counts verifications; each one waits until ``release`` is set."""
+
+    def __init__(self, result=(True, "FP"), error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def verify(self, public_key, clearsigned, expected_challenge, lane):
+        self.calls += 1
+        self.lane = lane
+        await self.release.wait()
+        if self.error:
+            raise self.error
+        return self.result
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        auth._in_flight.clear()
+        auth._recent_failures.clear()
+        self.addCleanup(auth._recent_failures.clear)
+
+    def run_with(self, verifier, coro_factory):
+        async def run_test():
+            verifier.release = asyncio.Event()
+            with patch.object(auth, "verifier", verifier):
+                return await coro_factory(verifier)
+
+        return asyncio.run(run_test())
+
+    def test_identical_concurrent_logins_share_one_verification(self):
+        async def scenario(verifier):
+            logins = [
+                asyncio.create_task(auth._verify("KEY", "SIG", "CHALLENGE"))
+                for _ in range(5)
+            ]
+            await asyncio.sleep(0)
+            verifier.release.set()
+            return await asyncio.gather(*logins)
+
+        verifier = FakeVerifier()
+        results = self.run_with(verifier, scenario)
+        self.assertEqual(results, [(True, "FP")] * 5)
+        self.assertEqual(verifier.calls, 1)
+        self.assertEqual(auth._in_flight, {})
+
+    def test_different_logins_are_not_coalesced(self):
+        async def scenario(verifier):
+            logins = [
+                asyncio.create_task(auth._verify("KEY", "SIG", challenge))
+                for challenge in ("C1", "C2")
+            ]
+            await asyncio.sleep(0)
+            verifier.release.set()
+            return await asyncio.gather(*logins)
+
+        verifier = FakeVerifier()
+        self.run_with(verifier, scenario)
+        self.assertEqual(verifier.calls, 2)
+
+    def test_fields_cannot_be_shifted_into_each_other(self):
+        self.assertNotEqual(
+            auth._login_digest("AB", "C", "D"), auth._login_digest("A", "BC", "D")
+        )
+
+    def test_one_caller_giving_up_does_not_cancel_the_others(self):
+        async def scenario(verifier):
+            first = asyncio.create_task(auth._verify("KEY", "SIG", "CHALLENGE"))
+            second = asyncio.create_task(auth._verify("KEY", "SIG", "CHALLENGE"))
+            await asyncio.sleep(0)
+            first.cancel()
+            await asyncio.sleep(0)
+            verifier.release.set()
+            return await second
+
+        verifier = FakeVerifier()
+        self.assertEqual(self.run_with(verifier, scenario), (True, "FP"))
+        self.assertEqual(verifier.calls, 1)
+
+    def test_recent_failure_is_answered_without_verifying(self):
+        async def scenario(verifier):
+            verifier.release.set()
+            results = [await auth._verify("KEY", "BAD", "CHALLENGE") for _ in range(3)]
+            # A corrected signature is verified as normal.
+            results.append(await auth._verify("KEY", "GOOD", "CHALLENGE"))
+            return results
+
+        verifier = FakeVerifier(result=(False, None))
+        results = self.run_with(verifier, scenario)
+        self.assertEqual(results, [(False, None)] * 4)
+        self.assertEqual(verifier.calls, 2)
+
+    def test_recent_failure_lapses(self):
+        async def scenario(verifier):
+            verifier.release.set()
+            await auth._verify("KEY", "BAD", "CHALLENGE")
+            later = auth.time.monotonic() + auth.LOGIN_FAILURE_TTL
+            with patch("src.routes.auth.time.monotonic", return_value=later):
+                await auth._verify("KEY", "BAD", "CHALLENGE")
+
+        verifier = FakeVerifier(result=(False, None))
+        self.run_with(verifier, scenario)
+        self.assertEqual(verifier.calls, 2)
+
+    def test_successes_are_not_remembered(self):
+        async def scenario(verifier):
+            verifier.release.set()
+            for _ in range(2):
+                await auth._verify("KEY", "SIG", "CHALLENGE")
+
+        verifier = FakeVerifier()
+        self.run_with(verifier, scenario)
+        self.assertEqual(verifier.calls, 2)
+        self.assertEqual(len(auth._recent_failures), 0)
+
+    def test_busy_is_shared_but_not_remembered(self):
+        async def scenario(verifier):
+            logins = [
+                asyncio.create_task(auth._verify("KEY", "SIG", "CHALLENGE"))
+                for _ in range(2)
+            ]
+            await asyncio.sleep(0)
+            verifier.release.set()
+            return await asyncio.gather(*logins, return_exceptions=True)
+
+        verifier = FakeVerifier(error=VerifierBusy())
+        results = self.run_with(verifier, scenario)
+        self.assertTrue(all(isinstance(r, VerifierBusy) for r in results))
+        self.assertEqual(verifier.calls, 1)
+        self.assertEqual(len(auth._recent_failures), 0)
+
+    def test_login_is_verified_in_its_lane(self):
+        async def scenario(verifier):
+            verifier.release.set()
+            await auth._verify("KEY", "SIG", "CHALLENGE", ONION)
+
+        verifier = FakeVerifier()
+        self.run_with(verifier, scenario)
+        self.assertEqual(verifier.lane, ONION)
+
+    def test_failure_memory_is_bounded(self):
+        async def scenario(verifier):
+            verifier.release.set()
+            for i in range(4):
+                await auth._verify("KEY", f"BAD{i}", "CHALLENGE")
+
+        verifier = FakeVerifier(result=(False, None))
+        with patch.object(auth, "MAX_RECENT_FAILURES", 2):
+            self.run_with(verifier, scenario)
+        self.assertEqual(len(auth._recent_failures), 2)
+
+
+class StubVerifier:
+    """Answers at once: a "GOOD" signature verifies as FP, anything else fails."""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.lanes = []
+
+    async def verify(self, public_key, clearsigned, expected_challenge, lane):
+        self.lanes.append(lane)
+        if self.error:
+            raise self.error
+        return (True, "FP") if clearsigned == "GOOD" else (False, None)
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+
+class TestLoginRoute(unittest.TestCase):
+    def setUp(self):
+        auth._in_flight.clear()
+        auth._recent_failures.clear()
+        self.addCleanup(auth._recent_failures.clear)
+        self.verifier = StubVerifier()
+        self.redis = FakeRedis()
+        for target, name, value in (
+            (auth, "verifier", self.verifier),
+            (auth, "redis_client", self.redis),
+            (auth.limiter, "is_limited", AsyncMock(return_value=False)),
+        ):
+            patcher = patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.challenge, self.challenge_id = auth._issue_challenge()
+
+    def login(self, signature="GOOD", challenge_id=None, client=None):
+        app = FastAPI()
+        app.include_router(auth.router)
+        with TestClient(app, client=client or ("testclient", 50000)) as c:
+            return c.post(
+                "/login",
+                data={
+                    "public_key": "KEY",
+                    "signature": signature,
+                    "challenge_id": challenge_id or self.challenge_id,
+                },
+                follow_redirects=False,
+            )
+
+    def test_challenge_logs_in_once(self):
+        first = self.login()
+        self.assertEqual(first.status_code, 303)
+        self.assertEqual(first.headers["location"], "/chat/")
+
+        replay = self.login()
+        self.assertEqual(replay.status_code, 400)
+        self.assertIn("already been used", replay.text)
+        # A fresh challenge to sign, not the spent one.
+        self.assertNotIn(self.challenge_id, replay.text)
+        self.assertIn('name="challenge_id"', replay.text)
+
+    def test_failed_verification_does_not_consume_the_challenge(self):
+        failed = self.login(signature="BAD")
+        self.assertEqual(failed.status_code, 401)
+        # The same challenge is offered again...
+        self.assertIn(self.challenge_id, failed.text)
+        self.assertEqual(self.redis.data, {})
+
+        # ...and still logs in once the signature is right.
+        self.assertEqual(self.login().status_code, 303)
+
+    def test_busy_verifier_sheds_with_503(self):
+        self.verifier.error = VerifierBusy()
+        self.assertEqual(self.login().status_code, 503)
+        # The challenge is untouched, so retrying it works.
+        self.assertEqual(self.redis.data, {})
+        self.verifier.error = None
+        self.assertEqual(self.login().status_code, 303)
+
+    def test_login_queues_in_its_clients_lane(self):
+        self.login(signature="BAD", client=("127.0.0.1", 50000))
+        self.login(signature="BAD2", client=("1.1.1.1", 50000))
+        self.assertEqual(self.verifier.lanes, [ONION, CLEARNET])
+
+
+class TestLane(unittest.TestCase):
+    def request_from(self, host):
+        return SimpleNamespace(client=SimpleNamespace(host=host))
+
+    def test_public_address_is_clearnet(self):
+        self.assertEqual(auth._lane(self.request_from("1.1.1.1")), CLEARNET)
+        self.assertEqual(auth._lane(self.request_from("8.8.8.8")), CLEARNET)
+
+    def test_tor_daemon_is_onion(self):
+        self.assertEqual(auth._lane(self.request_from("127.0.0.1")), ONION)
+        self.assertEqual(auth._lane(self.request_from("172.18.0.5")), ONION)
+        self.assertEqual(auth._lane(SimpleNamespace(client=None)), ONION)
+
+
+if __name__ == "__main__":
+    unittest.main()
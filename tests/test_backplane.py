@@ -0,0 +1,110 @@
+import asyncio
+import json
+import sys
+import os
+import unittest
+from unittest.mock import AsyncMock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.services.backplane import RedisBackplane, RELAY_CHANNEL
+
+
+def message_item(header, message="{}"):
+    return {"type": "message", "data": f"{json.dumps(header)}\n{message}"}
+
+
+class TestRedisBackplane(unittest.TestCase):
+    def test_publish_tags_frame_with_node_id(self):
+        async def run_test():
+            redis_client = AsyncMock()
+            backplane = RedisBackplane(redis_client, node_id="node-a")
+
+            await backplane.publish("s", "r", '{"type": "encrypted_text"}')
+
+            channel, data = redis_client.publish.await_args.args
+            self.assertEqual(channel, RELAY_CHANNEL)
+            header, message = data.split("\n", 1)
+            self.assertEqual(
+                json.loads(header),
+                {"origin": "node-a", "sender": "s", "recipient": "r"},
+            )
+            # The message rides along verbatim, not re-encoded.
+            self.assertEqual(message, '{"type": "encrypted_text"}')
+
+        asyncio.run(run_test())
+
+    def test_binary_messages_round_trip(self):
+        async def run_test():
+            redis_client = AsyncMock()
+            publisher = RedisBackplane(redis_client, node_id="node-a")
+            receiver = RedisBackplane(AsyncMock(), node_id="node-b")
+            deliver = AsyncMock()
+
+            await publisher.publish("s", "r", b"\x01\x00\xff\n")
+            _, data = redis_client.publish.await_args.args
+            await receiver._handle({"type": "message", "data": data}, deliver)
+
+            deliver.assert_awaited_once_with("s", "r", b"\x01\x00\xff\n", False)
+
+        asyncio.run(run_test())
+
+    def test_delivers_frames_from_other_nodes(self):
+        async def run_test():
+            backplane = RedisBackplane(AsyncMock(), node_id="node-a")
+            deliver = AsyncMock()
+            header = {"origin": "node-b", "sender": "s", "recipient": "r"}
+
+            await backplane._handle(message_item(header, '{"a":\n1}'), deliver)
+
+            deliver.assert_awaited_once_with("s", "r", '{"a":\n1}', False)
+
+        asyncio.run(run_test())
+
+    def test_echo_flag_round_trips(self):
+        async def run_test():
+            redis_client = AsyncMock()
+            publisher = RedisBackplane(redis_client, node_id="node-a")
+            receiver = RedisBackplane(AsyncMock(), node_id="node-b")
+            deliver = AsyncMock()
+
+            await publisher.publish("s", "r", "{}", node="node-b", echo=True)
+            channel, data = redis_client.publish.await_args.args
+            await receiver._handle({"type": "message", "data": data}, deliver)
+
+            self.assertEqual(json.loads(data.split("\n", 1)[0])["echo"], True)
+            deliver.assert_awaited_once_with("s", "r", "{}", True)
+
+        asyncio.run(run_test())
+
+    def test_ignores_own_frames(self):
+        async def run_test():
+            backplane = RedisBackplane(AsyncMock(), node_id="node-a")
+            deliver = AsyncMock()
+            header = {"origin": "node-a", "sender": "s", "recipient": "r"}
+
+            await backplane._handle(message_item(header), deliver)
+
+            deliver.assert_not_awaited()
+
+        asyncio.run(run_test())
+
+    def test_malformed_frames_and_delivery_errors_are_contained(self):
+        async def run_test():
+            backplane = RedisBackplane(AsyncMock(), node_id="node-a")
+            deliver = AsyncMock(side_effect=RuntimeError("socket closed"))
+
+            await backplane._handle({"type": "message", "data": "not json"}, deliver)
+            await backplane._handle(message_item({"origin": "node-b"}), deliver)
+            header = {"origin": "node-b", "sender": "s", "recipient": "r"}
+            no_message = {"type": "message", "data": json.dumps(header)}
+            await backplane._handle(no_message, deliver)
+            deliver.assert_not_awaited()
+
+            # Must not raise: one dead socket can't kill the subscription.
+            await backplane._handle(message_item(header), deliver)
+
+        asyncio.run(run_test())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,20 +1,29 @@
 import sys
 import os
+import time
 import unittest
 from types import SimpleNamespace
+from unittest.mock import patch
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from src.routes.chat import _origin_allowed, _valid_message
+from src.routes import chat
+from src.routes.chat import _origin_allowed
+from src.services import BINARY_SUBPROTOCOL, ConnectionManager, sign_user_id
+
+SENDER_FP = "497472E4EADD6B41F735D437F8FC9A8BDC9CF796"
+RECIPIENT_FP = "DEADBEEFDEADBEEFDEADBEEFDEADBEEFDEADBEEF"
+# A binary encrypted_text frame for RECIPIENT_FP: 12-byte iv, ciphertext "ct".
+BINARY = b"\x01" + bytes.fromhex(RECIPIENT_FP) + b"\x0c" + b"\x00" * 12 + b"ct"
 
 
 def fake_ws(headers):
     return SimpleNamespace(headers=headers)
 
 
-FP = "497472E4EADD6B41F735D437F8FC9A8BDC9CF796"
-OTHER_FP = "DEADBEEFDEADBEEFDEADBEEFDEADBEEFDEADBEEF"
-
-
 class TestOriginAllowed(unittest.TestCase):
     def test_same_origin_allowed(self):
         ws = fake_ws({"origin": "https://vapour.chat", "host": "vapour.chat"})
@@ -35,50 +44,78 @@ class TestOriginAllowed(unittest.TestCase):
         self.assertFalse(_origin_allowed(fake_ws({"origin": "https://vapour.chat"})))
 
 
-class TestValidMessage(unittest.TestCase):
-    def test_valid_key_exchange(self):
-        self.assertTrue(
-            _valid_message(
-                {"type": "key_exchange", "target_user": FP, "publicKey": {"kty": "EC"}}
-            )
-        )
-
-    def test_valid_encrypted_text(self):
-        self.assertTrue(
-            _valid_message(
-                {
-                    "type": "encrypted_text",
-                    "target_user": OTHER_FP,
-                    "content": {"iv": [1], "ciphertext": [2]},
-                }
-            )
-        )
-
-    def test_rejects_unknown_type(self):
-        self.assertFalse(
-            _valid_message({"type": "evil", "target_user": FP, "publicKey": {}})
-        )
-
-    def test_rejects_bad_target(self):
-        self.assertFalse(
-            _valid_message(
-                {"type": "key_exchange", "target_user": "not-a-fp", "publicKey": {}}
-            )
-        )
-
-    def test_rejects_key_exchange_without_public_key(self):
-        self.assertFalse(_valid_message({"type": "key_exchange", "target_user": FP}))
-
-    def test_rejects_encrypted_text_without_content_fields(self):
-        self.assertFalse(
-            _valid_message(
-                {"type": "encrypted_text", "target_user": FP, "content": {"iv": [1]}}
-            )
+class TestWebSocketEndpoint(unittest.TestCase):
+    def setUp(self):
+        self.manager = ConnectionManager()
+        patcher = patch.object(chat, "manager", self.manager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        app = FastAPI()
+        app.include_router(chat.router)
+        self.client = TestClient(app)
+
+    def connect(self, user_id, binary=False):
+        return self.client.websocket_connect(
+            "/chat/ws/x",
+            subprotocols=[BINARY_SUBPROTOCOL] if binary else [],
+            headers={"cookie": f"user_id={sign_user_id(user_id)}"},
         )
 
-    def test_rejects_non_dict(self):
-        for value in (None, "x", 5, ["a"]):
-            self.assertFalse(_valid_message(value), value)
+    def test_binary_subprotocol_negotiated_when_offered(self):
+        with self.client:
+            with self.connect(SENDER_FP, binary=True) as ws:
+                self.assertEqual(ws.accepted_subprotocol, BINARY_SUBPROTOCOL)
+            with self.connect(SENDER_FP) as ws:
+                self.assertIsNone(ws.accepted_subprotocol)
+
+    def test_binary_frames_relayed_as_binary(self):
+        with self.client:
+            with self.connect(RECIPIENT_FP, binary=True) as recipient:
+                with self.connect(SENDER_FP, binary=True) as sender:
+                    sender.send_bytes(BINARY)
+                    echo = sender.receive_bytes()
+                    delivered = recipient.receive_bytes()
+
+        # Only the 21-byte header is rewritten; the payload rides through.
+        self.assertEqual(echo[:21], b"\x03" + bytes.fromhex(RECIPIENT_FP))
+        self.assertEqual(delivered[:21], b"\x02" + bytes.fromhex(SENDER_FP))
+        self.assertEqual(delivered[21:], BINARY[21:])
+
+    def test_malformed_binary_frame_closes_with_1003(self):
+        with self.client:
+            with self.connect(SENDER_FP, binary=True) as ws:
+                ws.send_bytes(b"\x01junk")
+                with self.assertRaises(WebSocketDisconnect) as closed:
+                    ws.receive_bytes()
+        self.assertEqual(closed.exception.code, 1003)
+
+    def test_bytes_without_binary_subprotocol_close_with_1003(self):
+        with self.client:
+            with self.connect(SENDER_FP) as ws:
+                ws.send_bytes(BINARY)
+                with self.assertRaises(WebSocketDisconnect) as closed:
+                    ws.receive_text()
+        self.assertEqual(closed.exception.code, 1003)
+
+    def test_received_frames_keep_socket_from_idle_sweep(self):
+        with self.client:
+            with self.connect("A" * 40) as silent:
+                with self.connect(SENDER_FP, binary=True) as chatty:
+                    before = time.monotonic()
+                    chatty.send_bytes(BINARY)
+                    chatty.receive_bytes()
+
+                    # Everything last heard from before ``before`` is idle.
+                    now = before + self.manager.idle_timeout
+                    swept = self.client.portal.call(self.manager.sweep_idle, now)
+                    self.assertEqual(swept, 1)
+                    with self.assertRaises(WebSocketDisconnect) as closed:
+                        silent.receive_text()
+                    self.assertEqual(closed.exception.code, 1001)
+
+                    # The chatty socket is still served.
+                    chatty.send_bytes(BINARY)
+                    self.assertEqual(chatty.receive_bytes()[0], 0x03)
 
 
 if __name__ == "__main__":
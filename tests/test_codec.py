@@ -0,0 +1,144 @@
+import json
+import sys
+import os
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.services import codec
+from src.services.codec import (
+    BINARY_DELIVERED,
+    BINARY_ECHO,
+    BINARY_ENCRYPTED_TEXT,
+    EncryptedText,
+    KeyExchange,
+    binary_to_json,
+    decode_binary_frame,
+    decode_frame,
+    relabel_binary,
+)
+
+FP = "497472E4EADD6B41F735D437F8FC9A8BDC9CF796"
+OTHER_FP = "DEADBEEFDEADBEEFDEADBEEFDEADBEEFDEADBEEF"
+
+
+def decode(value):
+    return decode_frame(json.dumps(value))
+
+
+class TestDecodeFrame(unittest.TestCase):
+    def test_valid_key_exchange(self):
+        self.assertEqual(
+            decode(
+                {"type": "key_exchange", "target_user": FP, "publicKey": {"kty": "EC"}}
+            ),
+            KeyExchange(FP, {"kty": "EC"}),
+        )
+
+    def test_valid_encrypted_text(self):
+        content = {"iv": [1], "ciphertext": [2]}
+        self.assertEqual(
+            decode(
+                {"type": "encrypted_text", "target_user": OTHER_FP, "content": content}
+            ),
+            EncryptedText(OTHER_FP, content),
+        )
+
+    def test_accepts_bytes(self):
+        frame = decode_frame(
+            b'{"type": "key_exchange", "target_user": "%s", "publicKey": {}}'
+            % FP.encode()
+        )
+        self.assertEqual(frame, KeyExchange(FP, {}))
+
+    def test_rejects_unknown_type(self):
+        self.assertIsNone(decode({"type": "evil", "target_user": FP, "publicKey": {}}))
+
+    def test_rejects_bad_target(self):
+        self.assertIsNone(
+            decode({"type": "key_exchange", "target_user": "not-a-fp", "publicKey": {}})
+        )
+
+    def test_rejects_key_exchange_without_public_key(self):
+        self.assertIsNone(decode({"type": "key_exchange", "target_user": FP}))
+
+    def test_rejects_encrypted_text_without_content_fields(self):
+        self.assertIsNone(
+            decode(
+                {"type": "encrypted_text", "target_user": FP, "content": {"iv": [1]}}
+            )
+        )
+
+    def test_rejects_non_dict(self):
+        for value in (None, "x", 5, ["a"]):
+            self.assertIsNone(decode(value), value)
+
+    def test_rejects_malformed_json(self):
+        for raw in ("", "{", '{"type": }', "\ud800", b"\xff\xfe"):
+            self.assertIsNone(decode_frame(raw), raw)
+
+
+class TestStdlibBackend(TestDecodeFrame):
+    """The same schema checks with the fallback decoder."""
+
+    def setUp(self):
+        patcher = patch.object(codec, "_loads", json.loads)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+def binary_frame(target=OTHER_FP, iv=b"\x01" * 12, ciphertext=b"secret"):
+    return (
+        bytes((BINARY_ENCRYPTED_TEXT,))
+        + bytes.fromhex(target)
+        + bytes((len(iv),))
+        + iv
+        + ciphertext
+    )
+
+
+class TestBinaryFrames(unittest.TestCase):
+    def test_decode(self):
+        frame = decode_binary_frame(binary_frame())
+        self.assertEqual(frame.target_user, OTHER_FP)
+        self.assertEqual(bytes(frame.content["iv"]), b"\x01" * 12)
+        self.assertEqual(bytes(frame.content["ciphertext"]), b"secret")
+
+    def test_rejects_malformed(self):
+        good = binary_frame()
+        cases = [
+            b"",
+            good[:22],  # Header only.
+            bytes((BINARY_DELIVERED,)) + good[1:],  # Not a client frame kind.
+            good[:21] + b"\x00" + good[22:],  # Empty iv.
+            good[:21] + b"\xff" + good[22:],  # iv runs past the end.
+            good[:34],  # No ciphertext.
+        ]
+        for raw in cases:
+            self.assertIsNone(decode_binary_frame(raw), raw)
+
+    def test_relabel_keeps_payload(self):
+        raw = binary_frame()
+        delivered = relabel_binary(raw, "sender", FP)
+        self.assertEqual(delivered[0], BINARY_DELIVERED)
+        self.assertEqual(delivered[1:21].hex().upper(), FP)
+        self.assertEqual(delivered[21:], raw[21:])
+        self.assertEqual(relabel_binary(raw, "recipient", OTHER_FP)[0], BINARY_ECHO)
+
+    def test_json_equivalent(self):
+        message = json.loads(binary_to_json(binary_frame(), "sender", FP))
+        self.assertEqual(
+            message,
+            {
+                "type": "encrypted_text",
+                "target_user": OTHER_FP,
+                "content": {"iv": [1] * 12, "ciphertext": list(b"secret")},
+                "sender": FP,
+            },
+        )
+        # What a JSON client then receives is itself a valid frame.
+        self.assertIsNotNone(decode_frame(json.dumps(message)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import asyncio
+import sys
+import os
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.services.key_cache import KeyCache
+from src.services.verification import VerificationPool
+
+# Module level so verification workers import it, as they do key_cache.
+shared = KeyCache(max_size=8, ttl=60)
+
+
+def share_counters(counters):
+    shared.share_counters(counters)
+
+
+def cached_lookup(public_key, clearsigned, expected_challenge):
+    if shared.get(public_key) is None:
+        shared.put(public_key, public_key)
+    return True, public_key
+
+
+class TestKeyCache(unittest.TestCase):
+    def test_miss_then_hit(self):
+        cache = KeyCache(max_size=4, ttl=60)
+        self.assertIsNone(cache.get("KEY"))
+        cache.put("KEY", "parsed")
+        self.assertEqual(cache.get("KEY"), "parsed")
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 1})
+
+    def test_same_key_with_different_line_endings_hits(self):
+        cache = KeyCache(max_size=4, ttl=60)
+        cache.put("-----BEGIN\nabc\n-----END\n", "parsed")
+        self.assertEqual(cache.get("  -----BEGIN\r\nabc\r\n-----END"), "parsed")
+
+    def test_least_recently_used_is_evicted(self):
+        cache = KeyCache(max_size=2, ttl=60)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")  # "b" is now the oldest.
+        cache.put("c", 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_entries_expire(self):
+        cache = KeyCache(max_size=4, ttl=10)
+        with patch("src.services.key_cache.time.monotonic", return_value=100.0):
+            cache.put("KEY", "parsed")
+        with patch("src.services.key_cache.time.monotonic", return_value=109.0):
+            self.assertEqual(cache.get("KEY"), "parsed")
+        with patch("src.services.key_cache.time.monotonic", return_value=110.0):
+            self.assertIsNone(cache.get("KEY"))
+        self.assertEqual(len(cache), 0)
+
+    def test_zero_size_disables_caching(self):
+        cache = KeyCache(max_size=0, ttl=60)
+        cache.put("KEY", "parsed")
+        self.assertIsNone(cache.get("KEY"))
+
+    def test_counters_include_worker_processes(self):
+        async def run_test():
+            pool = VerificationPool(
+                workers=1,
+                max_pending=4,
+                timeout=5,
+                func=cached_lookup,
+                initializer=share_counters,
+                initargs=(shared.counters,),
+            )
+            before = shared.stats()
+            try:
+                for _ in range(3):
+                    await pool.verify("KEY", "c", "c")
+            finally:
+                await pool.stop()
+            # The entries stayed in the worker; the counts reached us.
+            self.assertEqual(len(shared), 0)
+            self.assertEqual(shared.misses - before["misses"], 1)
+            self.assertEqual(shared.hits - before["hits"], 2)
+
+        asyncio.run(run_test())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+import io
+import json
+import logging
+import sys
+import os
+import threading
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.logger import LOGGING_CONFIG
+from src.logger.logger import BackgroundHandler, CustomJsonFormatter, MaskingFilter
+from src.services import sign_user_id
+
+FINGERPRINT = "497472E4EADD6B41F735D437F8FC9A8BDC9CF796"
+
+
+def record(msg, args=None):
+    return logging.LogRecord("test", logging.INFO, __file__, 0, msg, args, None)
+
+
+def masked(log_filter, msg, args=None):
+    rec = record(msg, args)
+    log_filter.filter(rec)
+    return rec.getMessage()
+
+
+class BlockingStream(io.StringIO):
+    """A stream whose writes wait until released, like a full stdout pipe."""
+
+    def __init__(self):
+        super().__init__()
+        self.writing = threading.Event()
+        self.release = threading.Event()
+
+    def write(self, text):
+        self.writing.set()
+        self.release.wait(5)
+        return super().write(text)
+
+
+class TestBackgroundHandler(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger(f"test_logger.{self.id()}")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+
+    def attach(self, stream, **kwargs):
+        handler = BackgroundHandler(stream, **kwargs)
+        handler.setFormatter(CustomJsonFormatter())
+        handler.addFilter(MaskingFilter())
+        self.logger.addHandler(handler)
+        self.addCleanup(self.logger.removeHandler, handler)
+        return handler
+
+    def lines(self, stream):
+        return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    def test_writes_json_lines_in_order(self):
+        stream = io.StringIO()
+        handler = self.attach(stream)
+
+        for i in range(300):
+            self.logger.info("line %d", i)
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            self.logger.exception("failed")
+        handler.close()
+
+        lines = self.lines(stream)
+        self.assertEqual(
+            [l["message"] for l in lines[:300]], [f"line {i}" for i in range(300)]
+        )
+        self.assertEqual(lines[300]["level"], "ERROR")
+        self.assertIn("ValueError: boom", lines[300]["exc_info"])
+
+    def test_masks_before_queueing(self):
+        stream = io.StringIO()
+        handler = self.attach(stream)
+
+        self.logger.info("user %s", "497472E4EADD6B41F735D437F8FC9A8BDC9CF796")
+        handler.close()
+
+        self.assertEqual(self.lines(stream)[0]["message"], "user [MASKED]")
+
+    def test_full_queue_drops_and_counts(self):
+        stream = BlockingStream()
+        handler = self.attach(stream, queue_size=2)
+
+        self.logger.info("first")
+        self.assertTrue(stream.writing.wait(5))
+        # The listener is stuck writing "first"; two fit in the queue.
+        for i in range(5):
+            self.logger.info("flood %d", i)
+        self.assertEqual(handler.dropped, 3)
+
+        stream.release.set()
+        handler.close()
+
+        messages = [l["message"] for l in self.lines(stream)]
+        self.assertEqual(messages[:3], ["first", "flood 0", "flood 1"])
+        self.assertEqual(messages[3], "Dropped 3 log records: the log queue was full")
+
+    def test_writes_directly_after_close(self):
+        stream = io.StringIO()
+        handler = self.attach(stream)
+        # As after logging.shutdown(), for anything logged later at exit.
+        handler.close()
+
+        self.logger.info("after close")
+
+        self.assertEqual(self.lines(stream)[0]["message"], "after close")
+
+
+class TestMaskingFilter(unittest.TestCase):
+    def setUp(self):
+        self.filter = MaskingFilter()
+
+    def test_masks_fingerprints_in_message_and_args(self):
+        self.assertEqual(masked(self.filter, f"login {FINGERPRINT}"), "login [MASKED]")
+        self.assertEqual(
+            masked(self.filter, '"%s %s"', ("GET", f"/chat/{FINGERPRINT}")),
+            '"GET /chat/[MASKED]"',
+        )
+
+    def test_masks_challenge_nonces_and_cookies(self):
+        nonce = "1b4e28ba-2fa1-41d2-883f-0016d3cca427"
+        self.assertEqual(
+            masked(self.filter, f"challenge {nonce}"), "challenge [MASKED]"
+        )
+        cookie = sign_user_id(FINGERPRINT)
+        self.assertNotIn(cookie.rsplit(".", 1)[1], masked(self.filter, cookie))
+
+    def test_leaves_ordinary_text_alone(self):
+        args = ("10.0.0.7:51234", "GET", "/static/js/conversation.js", 200)
+        rec = record('%s - "%s %s" %d', args)
+        self.filter.filter(rec)
+        self.assertIs(rec.args, args)
+        self.assertEqual(
+            masked(self.filter, "Rejected expired key"), "Rejected expired key"
+        )
+
+    def test_template_scanned_once(self):
+        template = f"{FINGERPRINT} %s"
+        self.assertEqual(masked(self.filter, template, ("a",)), "[MASKED] a")
+        self.assertEqual(self.filter._templates, {template: "[MASKED] %s"})
+        self.assertEqual(masked(self.filter, template, ("b",)), "[MASKED] b")
+
+    def test_mapping_args(self):
+        self.assertEqual(
+            masked(self.filter, "user %(id)s", ({"id": FINGERPRINT},)), "user [MASKED]"
+        )
+
+    def test_extra_patterns(self):
+        log_filter = MaskingFilter(patterns=[r"secret-\w+"], min_length=1)
+        self.assertEqual(masked(log_filter, "token secret-abc"), "token [MASKED]")
+        # Only the patterns given apply.
+        self.assertEqual(masked(log_filter, FINGERPRINT), FINGERPRINT)
+
+
+class TestLoggingConfig(unittest.TestCase):
+    def test_app_and_access_logs_go_through_the_queue(self):
+        self.assertIs(LOGGING_CONFIG["handlers"]["console"]["()"], BackgroundHandler)
+        for name in ("", "uvicorn", "uvicorn.access"):
+            self.assertEqual(LOGGING_CONFIG["loggers"][name]["handlers"], ["console"])
+
+
+if __name__ == "__main__":
+    unittest.main()
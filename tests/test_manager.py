@@ -1,11 +1,72 @@
 import asyncio
+import json
 import sys
 import os
+import tracemalloc
 import unittest
-from unittest.mock import AsyncMock, MagicMock
+from unittest.mock import AsyncMock, MagicMock, patch
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from src.services.manager import ConnectionManager
+from src.services.codec import BINARY_SUBPROTOCOL
+from src.services.manager import ConnectionManager, _with_field, connection_limit
+
+
+class FakeBackplane:
+    def __init__(self):
+        self.published = []
+        self.deliver = None
+
+    async def start(self, deliver):
+        self.deliver = deliver
+
+    async def stop(self):
+        pass
+
+    async def publish(self, sender, recipient, message, echo=False):
+        self.published.append((sender, recipient, message, echo))
+
+
+class DirectedBackplane(FakeBackplane):
+    node_id = "node-a"
+
+    async def publish(self, sender, recipient, message, node=None, echo=False):
+        self.published.append((node, recipient, echo))
+
+
+class FakePresence:
+    def __init__(self, nodes=None):
+        self.nodes = nodes or {}
+        self.removed = []
+
+    async def add(self, user_id):
+        self.nodes[user_id] = {"node-a"}
+
+    async def remove(self, user_id):
+        self.removed.append(user_id)
+
+    async def nodes_for(self, user_id):
+        return self.nodes.get(user_id, set())
+
+
+async def connected(manager, user_id, websocket=None, subprotocol=None):
+    websocket = websocket or AsyncMock()
+    await manager.connect(websocket, user_id, subprotocol=subprotocol)
+    return websocket
+
+
+def sent(websocket):
+    """Frames written to a mocked socket, decoded."""
+    return [json.loads(c.args[0]) for c in websocket.send_text.await_args_list]
+
+
+async def drain(manager):
+    """Wait until every queued frame has been written."""
+    await asyncio.gather(*(c.flushed() for c in manager._connections()))
+
+
+async def drain_user(manager, user_id):
+    devices = manager.active_connections[user_id]
+    await asyncio.gather(*(c.flushed() for c in devices))
 
 
 class TestConnectionManager(unittest.TestCase):
@@ -18,58 +79,108 @@ class TestConnectionManager(unittest.TestCase):
             websocket = AsyncMock()
             await self.manager.connect(websocket, user_id)
             self.assertIn(user_id, self.manager.active_connections)
-            self.assertEqual(self.manager.active_connections[user_id], websocket)
+            self.assertEqual(
+                self.manager.active_connections[user_id][0].websocket, websocket
+            )
             websocket.accept.assert_awaited_once()
 
         asyncio.run(run_test())
 
     def test_disconnect(self):
-        user_id = "test_user"
-        self.manager.active_connections[user_id] = AsyncMock()
-        self.manager.disconnect(user_id)
-        self.assertNotIn(user_id, self.manager.active_connections)
+        async def run_test():
+            user_id = "test_user"
+            await connected(self.manager, user_id, StalledSocket())
+            await self.manager.send_personal_message('{"m": 1}', "s", user_id)
+            writer = self.manager.active_connections[user_id][0].writer
+            self.manager.disconnect(user_id)
+            self.assertNotIn(user_id, self.manager.active_connections)
+            await asyncio.sleep(0)
+            self.assertTrue(writer.cancelled())
+
+        asyncio.run(run_test())
 
     def test_disconnect_non_existent_user(self):
         user_id = "test_user"
         self.manager.disconnect(user_id)
         self.assertNotIn(user_id, self.manager.active_connections)
 
-    def test_capacity_blocks_new_user_at_cap(self):
-        manager = ConnectionManager(max_connections=1)
-        manager.active_connections["existing"] = AsyncMock()
-        # A brand-new identity does not fit...
-        self.assertFalse(manager.has_capacity_for("newcomer"))
-        # ...but the already-connected user may always reconnect.
-        self.assertTrue(manager.has_capacity_for("existing"))
+    def test_capacity_counts_sockets(self):
+        async def run_test():
+            manager = ConnectionManager(max_connections=2, max_devices=2)
+            await connected(manager, "existing")
+            self.assertTrue(manager.has_capacity_for("newcomer"))
+            # A second device takes the last slot...
+            await connected(manager, "existing")
+            self.assertEqual(manager.connection_count, 2)
+            self.assertFalse(manager.has_capacity_for("newcomer"))
+            # ...but a user at their device cap always fits, replacing one.
+            self.assertTrue(manager.has_capacity_for("existing"))
+
+        asyncio.run(run_test())
 
     def test_disconnect_only_removes_matching_socket(self):
-        old_ws = AsyncMock()
-        new_ws = AsyncMock()
-        self.manager.active_connections["u"] = new_ws
-        # A late cleanup carrying the replaced socket must not evict the new one.
-        self.manager.disconnect("u", old_ws)
-        self.assertIs(self.manager.active_connections.get("u"), new_ws)
-        # Cleanup carrying the current socket does remove it.
-        self.manager.disconnect("u", new_ws)
-        self.assertNotIn("u", self.manager.active_connections)
+        async def run_test():
+            phone = await connected(self.manager, "u")
+            laptop = await connected(self.manager, "u")
+            self.manager.disconnect("u", phone)
+            devices = self.manager.active_connections["u"]
+            self.assertEqual([c.websocket for c in devices], [laptop])
+            # A repeated cleanup for the same socket is harmless.
+            self.manager.disconnect("u", phone)
+            self.assertEqual(self.manager.connection_count, 1)
+            self.manager.disconnect("u", laptop)
+            self.assertNotIn("u", self.manager.active_connections)
+            self.assertEqual(self.manager.connection_count, 0)
+
+        asyncio.run(run_test())
+
+    def test_device_cap_pushes_out_oldest(self):
+        async def run_test():
+            manager = ConnectionManager(max_devices=2)
+            first = await connected(manager, "u")
+            second = await connected(manager, "u")
+            third = await connected(manager, "u")
+            await asyncio.sleep(0.01)
+
+            first.close.assert_awaited_once_with(code=1008)
+            devices = manager.active_connections["u"]
+            self.assertEqual([c.websocket for c in devices], [second, third])
+            self.assertEqual(manager.connection_count, 2)
+
+        asyncio.run(run_test())
+
+    def test_fans_out_to_every_device(self):
+        async def run_test():
+            senders = [await connected(self.manager, "sender") for _ in range(2)]
+            recipients = [await connected(self.manager, "recipient") for _ in range(3)]
+
+            await self.manager.send_personal_message('{"m": 1}', "sender", "recipient")
+            await drain(self.manager)
+
+            for websocket in recipients:
+                self.assertEqual(sent(websocket), [{"m": 1, "sender": "sender"}])
+            # The echo reaches the sending device and the sender's others.
+            for websocket in senders:
+                self.assertEqual(sent(websocket), [{"m": 1, "recipient": "recipient"}])
+
+        asyncio.run(run_test())
 
     def test_send_personal_message(self):
         async def run_test():
             sender_id = "sender"
             recipient_id = "recipient"
-            sender_ws = AsyncMock()
-            recipient_ws = AsyncMock()
-            self.manager.active_connections[sender_id] = sender_ws
-            self.manager.active_connections[recipient_id] = recipient_ws
-            message = {"message": "hello"}
+            sender_ws = await connected(self.manager, sender_id)
+            recipient_ws = await connected(self.manager, recipient_id)
+            message = '{"message": "hello"}'
 
             await self.manager.send_personal_message(message, sender_id, recipient_id)
+            await drain(self.manager)
 
-            sender_ws.send_json.assert_awaited_once_with(
-                {"message": "hello", "recipient": recipient_id}
+            self.assertEqual(
+                sent(sender_ws), [{"message": "hello", "recipient": recipient_id}]
             )
-            recipient_ws.send_json.assert_awaited_once_with(
-                {"message": "hello", "sender": sender_id}
+            self.assertEqual(
+                sent(recipient_ws), [{"message": "hello", "sender": sender_id}]
             )
 
         asyncio.run(run_test())
@@ -78,14 +189,14 @@ class TestConnectionManager(unittest.TestCase):
         async def run_test():
             sender_id = "sender"
             recipient_id = "recipient"
-            sender_ws = AsyncMock()
-            self.manager.active_connections[sender_id] = sender_ws
-            message = {"message": "hello"}
+            sender_ws = await connected(self.manager, sender_id)
+            message = '{"message": "hello"}'
 
             await self.manager.send_personal_message(message, sender_id, recipient_id)
+            await drain(self.manager)
 
-            sender_ws.send_json.assert_awaited_once_with(
-                {"message": "hello", "recipient": recipient_id}
+            self.assertEqual(
+                sent(sender_ws), [{"message": "hello", "recipient": recipient_id}]
             )
 
         asyncio.run(run_test())
@@ -94,18 +205,525 @@ class TestConnectionManager(unittest.TestCase):
         async def run_test():
             sender_id = "sender"
             recipient_id = "recipient"
-            recipient_ws = AsyncMock()
-            self.manager.active_connections[recipient_id] = recipient_ws
-            message = {"message": "hello"}
+            recipient_ws = await connected(self.manager, recipient_id)
+            message = '{"message": "hello"}'
 
             await self.manager.send_personal_message(message, sender_id, recipient_id)
+            await drain(self.manager)
+
+            self.assertEqual(
+                sent(recipient_ws), [{"message": "hello", "sender": sender_id}]
+            )
+
+        asyncio.run(run_test())
+
+    def test_remote_recipient_goes_through_backplane(self):
+        async def run_test():
+            backplane = FakeBackplane()
+            manager = ConnectionManager(backplane=backplane)
+            sender_ws = await connected(manager, "sender")
+
+            await manager.send_personal_message('{"m": 1}', "sender", "elsewhere")
+            await drain(manager)
+
+            self.assertEqual(
+                backplane.published, [("sender", "elsewhere", '{"m": 1}', True)]
+            )
+            # The sender still gets their echo from this node.
+            self.assertEqual(sent(sender_ws), [{"m": 1, "recipient": "elsewhere"}])
+
+        asyncio.run(run_test())
+
+    def test_local_recipient_still_relayed_for_other_devices(self):
+        async def run_test():
+            backplane = FakeBackplane()
+            manager = ConnectionManager(backplane=backplane)
+            await connected(manager, "sender")
+            recipient_ws = await connected(manager, "recipient")
+
+            await manager.send_personal_message('{"m": 1}', "sender", "recipient")
+            await drain(manager)
+
+            self.assertEqual(sent(recipient_ws), [{"m": 1, "sender": "sender"}])
+            # Without presence, other nodes may hold more of their devices.
+            self.assertEqual(
+                backplane.published, [("sender", "recipient", '{"m": 1}', True)]
+            )
+
+        asyncio.run(run_test())
+
+    def test_relayed_message_delivered_to_local_socket(self):
+        async def run_test():
+            backplane = FakeBackplane()
+            manager = ConnectionManager(backplane=backplane)
+            recipient_ws = await connected(manager, "recipient")
+            await manager.start()
+
+            await backplane.deliver("sender", "recipient", '{"m": 1}')
+            # A frame for someone not held here is silently ignored.
+            await backplane.deliver("sender", "nobody", '{"m": 2}')
+            await drain(manager)
+
+            self.assertEqual(sent(recipient_ws), [{"m": 1, "sender": "sender"}])
+
+        asyncio.run(run_test())
+
+    def test_relayed_echo_reaches_local_sender_devices(self):
+        async def run_test():
+            backplane = FakeBackplane()
+            manager = ConnectionManager(backplane=backplane)
+            sender_ws = await connected(manager, "sender")
+            recipient_ws = await connected(manager, "recipient")
+            await manager.start()
+
+            await backplane.deliver("sender", "recipient", '{"m": 1}', True)
+            # Without the flag the sender's devices here see nothing.
+            await backplane.deliver("sender", "recipient", '{"m": 2}', False)
+            await drain(manager)
+
+            self.assertEqual(sent(sender_ws), [{"m": 1, "recipient": "recipient"}])
+            self.assertEqual(
+                sent(recipient_ws),
+                [{"m": 1, "sender": "sender"}, {"m": 2, "sender": "sender"}],
+            )
+
+        asyncio.run(run_test())
+
+    def test_presence_routes_to_holding_node_only(self):
+        async def run_test():
+            backplane = DirectedBackplane()
+            presence = FakePresence({"remote": {"node-b"}})
+            manager = ConnectionManager(backplane=backplane, presence=presence)
+            manager.active_connections["sender"] = [MagicMock()]
+
+            await manager.send_personal_message('{"m": 1}', "sender", "remote")
+            await manager.send_personal_message('{"m": 2}', "sender", "offline")
+
+            # One directed publish; nothing at all for the offline recipient.
+            self.assertEqual(backplane.published, [("node-b", "remote", True)])
+
+        asyncio.run(run_test())
+
+    def test_presence_relays_echo_to_sender_nodes(self):
+        async def run_test():
+            backplane = DirectedBackplane()
+            presence = FakePresence(
+                {"sender": {"node-a", "node-c"}, "remote": {"node-b", "node-c"}}
+            )
+            manager = ConnectionManager(backplane=backplane, presence=presence)
+            manager.active_connections["sender"] = [MagicMock()]
+
+            await manager.send_personal_message('{"m": 1}', "sender", "offline")
+            await manager.send_personal_message('{"m": 2}', "sender", "remote")
+
+            # The sender's other node gets the echo even when the recipient is
+            # offline; a node holding both parties gets a single frame.
+            self.assertEqual(
+                sorted(backplane.published),
+                [
+                    ("node-b", "remote", True),
+                    ("node-c", "offline", True),
+                    ("node-c", "remote", True),
+                ],
+            )
+
+        asyncio.run(run_test())
+
+    def test_presence_updated_on_connect_and_disconnect(self):
+        async def run_test():
+            presence = FakePresence()
+            manager = ConnectionManager(
+                backplane=DirectedBackplane(), presence=presence
+            )
+            websocket = AsyncMock()
+            await manager.connect(websocket, "u")
+            self.assertEqual(presence.nodes["u"], {"node-a"})
+            other = await connected(manager, "u")
+
+            # Still held here through the other device.
+            manager.disconnect("u", websocket)
+            await asyncio.sleep(0)
+            self.assertEqual(presence.removed, [])
+
+            manager.disconnect("u", other)
+            await asyncio.sleep(0)
+            self.assertEqual(presence.removed, ["u"])
+
+        asyncio.run(run_test())
+
+
+class StalledSocket:
+    """A socket whose writes never complete (a peer that stopped reading)."""
+
+    def __init__(self):
+        self.sent = []
+        self.closed_with = None
+        self.never = asyncio.Event()
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, payload):
+        self.sent.append(payload)
+        await self.never.wait()
+
+    async def close(self, code):
+        self.closed_with = code
+
+
+class TestSlowConsumers(unittest.TestCase):
+    def test_stalled_recipient_does_not_block_sender(self):
+        async def run_test():
+            manager = ConnectionManager()
+            sender_ws = await connected(manager, "sender")
+            await connected(manager, "stalled", StalledSocket())
 
-            recipient_ws.send_json.assert_awaited_once_with(
-                {"message": "hello", "sender": sender_id}
+            for i in range(5):
+                await asyncio.wait_for(
+                    manager.send_personal_message(
+                        json.dumps({"m": i}), "sender", "stalled"
+                    ),
+                    timeout=1,
+                )
+            await asyncio.wait_for(drain_user(manager, "sender"), timeout=1)
+            self.assertEqual(len(sent(sender_ws)), 5)
+            self.assertEqual(manager.queue_stats()["queued"], 4)
+
+        asyncio.run(run_test())
+
+    def test_overflowing_recipient_evicted_with_1013(self):
+        async def run_test():
+            manager = ConnectionManager()
+            manager.send_queue_size = 2
+            stalled = await connected(manager, "stalled", StalledSocket())
+            bystander = await connected(manager, "bystander")
+
+            # One frame is taken by the stuck write; two fill the queue.
+            for i in range(4):
+                await manager.send_personal_message(
+                    json.dumps({"m": i}), "sender", "stalled"
+                )
+                await asyncio.sleep(0)
+            await manager.send_personal_message('{"m": 0}', "sender", "bystander")
+            await asyncio.sleep(0.01)
+
+            self.assertNotIn("stalled", manager.active_connections)
+            self.assertEqual(stalled.closed_with, 1013)
+            self.assertEqual(manager.queue_stats()["evicted_overflow"], 1)
+            # Other connections are unaffected.
+            self.assertEqual(sent(bystander), [{"m": 0, "sender": "sender"}])
+
+        asyncio.run(run_test())
+
+    def test_write_past_deadline_evicted_with_1008(self):
+        async def run_test():
+            manager = ConnectionManager()
+            manager.send_timeout = 0.05
+            await connected(manager, "sender")
+            stalled = await connected(manager, "stalled", StalledSocket())
+
+            await manager.send_personal_message('{"m": 1}', "sender", "stalled")
+            await asyncio.sleep(0.2)
+
+            self.assertNotIn("stalled", manager.active_connections)
+            self.assertEqual(stalled.closed_with, 1008)
+            self.assertEqual(manager.queue_stats()["evicted_timeout"], 1)
+
+        asyncio.run(run_test())
+
+    def test_failed_write_drops_connection(self):
+        async def run_test():
+            manager = ConnectionManager()
+            sender_ws = await connected(manager, "sender")
+            gone = await connected(manager, "gone")
+            gone.send_text.side_effect = RuntimeError("socket closed")
+
+            await manager.send_personal_message('{"m": 1}', "sender", "gone")
+            await asyncio.sleep(0.01)
+
+            self.assertNotIn("gone", manager.active_connections)
+            # The sender keeps its connection and still gets the echo.
+            self.assertIn("sender", manager.active_connections)
+            self.assertEqual(sent(sender_ws), [{"m": 1, "recipient": "gone"}])
+
+        asyncio.run(run_test())
+
+    def test_failed_relay_does_not_reach_sender(self):
+        async def run_test():
+            backplane = FakeBackplane()
+            backplane.publish = AsyncMock(side_effect=ConnectionError("down"))
+            manager = ConnectionManager(backplane=backplane)
+            sender_ws = await connected(manager, "sender")
+
+            with self.assertLogs("src.services.manager", "ERROR"):
+                await manager.send_personal_message('{"m": 1}', "sender", "remote")
+            await drain(manager)
+
+            self.assertEqual(sent(sender_ws), [{"m": 1, "recipient": "remote"}])
+
+        asyncio.run(run_test())
+
+    def test_queue_stats(self):
+        async def run_test():
+            manager = ConnectionManager()
+            await connected(manager, "a", StalledSocket())
+            await connected(manager, "b", StalledSocket())
+            for i in range(3):
+                await manager.send_personal_message(json.dumps({"m": i}), "a", "b")
+            await asyncio.sleep(0.01)
+            stats = manager.queue_stats()
+            self.assertEqual(stats.pop("max_send_latency"), 0.0)
+            self.assertGreaterEqual(stats.pop("stalled_for"), 0.01)
+            # One frame of each is mid-write; the rest wait in the queues.
+            self.assertEqual(
+                stats,
+                {
+                    "connections": 2,
+                    "queued": 4,
+                    "max_depth": 2,
+                    "evicted_overflow": 0,
+                    "evicted_timeout": 0,
+                },
+            )
+
+        asyncio.run(run_test())
+
+
+class SlowSocket(StalledSocket):
+    """A socket whose writes each take ``delay`` seconds."""
+
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+
+    async def send_text(self, payload):
+        self.sent.append(payload)
+        await asyncio.sleep(self.delay)
+
+
+class TestSendLatency(unittest.TestCase):
+    def test_latency_recorded_per_connection(self):
+        async def run_test():
+            manager = ConnectionManager()
+            fast = await connected(manager, "fast", SlowSocket(0))
+            await connected(manager, "slow", SlowSocket(0.05))
+
+            for i in range(3):
+                await manager.send_personal_message('{"m": 1}', "fast", "slow")
+            await drain(manager)
+
+            fast, slow = (manager.active_connections[u][0] for u in ("fast", "slow"))
+            self.assertLess(fast.send_latency, 0.01)
+            # Three 50ms writes into an average that starts at zero.
+            self.assertGreater(slow.send_latency, 0.02)
+            self.assertEqual(
+                manager.queue_stats()["max_send_latency"], slow.send_latency
+            )
+            self.assertIsNone(slow.writing_since)
+
+        asyncio.run(run_test())
+
+    def test_slow_write_logged(self):
+        async def run_test():
+            manager = ConnectionManager()
+            await connected(manager, "slow", SlowSocket(0.02))
+
+            with patch("src.services.manager.SLOW_SEND", 0.01):
+                with self.assertLogs("src.services.manager", "WARNING") as logs:
+                    await manager.send_personal_message('{"m": 1}', "s", "slow")
+                    await drain(manager)
+
+            self.assertIn("Slow consumer", logs.output[0])
+            # The peer is only reported; eviction is left to SEND_TIMEOUT.
+            self.assertIn("slow", manager.active_connections)
+
+        asyncio.run(run_test())
+
+
+class BareSocket:
+    async def accept(self, subprotocol=None):
+        pass
+
+
+class TestFootprint(unittest.TestCase):
+    def test_idle_connection_memory(self):
+        async def run_test():
+            manager = ConnectionManager(max_connections=10_000)
+            sockets = [BareSocket() for _ in range(2000)]
+            user_ids = [f"{i:040X}" for i in range(2000)]
+
+            tracemalloc.start()
+            try:
+                before = tracemalloc.get_traced_memory()[0]
+                for websocket, user_id in zip(sockets, user_ids):
+                    await manager.connect(websocket, user_id)
+                per_connection = (tracemalloc.get_traced_memory()[0] - before) / 2000
+            finally:
+                tracemalloc.stop()
+
+            # The registry's own share; the socket itself costs far more.
+            self.assertLess(per_connection, 512)
+
+        asyncio.run(run_test())
+
+    def test_queue_and_writer_released_once_drained(self):
+        async def run_test():
+            manager = ConnectionManager()
+            await connected(manager, "recipient")
+            connection = manager.active_connections["recipient"][0]
+
+            await manager.send_personal_message('{"m": 1}', "sender", "recipient")
+            self.assertIsNotNone(connection.writer)
+            await connection.flushed()
+
+            self.assertIsNone(connection.queue)
+            self.assertIsNone(connection.writer)
+
+        asyncio.run(run_test())
+
+    def test_connection_limit(self):
+        # 256 MiB at 32 KiB a socket.
+        self.assertEqual(connection_limit(50_000, 256), 8192)
+        self.assertEqual(connection_limit(100, 256), 100)
+        self.assertEqual(connection_limit(50_000, 0), 50_000)
+
+
+class TestIdleSweep(unittest.TestCase):
+    def test_closes_idle_sockets_with_1001(self):
+        async def run_test():
+            manager = ConnectionManager(idle_timeout=60)
+            idle_ws = await connected(manager, "idle")
+            busy_ws = await connected(manager, "busy")
+            now = manager.active_connections["busy"][0].last_seen
+            manager.active_connections["idle"][0].last_seen = now - 61
+
+            self.assertEqual(manager.sweep_idle(now), 1)
+            await asyncio.sleep(0.01)
+
+            self.assertNotIn("idle", manager.active_connections)
+            idle_ws.close.assert_awaited_once_with(code=1001)
+            self.assertIn("busy", manager.active_connections)
+            busy_ws.close.assert_not_awaited()
+
+        asyncio.run(run_test())
+
+    def test_each_device_swept_on_its_own(self):
+        async def run_test():
+            manager = ConnectionManager(idle_timeout=60)
+            old_ws = await connected(manager, "u")
+            new_ws = await connected(manager, "u")
+            old, new = manager.active_connections["u"]
+            old.last_seen = new.last_seen - 61
+
+            self.assertEqual(manager.sweep_idle(new.last_seen), 1)
+            await asyncio.sleep(0.01)
+
+            old_ws.close.assert_awaited_once_with(code=1001)
+            # The user's other device is untouched.
+            new_ws.close.assert_not_awaited()
+            self.assertEqual(manager.active_connections["u"], [new])
+
+        asyncio.run(run_test())
+
+    def test_sweeper_runs_between_start_and_stop(self):
+        async def run_test():
+            manager = ConnectionManager(idle_timeout=0)
+            websocket = await connected(manager, "u")
+            with patch("src.services.manager.IDLE_SWEEP_INTERVAL", 0.01):
+                await manager.start()
+                await asyncio.sleep(0.05)
+                await manager.stop()
+            websocket.close.assert_awaited_once_with(code=1001)
+
+        asyncio.run(run_test())
+
+
+SENDER_FP = "497472E4EADD6B41F735D437F8FC9A8BDC9CF796"
+RECIPIENT_FP = "DEADBEEFDEADBEEFDEADBEEFDEADBEEFDEADBEEF"
+# A binary encrypted_text frame for RECIPIENT_FP: 12-byte iv, ciphertext "ct".
+BINARY = b"\x01" + bytes.fromhex(RECIPIENT_FP) + b"\x0c" + b"\x00" * 12 + b"ct"
+
+
+class TestBinaryRelay(unittest.TestCase):
+    def test_binary_peers_get_bytes(self):
+        async def run_test():
+            manager = ConnectionManager()
+            sender_ws = await connected(
+                manager, SENDER_FP, subprotocol=BINARY_SUBPROTOCOL
+            )
+            recipient_ws = await connected(
+                manager, RECIPIENT_FP, subprotocol=BINARY_SUBPROTOCOL
             )
+            sender_ws.accept.assert_awaited_once_with(subprotocol=BINARY_SUBPROTOCOL)
+
+            await manager.send_personal_message(BINARY, SENDER_FP, RECIPIENT_FP)
+            await drain(manager)
+
+            delivered = recipient_ws.send_bytes.await_args.args[0]
+            self.assertEqual(delivered[:21], b"\x02" + bytes.fromhex(SENDER_FP))
+            self.assertEqual(delivered[21:], BINARY[21:])
+            echo = sender_ws.send_bytes.await_args.args[0]
+            self.assertEqual(echo[:21], b"\x03" + bytes.fromhex(RECIPIENT_FP))
+            recipient_ws.send_text.assert_not_awaited()
 
         asyncio.run(run_test())
 
+    def test_json_client_gets_binary_frames_as_json(self):
+        async def run_test():
+            manager = ConnectionManager()
+            await connected(manager, SENDER_FP, subprotocol=BINARY_SUBPROTOCOL)
+            recipient_ws = await connected(manager, RECIPIENT_FP)
+
+            await manager.send_personal_message(BINARY, SENDER_FP, RECIPIENT_FP)
+            await drain(manager)
+
+            self.assertEqual(
+                sent(recipient_ws),
+                [
+                    {
+                        "type": "encrypted_text",
+                        "target_user": RECIPIENT_FP,
+                        "content": {"iv": [0] * 12, "ciphertext": list(b"ct")},
+                        "sender": SENDER_FP,
+                    }
+                ],
+            )
+
+        asyncio.run(run_test())
+
+    def test_binary_client_gets_json_frames_as_text(self):
+        async def run_test():
+            manager = ConnectionManager()
+            await connected(manager, SENDER_FP)
+            recipient_ws = await connected(
+                manager, RECIPIENT_FP, subprotocol=BINARY_SUBPROTOCOL
+            )
+
+            await manager.send_personal_message('{"m": 1}', SENDER_FP, RECIPIENT_FP)
+            await drain(manager)
+
+            self.assertEqual(sent(recipient_ws), [{"m": 1, "sender": SENDER_FP}])
+
+        asyncio.run(run_test())
+
+
+class TestWithField(unittest.TestCase):
+    def test_appends_field_to_encoded_object(self):
+        frame = _with_field('{"type": "encrypted_text"} \n', "sender", "A" * 40)
+        self.assertEqual(
+            json.loads(frame), {"type": "encrypted_text", "sender": "A" * 40}
+        )
+
+    def test_overrides_client_supplied_field(self):
+        # A client can't pose as someone else by sending its own "sender".
+        frame = _with_field('{"sender": "spoofed", "m": 1}', "sender", "real")
+        self.assertEqual(json.loads(frame), {"sender": "real", "m": 1})
+
+    def test_payload_text_is_untouched(self):
+        original = '{"content": {"ciphertext": "q83v\\u00e9=="}}'
+        frame = _with_field(original, "recipient", "r")
+        self.assertTrue(frame.startswith(original[:-1]))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,171 @@
+import asyncio
+import sys
+import os
+import unittest
+
+from fastapi import FastAPI, Form, Request, WebSocket
+from fastapi.responses import PlainTextResponse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.middleware import SecurityMiddleware, SECURITY_HEADERS
+
+
+def make_app(max_body_bytes=16):
+    app = FastAPI()
+    app.add_middleware(SecurityMiddleware, max_body_bytes=max_body_bytes)
+
+    @app.get("/")
+    async def index():
+        response = PlainTextResponse("hi")
+        response.headers["X-Frame-Options"] = "SAMEORIGIN"
+        return response
+
+    @app.post("/raw")
+    async def raw(request: Request):
+        return PlainTextResponse(str(len(await request.body())))
+
+    @app.post("/form")
+    async def form(field: str = Form("")):
+        return PlainTextResponse(field)
+
+    @app.websocket("/ws")
+    async def ws(websocket: WebSocket):
+        await websocket.accept()
+        await websocket.close()
+
+    return app
+
+
+def call(app, method="GET", path="/", headers=(), chunks=(b"",)):
+    """Drive one HTTP request through ``app``; return (status, headers, body)."""
+    messages = [
+        {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+        for i, chunk in enumerate(chunks)
+    ]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(k.encode(), v.encode()) for k, v in headers],
+        "client": ("127.0.0.1", 1234),
+        "server": ("testserver", 80),
+    }
+    asyncio.run(app(scope, receive, send))
+    start = sent[0]
+    body = b"".join(m.get("body", b"") for m in sent[1:])
+    header_list = [(k.decode(), v.decode()) for k, v in start["headers"]]
+    return start["status"], header_list, body
+
+
+class TestSecurityHeaders(unittest.TestCase):
+    def test_every_header_added_once(self):
+        status, headers, body = call(make_app())
+        self.assertEqual((status, body), (200, b"hi"))
+        for name, value in SECURITY_HEADERS.items():
+            self.assertEqual(
+                [v for k, v in headers if k == name.lower()], [value], name
+            )
+
+    def test_app_header_is_replaced(self):
+        _, headers, _ = call(make_app())
+        self.assertNotIn(("x-frame-options", "SAMEORIGIN"), headers)
+
+    def test_not_found_still_gets_headers(self):
+        status, headers, _ = call(make_app(), path="/missing")
+        self.assertEqual(status, 404)
+        self.assertIn(("x-content-type-options", "nosniff"), headers)
+
+    def test_websockets_pass_through(self):
+        sent = []
+        incoming = [{"type": "websocket.connect"}]
+
+        async def receive():
+            return incoming.pop(0) if incoming else {"type": "websocket.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {
+            "type": "websocket",
+            "path": "/ws",
+            "raw_path": b"/ws",
+            "query_string": b"",
+            "root_path": "",
+            "headers": [],
+            "scheme": "ws",
+            "server": ("testserver", 80),
+            "subprotocols": [],
+        }
+        asyncio.run(make_app()(scope, receive, send))
+        self.assertEqual(sent[0]["type"], "websocket.accept")
+
+
+class TestBodyLimit(unittest.TestCase):
+    def test_small_body_allowed(self):
+        status, _, body = call(make_app(), "POST", "/raw", chunks=(b"12345",))
+        self.assertEqual((status, body), (200, b"5"))
+
+    def test_declared_oversize_rejected_up_front(self):
+        status, headers, _ = call(
+            make_app(), "POST", "/raw", headers=[("content-length", "17")]
+        )
+        self.assertEqual(status, 413)
+        self.assertIn(("x-frame-options", "DENY"), headers)
+
+    def test_bad_content_length_rejected(self):
+        status, _, _ = call(
+            make_app(), "POST", "/raw", headers=[("content-length", "lots")]
+        )
+        self.assertEqual(status, 400)
+
+    def test_chunked_oversize_rejected(self):
+        # No Content-Length: the limit is enforced on the bytes received.
+        for path in ("/raw", "/form"):
+            with self.subTest(path=path):
+                status, headers, body = call(
+                    make_app(),
+                    "POST",
+                    path,
+                    headers=[("content-type", "application/x-www-form-urlencoded")],
+                    chunks=(b"field=", b"0123456789ab"),
+                )
+                self.assertEqual((status, body), (413, b"Payload too large"))
+                self.assertIn(("x-frame-options", "DENY"), headers)
+
+    def test_understated_content_length_rejected(self):
+        status, _, _ = call(
+            make_app(),
+            "POST",
+            "/raw",
+            headers=[("content-length", "4")],
+            chunks=(b"0123456789", b"0123456789"),
+        )
+        self.assertEqual(status, 413)
+
+    def test_chunked_within_limit_allowed(self):
+        status, _, body = call(
+            make_app(),
+            "POST",
+            "/form",
+            headers=[("content-type", "application/x-www-form-urlencoded")],
+            chunks=(b"field=", b"abc"),
+        )
+        self.assertEqual((status, body), (200, b"abc"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+import sys
+import os
+import unittest
+import warnings
+
+import pgpy
+from pgpy.constants import (
+    EllipticCurveOID,
+    HashAlgorithm,
+    KeyFlags,
+    PubKeyAlgorithm,
+)
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.services import openpgp
+
+
+def new_key(algorithm, size):
+    key = pgpy.PGPKey.new(algorithm, size)
+    key.add_uid(
+        pgpy.PGPUID.new("Test User"),
+        usage={KeyFlags.Sign},
+        hashes=[HashAlgorithm.SHA256],
+    )
+    return key
+
+
+def clearsign(key, text, hash=HashAlgorithm.SHA256):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        signature = key.sign(pgpy.PGPMessage.new(text), hash=hash)
+    return (
+        "-----BEGIN PGP SIGNED MESSAGE-----\n"
+        f"Hash: {hash.name}\n\n{text}\n{signature}"
+    )
+
+
+class TestScanKey(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.rsa = new_key(PubKeyAlgorithm.RSAEncryptOrSign, 2048)
+        cls.rsa.add_subkey(
+            pgpy.PGPKey.new(PubKeyAlgorithm.RSAEncryptOrSign, 2048),
+            usage={KeyFlags.EncryptCommunications},
+        )
+        cls.ed25519 = new_key(PubKeyAlgorithm.EdDSA, EllipticCurveOID.Ed25519)
+
+    def test_rsa_key_matches_pgpy(self):
+        primary, subkeys = openpgp.scan_key(str(self.rsa.pubkey))
+        self.assertEqual(primary.algorithm, PubKeyAlgorithm.RSAEncryptOrSign)
+        self.assertEqual(primary.bits, 2048)
+        self.assertEqual(primary.fingerprint, str(self.rsa.fingerprint))
+        self.assertEqual(primary.key_id, self.rsa.fingerprint.keyid)
+        self.assertEqual([s.key_id for s in subkeys], list(self.rsa.subkeys))
+
+    def test_subkey_binding(self):
+        cert = openpgp.scan_cert(str(self.rsa.pubkey))
+        (subkey,) = cert.subkeys
+        (binding,) = cert.bindings[subkey.key_id]
+        self.assertTrue(openpgp.verify_binding(cert.primary, subkey, binding))
+        # Not a binding of some other key.
+        other = openpgp.scan_key(str(self.ed25519.pubkey))[0]
+        self.assertFalse(openpgp.verify_binding(cert.primary, other, binding))
+
+    def test_eddsa_key_matches_pgpy(self):
+        primary, subkeys = openpgp.scan_key(str(self.ed25519.pubkey))
+        self.assertEqual(primary.algorithm, PubKeyAlgorithm.EdDSA)
+        self.assertIsNone(primary.bits)
+        self.assertEqual(primary.key_id, self.ed25519.fingerprint.keyid)
+        self.assertEqual(subkeys, [])
+
+    def test_armor_headers_and_crlf_tolerated(self):
+        armored = str(self.ed25519.pubkey).replace(
+            "-----\n\n", "-----\nComment: exported\nVersion: test\n\n", 1
+        )
+        primary, _ = openpgp.scan_key(armored.replace("\n", "\r\n"))
+        self.assertEqual(primary.key_id, self.ed25519.fingerprint.keyid)
+
+    def test_old_format_packet_headers(self):
+        body = openpgp.scan_key(str(self.ed25519.pubkey))[0].body
+        # Old-format header: tag 6, two-byte length.
+        data = bytes([0x80 | (6 << 2) | 1]) + len(body).to_bytes(2, "big") + body
+        self.assertEqual(list(openpgp.packets(data)), [(6, body)])
+
+    def test_junk_raises_packet_error(self):
+        for text in (
+            "",
+            "not a key",
+            "-----BEGIN PGP PUBLIC KEY BLOCK-----\n\n!!!!\n-----END PGP PUBLIC KEY BLOCK-----",
+            "-----BEGIN PGP PUBLIC KEY BLOCK-----\n\nAAAA\n-----END PGP PUBLIC KEY BLOCK-----",
+            "-----BEGIN PGP PUBLIC KEY BLOCK-----\n\nxjME",
+        ):
+            with self.assertRaises(openpgp.PacketError, msg=text):
+                openpgp.scan_key(text)
+
+    def test_truncated_packet_raises(self):
+        with self.assertRaises(openpgp.PacketError):
+            list(openpgp.packets(b"\xc6\x33\x04"))
+
+
+class TestScanSignature(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.key = new_key(PubKeyAlgorithm.EdDSA, EllipticCurveOID.Ed25519)
+
+    def test_reads_hash_and_issuer(self):
+        signature = openpgp.scan_signature(clearsign(self.key, "challenge"))
+        self.assertEqual(signature.version, 4)
+        self.assertEqual(signature.sig_type, 0x00)  # Binary document.
+        self.assertEqual(signature.algorithm, PubKeyAlgorithm.EdDSA)
+        self.assertEqual(signature.hash_algorithm, HashAlgorithm.SHA256)
+        self.assertEqual(signature.issuer, self.key.fingerprint.keyid)
+
+    def test_reads_weak_hash(self):
+        signature = openpgp.scan_signature(
+            clearsign(self.key, "challenge", hash=HashAlgorithm.SHA1)
+        )
+        self.assertEqual(signature.hash_algorithm, HashAlgorithm.SHA1)
+
+    def test_missing_signature_raises(self):
+        with self.assertRaises(openpgp.PacketError):
+            openpgp.scan_signature("just the challenge")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,16 @@
+import base64
 import sys
 import os
+import warnings
+from datetime import datetime, timedelta, timezone
 from unittest.mock import patch, MagicMock
 from types import SimpleNamespace
 import unittest
 import pgpy
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from src.services.pgp_verifier import verify_login
+from src.services import openpgp, pgp_verifier
+from src.services.pgp_verifier import verify_login, key_cache
 
 
 class TestPgpVerifier(unittest.TestCase):
@@ -35,6 +39,9 @@ class TestPgpVerifier(unittest.TestCase):
             f"{str(signature)}"
         )
 
+    def tearDown(self):
+        key_cache.clear()
+
     @patch("src.services.pgp_verifier.logging")
     def test_verify_login_success(self, mock_logger):
         public_key_str = str(self.key.pubkey)
@@ -152,6 +159,107 @@ class TestPgpVerifier(unittest.TestCase):
         self.assertFalse(is_valid)
         self.assertIsNone(user_id)
 
+    @patch("src.services.pgp_verifier.logging")
+    def test_prescan_rejects_before_full_parse(self, mock_logger):
+        weak = pgpy.PGPKey.new(pgpy.constants.PubKeyAlgorithm.RSAEncryptOrSign, 1024)
+        with patch("src.services.pgp_verifier.pgpy.PGPKey.from_blob") as from_blob:
+            # Weak key; and a strong key that didn't make this signature.
+            for public_key in (weak.pubkey, self.key.pubkey):
+                clearsigned = (
+                    str(self.clearsigned_message)
+                    if public_key is weak.pubkey
+                    else self._signed_by_other_key()
+                )
+                is_valid, user_id = verify_login(
+                    str(public_key), clearsigned, self.challenge
+                )
+                self.assertFalse(is_valid)
+                self.assertIsNone(user_id)
+            from_blob.assert_not_called()
+
+    def _signed_by_other_key(self):
+        other = pgpy.PGPKey.new(pgpy.constants.PubKeyAlgorithm.RSAEncryptOrSign, 2048)
+        uid = pgpy.PGPUID.new("Other", email="other@user.com")
+        other.add_uid(
+            uid,
+            usage={pgpy.constants.KeyFlags.Sign},
+            hashes=[pgpy.constants.HashAlgorithm.SHA256],
+        )
+        signature = other.sign(pgpy.PGPMessage.new(self.challenge))
+        return (
+            "-----BEGIN PGP SIGNED MESSAGE-----\n"
+            "Hash: SHA256\n\n"
+            f"{self.challenge}\n{str(signature)}"
+        )
+
+    @patch("src.services.pgp_verifier.FAST_PATH", False)
+    @patch("src.services.pgp_verifier.logging")
+    def test_returning_key_is_not_reparsed(self, mock_logger):
+        public_key_str = str(self.key.pubkey)
+        with patch(
+            "src.services.pgp_verifier.pgpy.PGPKey.from_blob",
+            wraps=pgpy.PGPKey.from_blob,
+        ) as from_blob:
+            for challenge in (self.challenge, "wrong-challenge", self.challenge):
+                verify_login(public_key_str, self.clearsigned_message, challenge)
+            # Same key, with the line endings a different client might send.
+            is_valid, user_id = verify_login(
+                public_key_str.replace("\n", "\r\n"),
+                self.clearsigned_message,
+                self.challenge,
+            )
+        self.assertTrue(is_valid)
+        self.assertEqual(user_id, str(self.key.fingerprint))
+        from_blob.assert_called_once()
+
+    @patch("src.services.pgp_verifier.FAST_PATH", False)
+    @patch("src.services.pgp_verifier.logging")
+    def test_policy_rejection_logged_once_per_login(self, mock_logger):
+        weak = pgpy.PGPKey.new(pgpy.constants.PubKeyAlgorithm.RSAEncryptOrSign, 1024)
+        weak.add_uid(
+            pgpy.PGPUID.new("Weak", email="weak@user.com"),
+            usage={pgpy.constants.KeyFlags.Sign},
+            hashes=[pgpy.constants.HashAlgorithm.SHA256],
+        )
+        signature = weak.sign(pgpy.PGPMessage.new(self.challenge))
+        clearsigned = (
+            "-----BEGIN PGP SIGNED MESSAGE-----\n"
+            "Hash: SHA256\n\n"
+            f"{self.challenge}\n{str(signature)}"
+        )
+        errors = mock_logger.getLogger.return_value.error
+
+        # As for input the prescan can't read, leaving the policy to pgpy.
+        with patch.object(pgp_verifier, "_prescan_ok", return_value=True):
+            for _ in range(2):
+                self.assertFalse(
+                    verify_login(str(weak.pubkey), clearsigned, self.challenge)[0]
+                )
+        # The parse gives the reason; the cache hit says it reused the verdict.
+        self.assertEqual(
+            [c.args[0] for c in errors.call_args_list],
+            [
+                "Rejected RSA key smaller than 2048 bits",
+                "Rejected key by its cached policy verdict",
+            ],
+        )
+
+    @patch("src.services.pgp_verifier.FAST_PATH", False)
+    @patch("src.services.pgp_verifier.logging")
+    def test_cached_key_still_checked_for_expiry(self, mock_logger):
+        public_key_str = str(self.key.pubkey)
+        self.assertTrue(
+            verify_login(public_key_str, self.clearsigned_message, self.challenge)[0]
+        )
+        key, _, _ = key_cache.get(public_key_str)
+        with patch.object(
+            type(key), "is_expired", new_callable=lambda: property(lambda k: True)
+        ):
+            is_valid, _ = verify_login(
+                public_key_str, self.clearsigned_message, self.challenge
+            )
+        self.assertFalse(is_valid)
+
 
 class TestPgpPolicyHelpers(unittest.TestCase):
     """Unit tests for the policy gates, independent of full PGP parsing."""
@@ -207,5 +315,263 @@ class TestPgpPolicyHelpers(unittest.TestCase):
         self.assertFalse(self.pv._signature_policy_ok(weak, self.logger))
 
 
+class TestPgpVerifierPgpyBackend(TestPgpVerifier):
+    """The same fixtures, expectations unchanged, with the fast path off."""
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch("src.services.pgp_verifier.FAST_PATH", False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+def _signing_key(algorithm, size, **uid_options):
+    key = pgpy.PGPKey.new(algorithm, size, **uid_options.pop("key_options", {}))
+    key.add_uid(
+        pgpy.PGPUID.new("Diff User", email="diff@user.com"),
+        usage={pgpy.constants.KeyFlags.Sign},
+        hashes=[pgpy.constants.HashAlgorithm.SHA256],
+        **uid_options,
+    )
+    return key
+
+
+def _clearsign(key, text, signer=None, **sign_options):
+    """A pgpy-made cleartext signature (text document, dash-escaped)."""
+    message = pgpy.PGPMessage.new(text, cleartext=True)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        message |= (signer or key).sign(message, **sign_options)
+    return str(message)
+
+
+def _binary_sign(key, text):
+    """The fixture style above: a binary-document signature framed by hand."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        signature = key.sign(pgpy.PGPMessage.new(text))
+    return f"-----BEGIN PGP SIGNED MESSAGE-----\nHash: SHA256\n\n{text}\n{signature}"
+
+
+@patch("src.services.pgp_verifier.logging")
+class TestFastPathAgainstPgpy(unittest.TestCase):
+    """Differential checks: the fast path must agree with pgpy, and decide alone
+    whenever the login is good."""
+
+    @classmethod
+    def setUpClass(cls):
+        constants = pgpy.constants
+        cls.keys = {
+            "rsa2048": _signing_key(constants.PubKeyAlgorithm.RSAEncryptOrSign, 2048),
+            "ed25519": _signing_key(
+                constants.PubKeyAlgorithm.EdDSA, constants.EllipticCurveOID.Ed25519
+            ),
+            "p256": _signing_key(
+                constants.PubKeyAlgorithm.ECDSA, constants.EllipticCurveOID.NIST_P256
+            ),
+            "p384": _signing_key(
+                constants.PubKeyAlgorithm.ECDSA, constants.EllipticCurveOID.NIST_P384
+            ),
+        }
+        cls.challenge = "Verification Challenge: 0b8e6a3c-diff"
+
+    def assert_agree(self, public_key, clearsigned, challenge, expected):
+        results = []
+        for fast in (True, False):
+            key_cache.clear()
+            with patch("src.services.pgp_verifier.FAST_PATH", fast):
+                results.append(verify_login(public_key, clearsigned, challenge))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0][0], expected)
+        return results[0]
+
+    def fast(self, public_key, clearsigned, challenge):
+        clearsigned = clearsigned.replace("\r\n", "\n").strip()
+        return pgp_verifier._fast_verify(
+            pgp_verifier._scan(public_key.strip(), clearsigned),
+            clearsigned,
+            challenge,
+            MagicMock(),
+        )
+
+    def test_login_is_scanned_once(self, mock_logger):
+        key = self.keys["ed25519"]
+        clearsigned = _clearsign(key, self.challenge)
+        with patch.object(openpgp, "dearmor", wraps=openpgp.dearmor) as dearmor:
+            self.assertTrue(
+                verify_login(str(key.pubkey), clearsigned, self.challenge)[0]
+            )
+        # Once for the key block and once for the signature, shared by the
+        # prescan and the fast path.
+        self.assertEqual(dearmor.call_count, 2)
+
+    def test_good_logins_are_decided_by_fast_path(self, mock_logger):
+        for name, key in self.keys.items():
+            for sign in (_clearsign, _binary_sign):
+                with self.subTest(key=name, style=sign.__name__):
+                    public_key = str(key.pubkey)
+                    clearsigned = sign(key, self.challenge)
+                    result = self.assert_agree(
+                        public_key, clearsigned, self.challenge, True
+                    )
+                    self.assertEqual(result[1], str(key.fingerprint))
+                    self.assertEqual(
+                        self.fast(public_key, clearsigned, self.challenge),
+                        str(key.fingerprint),
+                    )
+
+    def test_hash_algorithms(self, mock_logger):
+        key = self.keys["p384"]
+        for hash_algorithm in (
+            pgpy.constants.HashAlgorithm.SHA224,
+            pgpy.constants.HashAlgorithm.SHA384,
+            pgpy.constants.HashAlgorithm.SHA512,
+        ):
+            with self.subTest(hash=hash_algorithm.name):
+                clearsigned = _clearsign(key, self.challenge, hash=hash_algorithm)
+                self.assert_agree(str(key.pubkey), clearsigned, self.challenge, True)
+                self.assertIsNotNone(
+                    self.fast(str(key.pubkey), clearsigned, self.challenge)
+                )
+
+    def test_dash_escaped_multiline_text(self, mock_logger):
+        key = self.keys["ed25519"]
+        text = "- a line that must be dash-escaped\n-----\nlast line"
+        clearsigned = _clearsign(key, text)
+        self.assertIn("- - a line", clearsigned)
+        self.assert_agree(str(key.pubkey), clearsigned, text, True)
+        self.assertIsNotNone(self.fast(str(key.pubkey), clearsigned, text))
+
+    def test_crlf_submission(self, mock_logger):
+        key = self.keys["rsa2048"]
+        clearsigned = _clearsign(key, self.challenge).replace("\n", "\r\n")
+        self.assert_agree(str(key.pubkey), clearsigned, self.challenge, True)
+
+    def test_subkey_signature(self, mock_logger):
+        key = _signing_key(
+            pgpy.constants.PubKeyAlgorithm.EdDSA,
+            pgpy.constants.EllipticCurveOID.Ed25519,
+        )
+        subkey = pgpy.PGPKey.new(
+            pgpy.constants.PubKeyAlgorithm.ECDSA,
+            pgpy.constants.EllipticCurveOID.NIST_P256,
+        )
+        key.add_subkey(subkey, usage={pgpy.constants.KeyFlags.Sign})
+        clearsigned = _clearsign(key, self.challenge, signer=subkey)
+        result = self.assert_agree(str(key.pubkey), clearsigned, self.challenge, True)
+        # Identity is the primary key, whichever key signed.
+        self.assertEqual(result[1], str(key.fingerprint))
+        self.assertEqual(
+            self.fast(str(key.pubkey), clearsigned, self.challenge),
+            str(key.fingerprint),
+        )
+
+    def test_unbound_subkey_cannot_sign(self, mock_logger):
+        # Someone else's key appended as a "subkey", with no binding signature
+        # by the victim's primary, must not sign for the victim.
+        victim, attacker = self.keys["rsa2048"], self.keys["ed25519"]
+        forged = _with_foreign_subkey(str(victim.pubkey), attacker)
+        clearsigned = _clearsign(attacker, self.challenge)
+        self.assert_agree(forged, clearsigned, self.challenge, False)
+        self.assertIsNone(self.fast(forged, clearsigned, self.challenge))
+
+    def test_bad_logins_are_left_to_pgpy(self, mock_logger):
+        for name, key in self.keys.items():
+            with self.subTest(key=name):
+                public_key = str(key.pubkey)
+                clearsigned = _clearsign(key, self.challenge)
+                other = self.keys["p256" if name != "p256" else "ed25519"]
+                cases = {
+                    "wrong challenge": (public_key, clearsigned, "other challenge"),
+                    "tampered text": (
+                        public_key,
+                        clearsigned.replace("0b8e6a3c", "0b8e6a3d"),
+                        self.challenge.replace("0b8e6a3c", "0b8e6a3d"),
+                    ),
+                    "other signer": (
+                        public_key,
+                        _clearsign(other, self.challenge),
+                        self.challenge,
+                    ),
+                    "tampered signature": (
+                        public_key,
+                        _tamper_signature(clearsigned),
+                        self.challenge,
+                    ),
+                }
+                for case, args in cases.items():
+                    with self.subTest(case=case):
+                        self.assert_agree(*args, expected=False)
+                        self.assertIsNone(self.fast(*args))
+
+    def test_key_expiry(self, mock_logger):
+        algorithm = pgpy.constants.PubKeyAlgorithm.EdDSA
+        curve = pgpy.constants.EllipticCurveOID.Ed25519
+        created = datetime.now(timezone.utc) - timedelta(days=2)
+        live = _signing_key(
+            algorithm,
+            curve,
+            key_expiration=timedelta(days=30),
+            key_options={"created": created},
+        )
+        expired = _signing_key(
+            algorithm,
+            curve,
+            key_expiration=timedelta(days=1),
+            key_options={"created": created},
+        )
+        clearsigned = _clearsign(live, self.challenge)
+        self.assert_agree(str(live.pubkey), clearsigned, self.challenge, True)
+        self.assertIsNotNone(self.fast(str(live.pubkey), clearsigned, self.challenge))
+
+        clearsigned = _clearsign(expired, self.challenge)
+        self.assert_agree(str(expired.pubkey), clearsigned, self.challenge, False)
+        self.assertIsNone(self.fast(str(expired.pubkey), clearsigned, self.challenge))
+
+
+def _with_foreign_subkey(public_key, other):
+    # Re-tag ``other``'s primary key packet as a public subkey (tag 14) and
+    # append it to ``public_key``, without any binding signature.
+    data = openpgp.dearmor(public_key, "PUBLIC KEY BLOCK")
+    tag, body = next(
+        openpgp.packets(openpgp.dearmor(str(other.pubkey), "PUBLIC KEY BLOCK"))
+    )
+    assert tag == openpgp.TAG_PUBLIC_KEY and len(body) < 192
+    data += bytes([0xC0 | openpgp.TAG_PUBLIC_SUBKEY, len(body)]) + body
+    crc = base64.b64encode(_crc24(data).to_bytes(3, "big")).decode()
+    return (
+        "-----BEGIN PGP PUBLIC KEY BLOCK-----\n\n"
+        f"{base64.b64encode(data).decode()}\n={crc}\n"
+        "-----END PGP PUBLIC KEY BLOCK-----\n"
+    )
+
+
+def _tamper_signature(clearsigned):
+    # Flip a bit in the final signature MPI, re-armoring (checksum included) so
+    # the result still parses and only the signature itself is wrong.
+    head, armor = clearsigned.split("-----BEGIN PGP SIGNATURE-----\n\n")
+    body = armor.split("\n=")[0].replace("\n", "")
+    data = bytearray(base64.b64decode(body))
+    data[-3] ^= 0x01
+    crc = base64.b64encode(_crc24(data).to_bytes(3, "big")).decode()
+    return (
+        f"{head}-----BEGIN PGP SIGNATURE-----\n\n"
+        f"{base64.b64encode(bytes(data)).decode()}\n={crc}\n"
+        "-----END PGP SIGNATURE-----\n"
+    )
+
+
+def _crc24(data):
+    # RFC 4880 section 6.1.
+    crc = 0xB704CE
+    for byte in data:
+        crc ^= byte << 16
+        for _ in range(8):
+            crc <<= 1
+            if crc & 0x1000000:
+                crc ^= 0x1864CFB
+    return crc & 0xFFFFFF
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,137 @@
+import asyncio
+import sys
+import os
+import time
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.services.presence import PresenceRegistry
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.ops = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __getattr__(self, name):
+        def queue(*args):
+            self.ops.append((name, args))
+
+        return queue
+
+    async def execute(self):
+        return [await getattr(self.redis, name)(*args) for name, args in self.ops]
+
+
+class FakeRedis:
+    def __init__(self):
+        self.hashes = {}
+        self.expires = {}
+        self.reads = 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field] = str(value)
+
+    async def hdel(self, key, field):
+        self.hashes.get(key, {}).pop(field, None)
+
+    async def hgetall(self, key):
+        self.reads += 1
+        return dict(self.hashes.get(key, {}))
+
+    async def expire(self, key, seconds):
+        self.expires[key] = seconds
+
+
+class TestPresenceRegistry(unittest.TestCase):
+    def test_add_claims_user_for_node(self):
+        async def run_test():
+            r = FakeRedis()
+            await PresenceRegistry(r, "node-a").add("u")
+            lookup = PresenceRegistry(r, "node-b")
+            self.assertEqual(await lookup.nodes_for("u"), {"node-a"})
+            self.assertEqual(r.expires["presence:u"], 30)
+
+        asyncio.run(run_test())
+
+    def test_remove_withdraws_claim(self):
+        async def run_test():
+            r = FakeRedis()
+            registry = PresenceRegistry(r, "node-a", cache_ttl=0)
+            await registry.add("u")
+            await registry.remove("u")
+            self.assertEqual(await registry.nodes_for("u"), frozenset())
+
+        asyncio.run(run_test())
+
+    def test_lapsed_claims_ignored(self):
+        async def run_test():
+            r = FakeRedis()
+            # node-a's claim expired (it stopped heartbeating); node-b is live.
+            r.hashes["presence:u"] = {
+                "node-a": str(time.time() - 1),
+                "node-b": str(time.time() + 10),
+            }
+            registry = PresenceRegistry(r, "node-c")
+            self.assertEqual(await registry.nodes_for("u"), {"node-b"})
+
+        asyncio.run(run_test())
+
+    def test_lookups_are_cached_briefly(self):
+        async def run_test():
+            r = FakeRedis()
+            registry = PresenceRegistry(r, "node-a", cache_ttl=5)
+            for _ in range(3):
+                await registry.nodes_for("u")
+            self.assertEqual(r.reads, 1)
+
+            later = time.monotonic() + 6
+            with patch("src.services.presence.time.monotonic", return_value=later):
+                await registry.nodes_for("u")
+            self.assertEqual(r.reads, 2)
+
+        asyncio.run(run_test())
+
+    def test_local_changes_invalidate_cache(self):
+        async def run_test():
+            r = FakeRedis()
+            registry = PresenceRegistry(r, "node-a", cache_ttl=60)
+            self.assertEqual(await registry.nodes_for("u"), frozenset())
+            await registry.add("u")
+            self.assertEqual(await registry.nodes_for("u"), {"node-a"})
+
+        asyncio.run(run_test())
+
+    def test_cache_is_bounded(self):
+        async def run_test():
+            registry = PresenceRegistry(FakeRedis(), "node-a", cache_size=2)
+            for user in ("a", "b", "c"):
+                await registry.nodes_for(user)
+            self.assertEqual(list(registry._cache), ["b", "c"])
+
+        asyncio.run(run_test())
+
+    def test_stop_withdraws_local_claims(self):
+        async def run_test():
+            r = FakeRedis()
+            registry = PresenceRegistry(r, "node-a", cache_ttl=0)
+            await registry.add("u")
+            await registry.start(lambda: ["u"])
+            await registry.stop(["u"])
+            self.assertEqual(await registry.nodes_for("u"), frozenset())
+
+        asyncio.run(run_test())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,43 +1,120 @@
+import asyncio
+import math
 import sys
 import os
 import unittest
 from types import SimpleNamespace
+from unittest.mock import patch
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from redis.exceptions import NoScriptError
 from src.services.rate_limit import (
     is_rate_limited,
     is_globally_rate_limited,
+    is_any_rate_limited,
+    ip_limit,
+    global_limit,
+    load_scripts,
     client_ip,
+    Limit,
+    LocalRateLimiter,
+    FIXED_WINDOW,
+    GCRA,
+    _LIMITER_SHA,
+    _charge,
 )
 
+try:
+    import fakeredis
+    import lupa  # fakeredis runs Lua scripts through it.
+except ImportError:  # Optional; TestLimiterScript is skipped without them.
+    fakeredis = None
+
 
 class FakeRedis:
+    """Emulates the limiter script's semantics in-process."""
+
     def __init__(self):
         self.counts = {}
         self.expires = {}
+        self.tats = {}
+        self.scripts = {_LIMITER_SHA}
+        self.round_trips = 0
+
+    async def script_load(self, script):
+        self.scripts.add(_LIMITER_SHA)
+
+    async def evalsha(self, sha, numkeys, *keys_and_args):
+        if sha not in self.scripts:
+            raise NoScriptError("NOSCRIPT")
+        self.round_trips += 1
+        keys, args = keys_and_args[:numkeys], keys_and_args[numkeys:]
+        now, mode = args[0], args[1]
+        verdicts = []
+        for i, key in enumerate(keys):
+            algorithm, limit, window, burst, admitted, cost = args[
+                2 + 6 * i : 8 + 6 * i
+            ]
+            if algorithm == GCRA:
+                interval = window * 1000 / limit
+                tat = max(self.tats.get(key, now), now) + admitted * interval
+                new_tat = tat + cost * interval
+                over = new_tat - now > burst * interval
+                if not over:
+                    tat = new_tat
+                if tat > now:
+                    self.tats[key] = tat
+                    self.expires[key] = math.ceil(tat - now)
+            else:
+                count = await self.incr(key, admitted + cost)
+                if count == admitted + cost:
+                    await self.expire(key, window + 1)
+                over = count > limit
+            if over and mode == "first":
+                return i + 1
+            verdicts.append(int(over))
+        return verdicts if mode == "each" else 0
 
-    def incr(self, key):
-        self.counts[key] = self.counts.get(key, 0) + 1
+    async def eval(self, script, numkeys, *keys_and_args):
+        self.scripts.add(_LIMITER_SHA)
+        return await self.evalsha(_LIMITER_SHA, numkeys, *keys_and_args)
+
+    async def incr(self, key, amount=1):
+        self.counts[key] = self.counts.get(key, 0) + amount
         return self.counts[key]
 
-    def expire(self, key, seconds):
+    async def expire(self, key, seconds):
         self.expires[key] = seconds
 
 
+def limited(r, ip, scope, limit, window, algorithm=FIXED_WINDOW):
+    return asyncio.run(is_rate_limited(r, ip, scope, limit, window, algorithm))
+
+
+def globally_limited(r, scope, limit, window, algorithm=FIXED_WINDOW):
+    return asyncio.run(is_globally_rate_limited(r, scope, limit, window, algorithm))
+
+
+def admitted_at(r, when, count, algorithm, limit=10, window=60):
+    """How many of ``count`` back-to-back requests at time ``when`` get in."""
+    with patch("src.services.rate_limit.time.time", return_value=when):
+        return sum(
+            not limited(r, "8.8.8.8", "login", limit, window, algorithm)
+            for _ in range(count)
+        )
+
+
 class TestRateLimit(unittest.TestCase):
     def test_public_ip_blocked_past_limit(self):
         r = FakeRedis()
-        allowed = [
-            is_rate_limited(r, "8.8.8.8", "login", limit=3, window=60)
-            for _ in range(3)
-        ]
+        allowed = [limited(r, "8.8.8.8", "login", limit=3, window=60) for _ in range(3)]
         self.assertEqual(allowed, [False, False, False])
-        self.assertTrue(is_rate_limited(r, "8.8.8.8", "login", limit=3, window=60))
+        self.assertTrue(limited(r, "8.8.8.8", "login", limit=3, window=60))
 
     def test_expire_set_once_on_first_hit(self):
         r = FakeRedis()
         for _ in range(5):
-            is_rate_limited(r, "8.8.8.8", "login", limit=10, window=60)
+            limited(r, "8.8.8.8", "login", limit=10, window=60)
         # exactly one key, expiry set near the window
         self.assertEqual(len(r.expires), 1)
         self.assertEqual(next(iter(r.expires.values())), 61)
@@ -45,46 +122,89 @@ class TestRateLimit(unittest.TestCase):
     def test_private_ip_never_limited(self):
         r = FakeRedis()
         for ip in ("10.0.0.5", "192.168.1.9", "127.0.0.1", "172.16.0.1"):
-            results = [
-                is_rate_limited(r, ip, "login", limit=1, window=60) for _ in range(5)
-            ]
+            results = [limited(r, ip, "login", limit=1, window=60) for _ in range(5)]
             self.assertTrue(all(x is False for x in results), ip)
         # private traffic must not even touch Redis
         self.assertEqual(r.counts, {})
 
     def test_unparseable_ip_not_limited(self):
         r = FakeRedis()
-        self.assertFalse(is_rate_limited(r, "unknown", "login", limit=1, window=60))
+        self.assertFalse(limited(r, "unknown", "login", limit=1, window=60))
 
     def test_scopes_are_independent(self):
         r = FakeRedis()
-        self.assertFalse(is_rate_limited(r, "8.8.8.8", "index", limit=1, window=60))
+        self.assertFalse(limited(r, "8.8.8.8", "index", limit=1, window=60))
         # different scope, fresh budget
-        self.assertFalse(is_rate_limited(r, "8.8.8.8", "login", limit=1, window=60))
+        self.assertFalse(limited(r, "8.8.8.8", "login", limit=1, window=60))
 
     def test_global_limit_blocks_past_limit_regardless_of_ip(self):
         r = FakeRedis()
         # No IP argument: this must trip purely on aggregate volume, which is
         # what defends onion traffic that all shares one exempt address.
-        allowed = [
-            is_globally_rate_limited(r, "login", limit=3, window=60)
-            for _ in range(3)
-        ]
+        allowed = [globally_limited(r, "login", limit=3, window=60) for _ in range(3)]
         self.assertEqual(allowed, [False, False, False])
-        self.assertTrue(is_globally_rate_limited(r, "login", limit=3, window=60))
+        self.assertTrue(globally_limited(r, "login", limit=3, window=60))
 
     def test_global_limit_independent_of_per_ip(self):
         r = FakeRedis()
         # Private IPs are exempt from the per-IP limiter but must still count
         # toward the global ceiling.
         for _ in range(2):
-            self.assertFalse(is_rate_limited(r, "127.0.0.1", "login", 1, 60))
-        allowed = [
-            is_globally_rate_limited(r, "login", limit=2, window=60)
-            for _ in range(2)
-        ]
+            self.assertFalse(limited(r, "127.0.0.1", "login", 1, 60))
+        allowed = [globally_limited(r, "login", limit=2, window=60) for _ in range(2)]
         self.assertEqual(allowed, [False, False])
-        self.assertTrue(is_globally_rate_limited(r, "login", limit=2, window=60))
+        self.assertTrue(globally_limited(r, "login", limit=2, window=60))
+
+    def test_multiple_scopes_checked_in_one_round_trip(self):
+        r = FakeRedis()
+        limits = (
+            ip_limit("8.8.8.8", "login", limit=5, window=60),
+            global_limit("login", limit=50, window=60),
+        )
+        self.assertFalse(asyncio.run(is_any_rate_limited(r, *limits)))
+        self.assertEqual(r.round_trips, 1)
+        self.assertEqual(sorted(r.counts.values()), [1, 1])
+
+    def test_rejected_scope_does_not_charge_later_scopes(self):
+        r = FakeRedis()
+        per_ip = ip_limit("8.8.8.8", "login", limit=1, window=60)
+        overall = global_limit("login", limit=50, window=60)
+        self.assertFalse(asyncio.run(is_any_rate_limited(r, per_ip, overall)))
+        self.assertTrue(asyncio.run(is_any_rate_limited(r, per_ip, overall)))
+        self.assertEqual(r.counts[overall.key], 1)
+
+    def test_exempt_ip_scope_skipped(self):
+        r = FakeRedis()
+        limits = (
+            ip_limit("127.0.0.1", "login", limit=1, window=60),
+            global_limit("login", limit=2, window=60),
+        )
+        self.assertIsNone(limits[0])
+        self.assertFalse(asyncio.run(is_any_rate_limited(r, *limits)))
+        self.assertEqual(list(r.counts), [limits[1].key])
+
+    def test_nothing_to_check_skips_redis(self):
+        r = FakeRedis()
+        self.assertFalse(asyncio.run(is_any_rate_limited(r, None)))
+        self.assertEqual(r.round_trips, 0)
+
+    def test_flushed_script_cache_falls_back_to_eval(self):
+        r = FakeRedis()
+        r.scripts.clear()
+        self.assertFalse(limited(r, "8.8.8.8", "login", limit=3, window=60))
+        # EVAL re-cached the script, so the next call is a plain EVALSHA.
+        self.assertIn(_LIMITER_SHA, r.scripts)
+        self.assertFalse(limited(r, "8.8.8.8", "login", limit=3, window=60))
+
+    def test_load_scripts_caches_limiter(self):
+        r = FakeRedis()
+        r.scripts.clear()
+        asyncio.run(load_scripts(r))
+        self.assertIn(_LIMITER_SHA, r.scripts)
+
+    def test_unknown_algorithm_rejected(self):
+        with self.assertRaises(ValueError):
+            global_limit("login", limit=1, window=60, algorithm="leaky")
 
     def test_client_ip_reads_request(self):
         req = SimpleNamespace(client=SimpleNamespace(host="1.2.3.4"))
@@ -94,5 +214,224 @@ class TestRateLimit(unittest.TestCase):
         self.assertEqual(client_ip(SimpleNamespace(client=None)), "unknown")
 
 
+class TestBoundaryBurst(unittest.TestCase):
+    """A full budget just before and just after a window boundary."""
+
+    def test_fixed_window_admits_double_limit_across_boundary(self):
+        r = FakeRedis()
+        before = admitted_at(r, 59.9, 10, FIXED_WINDOW)
+        after = admitted_at(r, 60.1, 10, FIXED_WINDOW)
+        # 20 requests in 0.2s against a limit of 10 per 60s.
+        self.assertEqual(before + after, 20)
+
+    def test_gcra_holds_the_limit_across_boundary(self):
+        r = FakeRedis()
+        before = admitted_at(r, 59.9, 10, GCRA)
+        after = admitted_at(r, 60.1, 10, GCRA)
+        self.assertEqual(before + after, 10)
+
+
+class TestGcra(unittest.TestCase):
+    def test_refills_at_sustained_rate(self):
+        r = FakeRedis()
+        self.assertEqual(admitted_at(r, 1000.0, 11, GCRA), 10)
+        # One request's worth of budget (60s / 10) later, exactly one more fits.
+        self.assertEqual(admitted_at(r, 1006.0, 2, GCRA), 1)
+
+    def test_burst_smooths_back_to_back_requests(self):
+        r = FakeRedis()
+        with patch("src.services.rate_limit.time.time", return_value=1000.0):
+            paced = global_limit("login", limit=300, window=60, algorithm=GCRA, burst=3)
+            results = [asyncio.run(is_any_rate_limited(r, paced)) for _ in range(5)]
+        self.assertEqual(results, [False, False, False, True, True])
+
+    def test_rejection_does_not_extend_penalty(self):
+        r = FakeRedis()
+        admitted_at(r, 1000.0, 10, GCRA)
+        tat = dict(r.tats)
+        admitted_at(r, 1000.0, 5, GCRA)
+        self.assertEqual(r.tats, tat)
+
+    def test_state_is_one_key_with_ttl(self):
+        r = FakeRedis()
+        for when in (0.0, 59.9, 60.1, 3600.0):
+            admitted_at(r, when, 3, GCRA)
+        self.assertEqual(len(r.tats), 1)
+        self.assertEqual(r.counts, {})
+        self.assertTrue(all(ttl > 0 for ttl in r.expires.values()))
+
+
+@unittest.skipUnless(fakeredis, "needs fakeredis[lua] to run the Lua script")
+class TestLimiterScript(unittest.TestCase):
+    """The real limiter script, run by fakeredis, step for step against the
+    FakeRedis copy every other test relies on."""
+
+    FIXED = Limit("rl:login:0", 3, 60)
+    PACED = Limit("rl:gcra:paced", 4, 60, GCRA, 2)
+    GLOBAL = Limit("rl:gcra:global", 10, 60, GCRA)
+    # ms between PACED's requests.
+    INTERVAL = 15_000
+
+    def steps(self):
+        """(ms to advance, limits, admitted, cost, mode) for each charge."""
+        fixed, paced, everyone = self.FIXED, self.PACED, self.GLOBAL
+        for _ in range(5):
+            yield 0, [fixed], [0], 1, "first"
+        for _ in range(3):
+            yield 0, [paced], [0], 1, "first"
+        yield self.INTERVAL, [paced], [0], 1, "first"
+        # Stops at the first scope over its limit, leaving later ones alone.
+        yield 0, [paced, everyone], [0, 0], 1, "first"
+        # Batched hits land whatever the verdict on the new request.
+        yield 0, [everyone, paced, fixed], [4, 2, 1], 1, "each"
+        yield 0, [everyone], [9], 1, "each"
+        yield 0, [everyone], [0], 0, "each"
+        yield 10 * self.INTERVAL, [paced, everyone], [1, 0], 1, "first"
+        yield 10 * self.INTERVAL, [paced, everyone], [0, 0], 2, "each"
+
+    async def state(self, real, model, limit):
+        stored = await real.get(limit.key)
+        if limit.algorithm == GCRA:
+            return float(stored or 0), model.tats.get(limit.key, 0)
+        return int(stored or 0), model.counts.get(limit.key, 0)
+
+    def test_script_matches_python_copy(self):
+        async def run_test():
+            real = fakeredis.FakeAsyncRedis()
+            model = FakeRedis()
+            clock = 1_000_000.0
+            with patch("src.services.rate_limit.time.time", side_effect=lambda: clock):
+                for i, (advance, limits, admitted, cost, mode) in enumerate(
+                    self.steps()
+                ):
+                    clock += advance / 1000
+                    expected = await _charge(model, limits, admitted, cost, mode)
+                    actual = await _charge(real, limits, admitted, cost, mode)
+                    self.assertEqual(actual, expected, f"step {i}")
+                    for limit in limits:
+                        stored, modelled = await self.state(real, model, limit)
+                        self.assertEqual(stored, modelled, f"step {i}: {limit.key}")
+
+        asyncio.run(run_test())
+
+
+class TestLocalRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.r = FakeRedis()
+        self.limiter = LocalRateLimiter(self.r)
+        self.per_ip = ip_limit("8.8.8.8", "login", limit=10, window=60, algorithm=GCRA)
+
+    def is_limited(self, *limits):
+        return asyncio.run(self.limiter.is_limited(*limits))
+
+    def test_clear_accepts_skip_redis(self):
+        # Capacity 10, sync threshold 0.5: the first hits are answered locally.
+        results = [self.is_limited(self.per_ip) for _ in range(5)]
+        self.assertEqual(results, [False] * 5)
+        self.assertEqual(self.r.round_trips, 0)
+
+    def test_flush_charges_accepted_hits_in_one_round_trip(self):
+        other = ip_limit("9.9.9.9", "login", limit=10, window=60, algorithm=GCRA)
+        for _ in range(3):
+            self.is_limited(self.per_ip)
+        self.is_limited(other)
+        asyncio.run(self.limiter.flush())
+        self.assertEqual(self.r.round_trips, 1)
+        # Three requests' worth of TAT for one IP, one for the other.
+        tats = sorted(self.r.tats.values())
+        self.assertEqual(tats[1] - tats[0], 2 * 6000)
+        # Nothing left to charge.
+        asyncio.run(self.limiter.flush())
+        self.assertEqual(self.r.round_trips, 1)
+
+    def test_near_threshold_asks_redis_with_pending_hits(self):
+        results = [self.is_limited(self.per_ip) for _ in range(11)]
+        self.assertEqual(results, [False] * 10 + [True])
+        # Local accepts until half the bucket is gone, then every request is
+        # checked against (and charged to) Redis.
+        self.assertEqual(self.r.round_trips, 5)
+        self.assertEqual(len(self.r.tats), 1)
+
+    def test_empty_bucket_denied_locally(self):
+        for _ in range(11):
+            self.is_limited(self.per_ip)
+        trips = self.r.round_trips
+        self.assertTrue(self.is_limited(self.per_ip))
+        self.assertEqual(self.r.round_trips, trips)
+
+    def test_redis_denial_drains_local_bucket(self):
+        # Another worker has already spent this IP's budget.
+        other_worker = LocalRateLimiter(self.r, sync_threshold=1.0)
+        for _ in range(10):
+            asyncio.run(other_worker.is_limited(self.per_ip))
+        limiter = LocalRateLimiter(self.r, sync_threshold=1.0)
+        self.assertTrue(asyncio.run(limiter.is_limited(self.per_ip)))
+        trips = self.r.round_trips
+        self.assertTrue(asyncio.run(limiter.is_limited(self.per_ip)))
+        self.assertEqual(self.r.round_trips, trips)
+
+    def test_flush_denial_drains_local_bucket(self):
+        self.is_limited(self.per_ip)
+        # Meanwhile the rest of the cluster exhausted the budget.
+        self.r.tats[self.per_ip.key] = 10**15
+        asyncio.run(self.limiter.flush())
+        self.assertTrue(self.is_limited(self.per_ip))
+
+    def test_failed_flush_keeps_pending_hits(self):
+        self.is_limited(self.per_ip)
+        self.r.scripts.clear()
+
+        async def fail(*args):
+            raise ConnectionError("redis down")
+
+        self.r.eval = fail
+        with self.assertRaises(ConnectionError):
+            asyncio.run(self.limiter.flush())
+        del self.r.eval
+        asyncio.run(self.limiter.flush())
+        self.assertEqual(len(self.r.tats), 1)
+
+    def test_hits_admitted_by_another_worker_are_never_dropped(self):
+        # Two workers each accept hits locally; by the time one flushes, the
+        # other has spent the whole budget through Redis.
+        worker_a, worker_b = LocalRateLimiter(self.r), LocalRateLimiter(self.r)
+        with patch("src.services.rate_limit.time.time", return_value=1000.0):
+            admitted = 0
+            for _ in range(5):
+                admitted += not asyncio.run(worker_a.is_limited(self.per_ip))
+            for _ in range(11):
+                admitted += not asyncio.run(worker_b.is_limited(self.per_ip))
+            self.assertEqual(admitted, 15)
+            asyncio.run(worker_a.flush())
+        # All 15 are on the TAT (6 s apart at 10 per minute), not just 10...
+        self.assertEqual(self.r.tats[self.per_ip.key] - 1_000_000, 15 * 6000)
+        # ...so every worker now waits for the overshoot to drain.
+        self.assertTrue(asyncio.run(worker_a.is_limited(self.per_ip)))
+        self.assertTrue(asyncio.run(worker_b.is_limited(self.per_ip)))
+
+    def test_rejected_request_still_charges_pending_hits(self):
+        self.r.tats[self.per_ip.key] = 10**15  # Another worker spent it all.
+        for _ in range(5):
+            self.is_limited(self.per_ip)
+        self.limiter.sync_threshold = 1.0
+        tat = self.r.tats[self.per_ip.key]
+        self.assertTrue(self.is_limited(self.per_ip))
+        # The five admitted locally were charged; the rejected one was not.
+        self.assertEqual(self.r.tats[self.per_ip.key] - tat, 5 * 6000)
+        self.assertEqual(self.limiter._buckets[self.per_ip.key].pending, 0)
+
+    def test_lru_bounded_and_evicted_hits_still_charged(self):
+        limiter = LocalRateLimiter(self.r, max_keys=2)
+        for ip in ("8.8.8.8", "8.8.4.4", "9.9.9.9"):
+            asyncio.run(limiter.is_limited(ip_limit(ip, "index", 60, 60, GCRA)))
+        self.assertEqual(len(limiter._buckets), 2)
+        asyncio.run(limiter.flush())
+        self.assertEqual(len(self.r.tats), 3)
+
+    def test_exempt_scopes_skipped(self):
+        self.assertFalse(self.is_limited(ip_limit("127.0.0.1", "login", 1, 60)))
+        self.assertEqual(self.limiter._buckets, {})
+
+
 if __name__ == "__main__":
     unittest.main()
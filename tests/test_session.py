@@ -5,7 +5,12 @@ import unittest
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from src.services import session
-from src.services.session import sign_user_id, unsign_user_id
+from src.services.session import (
+    sign_user_id,
+    unsign_user_id,
+    sign_challenge,
+    unsign_challenge,
+)
 
 
 class TestSession(unittest.TestCase):
@@ -56,5 +61,43 @@ class TestSession(unittest.TestCase):
         self.assertIsNone(unsign_user_id(token))
 
 
+class TestChallengeTokens(unittest.TestCase):
+    nonce = "a677a007-a410-4071-ba35-ef2a1b18fef1"
+
+    def _signed(self, expires_at: int) -> str:
+        payload = f"{self.nonce}.{expires_at}"
+        return f"{payload}.{session._signature(payload, session._CHALLENGE_KEY)}"
+
+    def test_round_trip(self):
+        self.assertEqual(unsign_challenge(sign_challenge(self.nonce)), self.nonce)
+
+    def test_tampered_nonce_rejected(self):
+        token = sign_challenge(self.nonce)
+        forged = token.replace(self.nonce, "b677a007-a410-4071-ba35-ef2a1b18fef1")
+        self.assertIsNone(unsign_challenge(forged))
+
+    def test_expired_rejected(self):
+        self.assertIsNone(unsign_challenge(self._signed(int(time.time()) - 1)))
+
+    def test_expiry_beyond_lifetime_rejected(self):
+        too_far = int(time.time()) + session.CHALLENGE_LIFETIME + 60
+        self.assertIsNone(unsign_challenge(self._signed(too_far)))
+
+    def test_empty_and_malformed(self):
+        for token in (None, "", "no-dot", ".", f"{self.nonce}."):
+            self.assertIsNone(unsign_challenge(token), token)
+
+    def test_non_ascii_rejected(self):
+        token = sign_challenge(self.nonce)
+        for forged in ("a.1.\u00e9", token + "\u00e9", "\u00e9" + token, "a.1.\udcff"):
+            self.assertIsNone(unsign_challenge(forged), forged)
+            self.assertIsNone(unsign_user_id(forged), forged)
+
+    def test_not_interchangeable_with_session_cookies(self):
+        # Separate derived keys: neither token verifies as the other kind.
+        self.assertIsNone(unsign_user_id(sign_challenge(self.nonce)))
+        self.assertIsNone(unsign_challenge(sign_user_id(self.nonce)))
+
+
 if __name__ == "__main__":
     unittest.main()
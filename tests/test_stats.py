@@ -0,0 +1,67 @@
+import asyncio
+import sys
+import os
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.services.key_cache import KeyCache
+from src.services.manager import ConnectionManager
+from src.stats import StatsReporter
+
+
+class TestStatsReporter(unittest.TestCase):
+    def test_report_logs_each_component(self):
+        key_cache = KeyCache(max_size=4, ttl=60)
+        key_cache.get("missing")
+        reporter = StatsReporter(
+            {"key_cache": key_cache.stats, "chat": ConnectionManager().queue_stats}
+        )
+
+        with self.assertLogs("src.stats") as logs:
+            reporter.report()
+
+        key_cache_line, chat_line = logs.records
+        self.assertEqual(key_cache_line.getMessage(), "Stats")
+        self.assertEqual(key_cache_line.component, "key_cache")
+        self.assertEqual((key_cache_line.hits, key_cache_line.misses), (0, 1))
+        self.assertEqual(chat_line.component, "chat")
+        self.assertEqual((chat_line.connections, chat_line.queued), (0, 0))
+
+    def test_failing_source_does_not_stop_the_others(self):
+        def broken():
+            raise RuntimeError("boom")
+
+        reporter = StatsReporter({"broken": broken, "ok": lambda: {"n": 1}})
+        with self.assertLogs("src.stats") as logs:
+            reporter.report()
+
+        self.assertEqual(
+            [r.getMessage() for r in logs.records],
+            ["Stats for broken failed", "Stats"],
+        )
+        self.assertEqual(logs.records[1].n, 1)
+
+    def test_reports_every_interval(self):
+        async def run_test():
+            reporter = StatsReporter({"ok": lambda: {"n": 1}}, interval=0.01)
+            await reporter.start()
+            with self.assertLogs("src.stats") as logs:
+                await asyncio.sleep(0.05)
+            await reporter.stop()
+            self.assertTrue(all(r.component == "ok" for r in logs.records))
+
+        asyncio.run(run_test())
+
+    def test_zero_interval_disables(self):
+        async def run_test():
+            reporter = StatsReporter({"ok": lambda: {"n": 1}}, interval=0)
+            await reporter.start()
+            with self.assertNoLogs("src.stats"):
+                await asyncio.sleep(0.02)
+            await reporter.stop()
+
+        asyncio.run(run_test())
+
+
+if __name__ == "__main__":
+    unittest.main()
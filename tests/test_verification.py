@@ -0,0 +1,216 @@
+import asyncio
+import sys
+import os
+import socket
+import time
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.services.verification import VerificationPool, VerifierBusy, CLEARNET, ONION
+
+
+def fake_verify(public_key, clearsigned, expected_challenge):
+    # "slow" keys take a while, "hang" keys never finish, "boom" keys crash the
+    # worker process outright; anything else verifies as its own fingerprint.
+    if public_key == "slow":
+        time.sleep(0.3)
+    if public_key == "hang":
+        time.sleep(60)
+    if public_key == "boom":
+        os._exit(1)
+    return clearsigned == expected_challenge, public_key
+
+
+def app_modules(public_key, clearsigned, expected_challenge):
+    # Which of the app's own modules a worker has loaded.
+    app = ("src.main", "src.redis_client", "src.routes")
+    return False, sorted(m for m in sys.modules if m.startswith(app))
+
+
+def pool(**kw):
+    options = dict(workers=1, max_pending=4, timeout=5, func=fake_verify)
+    options.update(kw)
+    return VerificationPool(**options)
+
+
+class TestVerificationPool(unittest.TestCase):
+    def test_verifies_in_worker_process(self):
+        async def run_test():
+            p = pool()
+            try:
+                self.assertEqual(await p.verify("FP", "c", "c"), (True, "FP"))
+                self.assertEqual(await p.verify("FP", "c", "other"), (False, "FP"))
+            finally:
+                await p.stop()
+
+        asyncio.run(run_test())
+
+    def test_sheds_when_queue_full(self):
+        async def run_test():
+            p = pool(max_pending=2)
+            try:
+                jobs = [
+                    asyncio.create_task(p.verify("slow", "c", "c")) for _ in range(2)
+                ]
+                await asyncio.sleep(0)
+                with self.assertRaises(VerifierBusy):
+                    await p.verify("FP", "c", "c")
+                self.assertEqual(await asyncio.gather(*jobs), [(True, "slow")] * 2)
+                # Capacity is released once the queue drains.
+                self.assertEqual(p.pending, 0)
+                self.assertEqual(await p.verify("FP", "c", "c"), (True, "FP"))
+            finally:
+                await p.stop()
+
+        asyncio.run(run_test())
+
+    def test_stuck_job_times_out_and_worker_is_replaced(self):
+        async def run_test():
+            p = pool(timeout=0.5)
+            try:
+                self.assertEqual(await p.verify("hang", "c", "c"), (False, None))
+                # The replacement worker serves the next job promptly.
+                self.assertEqual(await p.verify("FP", "c", "c"), (True, "FP"))
+                self.assertEqual(len(p._all), 1)
+            finally:
+                await p.stop()
+
+        asyncio.run(run_test())
+
+    def test_crashed_worker_fails_closed_and_is_replaced(self):
+        async def run_test():
+            p = pool()
+            try:
+                self.assertEqual(await p.verify("boom", "c", "c"), (False, None))
+                self.assertEqual(await p.verify("FP", "c", "c"), (True, "FP"))
+            finally:
+                await p.stop()
+
+        asyncio.run(run_test())
+
+    def test_replacement_worker_does_not_hold_app_sockets(self):
+        async def run_test():
+            p = pool()
+            try:
+                await p.start()
+                # A client socket the app has open when a worker is replaced.
+                app_end, peer = socket.socketpair()
+                self.assertEqual(await p.verify("boom", "c", "c"), (False, None))
+                self.assertEqual(await p.verify("FP", "c", "c"), (True, "FP"))
+                # Once the app closes it, the peer sees EOF straight away; a
+                # worker holding a copy would keep it open.
+                app_end.close()
+                peer.settimeout(1)
+                self.assertEqual(peer.recv(1), b"")
+                peer.close()
+            finally:
+                await p.stop()
+
+        asyncio.run(run_test())
+
+    def test_workers_do_not_load_the_app(self):
+        # The fork server preloads the verifier, and that must not drag in the
+        # routers, the Redis pool or the app's logging along with it.
+        async def run_test():
+            p = pool(func=app_modules)
+            try:
+                self.assertEqual(await p.verify("FP", "c", "c"), (False, []))
+            finally:
+                await p.stop()
+
+        asyncio.run(run_test())
+
+    def test_cancelled_job_result_never_reaches_next_caller(self):
+        async def run_test():
+            p = pool()
+            try:
+                job = asyncio.create_task(p.verify("slow", "c", "c"))
+                await asyncio.sleep(0.05)
+                job.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await job
+                # Had the worker been reused, this would read "slow"'s result.
+                self.assertEqual(await p.verify("FP", "c", "other"), (False, "FP"))
+            finally:
+                await p.stop()
+
+        asyncio.run(run_test())
+
+
+class TestAdmission(unittest.TestCase):
+    def test_login_that_waits_too_long_is_shed_before_running(self):
+        async def run_test():
+            p = pool(queue_timeout=0.1)
+            try:
+                running = asyncio.create_task(p.verify("slow", "c", "c"))
+                await asyncio.sleep(0)
+                with self.assertRaises(VerifierBusy):
+                    await p.verify("FP", "c", "c")
+                self.assertEqual(await running, (True, "slow"))
+                # Shedding freed its place; the worker is still in service.
+                self.assertEqual(p.pending, 0)
+                self.assertEqual(await p.verify("FP", "c", "c"), (True, "FP"))
+            finally:
+                await p.stop()
+
+        asyncio.run(run_test())
+
+    def test_lanes_take_turns_at_free_workers(self):
+        async def run_test():
+            p = pool(max_pending=8)
+            finished = []
+
+            async def login(key, lane):
+                await p.verify(key, "c", "c", lane)
+                finished.append(key)
+
+            try:
+                jobs = [asyncio.create_task(login("slow", CLEARNET))]
+                await asyncio.sleep(0)
+                # An onion flood queues first; clearnet logins still get every
+                # other worker rather than waiting behind all of it.
+                for key in ("O1", "O2", "O3"):
+                    jobs.append(asyncio.create_task(login(key, ONION)))
+                    await asyncio.sleep(0)
+                for key in ("C1", "C2"):
+                    jobs.append(asyncio.create_task(login(key, CLEARNET)))
+                    await asyncio.sleep(0)
+                await asyncio.gather(*jobs)
+            finally:
+                await p.stop()
+            self.assertEqual(finished, ["slow", "C1", "O1", "C2", "O2", "O3"])
+
+        asyncio.run(run_test())
+
+    def test_full_lane_does_not_shed_the_other(self):
+        async def run_test():
+            p = pool(max_pending=1)
+            try:
+                onion = asyncio.create_task(p.verify("slow", "c", "c", ONION))
+                await asyncio.sleep(0)
+                with self.assertRaises(VerifierBusy):
+                    await p.verify("FP", "c", "c", ONION)
+                self.assertEqual(await p.verify("FP", "c", "c", CLEARNET), (True, "FP"))
+                await onion
+            finally:
+                await p.stop()
+
+        asyncio.run(run_test())
+
+    def test_stop_sheds_queued_logins(self):
+        async def run_test():
+            p = pool()
+            running = asyncio.create_task(p.verify("hang", "c", "c"))
+            queued = asyncio.create_task(p.verify("FP", "c", "c"))
+            await asyncio.sleep(0.05)
+            await p.stop()
+            with self.assertRaises(VerifierBusy):
+                await queued
+            running.cancel()
+            await asyncio.gather(running, return_exceptions=True)
+
+        asyncio.run(run_test())
+
+
+if __name__ == "__main__":
+    unittest.main()